@@ -1,12 +1,38 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import copy
 import datetime
+from decimal import Decimal
+import functools
+import math
+from pathlib import Path
+from types import MappingProxyType
 
-import jinja2
 import requests
 
-from qcpump.core.db import firebirdsql_query, fdb_query, mssql_query
-from qcpump.pumps.base import INT, MULTCHOICE, STRING, BasePump
-from qcpump.pumps.common.qatrack import QATrackFetchAndPost, slugify
+from qcpump.core.db import (
+    MAX_IN_ITEMS,
+    MAX_QUERY_PARAMS,
+    QueryRegistry,
+    QueryStats,
+    batched_query,
+    firebirdsql_query,
+    fdb_query,
+    in_batch_size,
+    mssql_query,
+    query_executor,
+)
+from qcpump.pumps.base import BOOLEAN, FLOAT, INT, MULTCHOICE, STRING, BasePump
+from qcpump.pumps.common.backfill import BackfillCheckpoint, BackfillProgress, date_chunks, parse_date
+from qcpump.pumps.common.json_store import read_json, write_json
+from qcpump.pumps.common.qatrack import (
+    QATrackFetchAndPost,
+    clear_template_caches,
+    render_template,
+    slugify,
+)
+from qcpump.pumps.common.mirror import RowMirror
+from qcpump.pumps.common.windows import WindowTracker
 from qcpump.settings import Settings
 
 HTTP_CREATED = requests.codes['created']
@@ -23,6 +49,8 @@ db_queriers = {
 
 settings = Settings()
 
+query_registry = QueryRegistry(Path(__file__).parent / "queries")
+
 
 QUERY_META = [
     'work_started',
@@ -38,12 +66,125 @@ QUERY_META = [
 ]
 
 
+# files in the pump data directory where the DQA3 machine name -> ID map and
+# the local mirror of trend data are saved
+MACHINE_MAP_FILE = "dqa3_machines.json"
+MIRROR_FILE = "dqa3_mirror.sqlite3"
+
+# column holding the data_key in the trend query for each database type
+DATA_KEY_COLUMNS = {
+    'fdb': 'tr.data_key',
+    'mssql': 'tr.data_key',
+    'atlas': 'data.Dqa3DataId',
+}
+
+# column holding the measurement date/time in the trend query for each database type
+WORK_STARTED_COLUMNS = {
+    'fdb': 'tr.measured_datetime',
+    'mssql': 'tr.measured_datetime',
+    'atlas': 'data.created',
+}
+
+
+@functools.lru_cache(maxsize=128)
+def render_trend_query(
+    db_type, version, n_units, beam_types, query_parameter="?", n_ranges=0, chunk_sizes=(), date_range_end=False,
+    data_key_after=False,
+):
+    """Return the trend query for the given database type & version with
+    enough placeholders for n_units and beam_types.  n_ranges and chunk_sizes
+    add NOT BETWEEN and NOT IN (...) predicates for excluding data_keys that
+    have already been uploaded (see data_key_exclusions). If date_range_end
+    is True, an extra placeholder is added for the (exclusive) end of the date
+    range to fetch and if data_key_after is True, a placeholder is added for
+    only fetching data_keys greater than a given key. Rendered queries are cached so that the same query string
+    is reused on every pump cycle."""
+    template = query_registry.get(db_type, "trend.sql", version=version)
+    unit_placeholders = ','.join(query_parameter for __ in range(n_units))
+    beam_type_placeholders = ','.join(query_parameter for __ in beam_types)
+
+    column = DATA_KEY_COLUMNS[db_type]
+    exclusions = [f"AND {column} > {query_parameter}"] if data_key_after else []
+    exclusions += [f"AND {column} NOT BETWEEN {query_parameter} AND {query_parameter}" for __ in range(n_ranges)]
+    for chunk_size in chunk_sizes:
+        placeholders = ','.join(query_parameter for __ in range(chunk_size))
+        exclusions.append(f"AND {column} NOT IN ({placeholders})")
+
+    end = f"AND {WORK_STARTED_COLUMNS[db_type]} < {query_parameter}" if date_range_end else ""
+
+    return template.format(
+        units=unit_placeholders,
+        beam_types=beam_type_placeholders,
+        date_range_end=end,
+        exclude_data_keys="\n    ".join(exclusions),
+    )
+
+
+def data_key_exclusions(data_keys, max_params):
+    """Summarize data_keys (most recent first) as a list of (low, high) ranges
+    of consecutive integer keys and a list of chunks of individual keys using
+    at most max_params query parameters. Keys which don't fit are left out (in
+    which case they will be checked against the QATrack+ API as usual)."""
+
+    int_keys = sorted((k for k in data_keys if isinstance(k, int)), reverse=True)
+    other_keys = [k for k in data_keys if not isinstance(k, int)]
+
+    runs = []
+    for key in int_keys:
+        if runs and runs[-1][0] == key + 1:
+            runs[-1][0] = key
+        else:
+            runs.append([key, key])
+
+    ranges = []
+    singles = []
+    budget = max(max_params, 0)
+    for low, high in runs:
+        if high - low >= 2 and budget >= 2:
+            ranges.append((low, high))
+            budget -= 2
+        elif high - low < 2:
+            keys = list(range(high, low - 1, -1))[:budget]
+            singles.extend(keys)
+            budget -= len(keys)
+
+    singles.extend(other_keys[:budget])
+    chunks = [singles[i:i + MAX_IN_ITEMS] for i in range(0, len(singles), MAX_IN_ITEMS)]
+    return ranges, chunks
+
+
+def test_slug(column, beam_name):
+    """Return the QATrack+ test slug for a DQA3 result column & beam name
+    (slugify caches slugs so this is cheap for previously seen names)"""
+    return slugify(f"{column}_{beam_name}")
+
+
+def clean_number(value):
+    """Convert NaN or infinite values (which can't be uploaded as JSON) to None"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, Decimal):
+        return value if value.is_finite() else None
+    return value
+
+
+def data_key_param(data_key):
+    """id_for_record converts data_keys to strings. Convert them back to ints
+    where possible so they can be used as query parameters"""
+    if isinstance(data_key, str) and data_key.isdigit():
+        return int(data_key)
+    return data_key
+
+
 class BaseDQA3:
 
     HELP_URL = "https://qcpump.readthedocs.io/en/stable/pumps/dqa3.html"
 
     query_parameter = "?"
 
+    # stop waiting for the small queries used to validate the configuration after this many seconds
+    validation_query_timeout = 60
+
     TEST_LIST_CONFIG = {
         'name': "Test List",
         'multiple': False,
@@ -84,17 +225,120 @@ class BaseDQA3:
         ],
     }
 
+    MIRROR_CONFIG = {
+        'name': 'Mirror',
+        'multiple': False,
+        'dependencies': ["DQA3Reader"],
+        'fields': [
+            {
+                'name': 'enabled',
+                'type': BOOLEAN,
+                'required': False,
+                'default': False,
+                'help': (
+                    "Enable to keep a local SQLite copy of the DQA3 trend data in the pump's configuration "
+                    "directory. Only new data is queried from the DQA3 database and uploads are read from "
+                    "the local copy, which can also be used for ad-hoc queries."
+                ),
+            },
+        ],
+    }
+
+    BACKFILL_CONFIG = {
+        'name': 'Backfill',
+        'multiple': False,
+        'dependencies': ["DQA3Reader", 'QATrack+ API'],
+        'validation': 'validate_backfill',
+        'fields': [
+            {
+                'name': 'enabled',
+                'type': BOOLEAN,
+                'required': False,
+                'default': False,
+                'help': (
+                    "Enable to import historical data from before the History Days window. Backfilling "
+                    "runs after new data has been pumped and resumes where it left off if interrupted."
+                ),
+            },
+            {
+                'name': 'start date',
+                'type': STRING,
+                'required': False,
+                'default': "",
+                'help': "Enter the date (YYYY-MM-DD) you want to start importing historical data from",
+            },
+            {
+                'name': 'chunk days',
+                'type': INT,
+                'required': False,
+                'default': 7,
+                'help': "Enter the number of days of data to fetch with each backfill query",
+                'validation': {
+                    'min': 1,
+                    'max': 365,
+                },
+            },
+            {
+                'name': 'chunks per run',
+                'type': INT,
+                'required': False,
+                'default': 4,
+                'help': "Enter the maximum number of chunks to backfill each time the pump runs",
+                'validation': {
+                    'min': 1,
+                    'max': 100,
+                },
+            },
+            {
+                'name': 'workers',
+                'type': INT,
+                'required': False,
+                'default': 2,
+                'help': "Enter the number of chunks to query from the DQA3 database at the same time",
+                'validation': {
+                    'min': 1,
+                    'max': 8,
+                },
+            },
+            {
+                'name': 'throttle',
+                'type': FLOAT,
+                'required': False,
+                'default': 1,
+                'help': (
+                    "Enter the minimum interval between backfill data uploads. Use a larger value than "
+                    "the QATrack+ API throttle to limit the load on your QATrack+ instance."
+                ),
+                'validation': {
+                    'min': 0,
+                    'max': 60,
+                },
+            },
+        ],
+    }
+
     def __init__(self, *args, **kwargs):
 
         self.db_version = None
         self.dqa_machine_name_to_id = {}
+        # machine_id -> QATrack+ unit name snapshot taken at the start of each pump run
+        self.unit_map_snapshot = None
+        # local copy of trend data (if enabled)
+        self.mirror = None
+        # machine_id -> {data_key: work_started} for data known to be in QATrack+
+        self.uploaded_data_keys = defaultdict(dict)
+        self.query_stats = QueryStats(warn=lambda msg: self.log_warning(msg))
         super().__init__(*args, **kwargs)
 
     @property
     def querier(self):
+        return self.get_querier(self.get_config_value("DQA3Reader", "driver"))
+
+    def get_querier(self, driver):
+        """Return the query function for our database type & the input driver name"""
         if self.db_type in ["mssql", "atlas"]:
             return db_queriers[self.db_type]
-        return db_queriers[self.get_config_value("DQA3Reader", "driver")]
+        return db_queriers[driver]
 
     def validate_test_list(self, values):
         name = values['name'].replace(" ", "")
@@ -105,9 +349,31 @@ class BaseDQA3:
                 '\n"Daily QA3 Results: {{ energy }}{{ beam_type }}{{ wedge_type }}{{ wedge_angle }}"'
             )
             return False, msg
+        clear_template_caches()
         return True, "OK"
 
     def validate_dqa3reader(self, values):
+        errors = self.dqa3reader_field_errors(values)
+
+        self.db_version = None
+        if not errors:
+            connect_kwargs = self.db_connect_kwargs()
+
+            try:
+                self.db_version = self.query_db_version(self.querier, connect_kwargs)
+
+                if query_registry.has(self.db_type, "trend.sql", version=self.db_version):
+                    return True, f"Successful connection (DB version: {self.db_version})"
+                else:
+                    errors.append(f"Unknown database type/version={self.db_type}/{self.db_version}")
+
+            except Exception as e:
+                errors.append(str(e))
+
+        return False, '\n'.join(errors)
+
+    def dqa3reader_field_errors(self, values):
+        """Return a list of error messages for any missing DQA3Reader connection fields"""
         errors = []
         host = values['host']
         if not host:
@@ -126,27 +392,15 @@ class BaseDQA3:
         if not database:
             errors.append("Please set the name of the database")
 
-        self.db_version = None
-        self.dqa3_trend_query = ""
-        if not errors:
-            connect_kwargs = self.db_connect_kwargs()
-
-            version_query = (self.get_pump_path() / "queries" / self.db_type / "db_version.sql").read_text()
-            try:
-                self.db_version = self.querier(connect_kwargs, version_query)[0][0]
-                self.db_version = '.'.join(self.db_version.split(".")[:2])
+        return errors
 
-                trend_query_path = self.get_pump_path() / "queries" / self.db_type / self.db_version / "trend.sql"
-                if trend_query_path.is_file():
-                    self.dqa3_trend_query = trend_query_path.read_text()
-                    return True, f"Successful connection (DB version: {self.db_version})"
-                else:
-                    errors.append(f"Unknown database type/version={self.db_type}/{self.db_version}")
-
-            except Exception as e:
-                errors.append(str(e))
-
-        return False, '\n'.join(errors)
+    def query_db_version(self, querier, connect_kwargs):
+        """Query the database for its version and return it in major.minor form"""
+        version_query = query_registry.get(self.db_type, "db_version.sql")
+        db_version = query_executor.submit(
+            querier, connect_kwargs, version_query, timeout=self.validation_query_timeout, kill_event=self.kill_event,
+        ).result()[0][0]
+        return '.'.join(db_version.split(".")[:2])
 
     def validate_units(self, values):
         self.log_debug(f"Validating units {values}")
@@ -155,9 +409,22 @@ class BaseDQA3:
             return False, "Please complete both the DQA3 Name and QATrack+ Unit Name settings"
         return True, "OK"
 
-    def db_connect_kwargs(self):
+    def validate_backfill(self, values):
+        if not values['enabled']:
+            return True, "Backfill disabled"
+
+        try:
+            start_date = parse_date(values['start date'] or "")
+        except ValueError:
+            return False, "Please enter a backfill start date in the format YYYY-MM-DD"
+
+        if start_date >= self.min_date:
+            return True, "OK (start date is within the History Days window so there is nothing to backfill)"
+        return True, "OK"
+
+    def db_connect_kwargs(self, config=None):
 
-        config = self.get_config_values('DQA3Reader')[0]
+        config = config or self.get_config_values('DQA3Reader')[0]
 
         base_kwargs = {
             'host': config['host'],
@@ -190,8 +457,11 @@ class BaseDQA3:
         results = []
         connect_kwargs = self.db_connect_kwargs()
         try:
-            uquery = (self.get_pump_path() / "queries" / self.db_type / self.db_version / "machines.sql").read_text()
-            q_results = self.querier(connect_kwargs, uquery, fetch_method="fetchallmap")
+            uquery = query_registry.get(self.db_type, "machines.sql", version=self.db_version)
+            q_results = query_executor.submit(
+                self.querier, connect_kwargs, uquery, fetch_method="fetchallmap", stats=self.query_stats,
+                timeout=self.validation_query_timeout, kill_event=self.kill_event,
+            ).result()
             for row in q_results:
                 name = self.dqa3_machine_to_name(row)
                 self.dqa_machine_name_to_id[name] = row['machine_id']
@@ -199,9 +469,37 @@ class BaseDQA3:
             self.log_debug(f"Found Units {', '.join(results)}")
         except Exception as e:
             self.log_error(f"Querying units resulted in an error: {e}")
+        else:
+            self.save_machine_map()
 
         return results
 
+    def machine_map_state(self):
+        """Return the DQA3 machine name/ID data to be persisted between runs of QCPump"""
+        return {'machines': self.dqa_machine_name_to_id}
+
+    def restore_machine_map(self, state):
+        self.dqa_machine_name_to_id = dict(state['machines'])
+
+    def save_machine_map(self):
+        """Write the DQA3 machine name -> ID map to disk so that units can be
+        mapped on startup without having to query the DQA3 database first"""
+        path = self.get_pump_data_path(MACHINE_MAP_FILE)
+        try:
+            write_json(path, self.machine_map_state())
+        except (OSError, TypeError, ValueError) as e:
+            self.log_warning(f"Unable to save DQA3 machine map to {path}: {e}")
+
+    def load_machine_map(self):
+        """Restore the DQA3 machine name -> ID map saved by save_machine_map"""
+        path = self.get_pump_data_path(MACHINE_MAP_FILE)
+        try:
+            self.restore_machine_map(read_json(path))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            self.log_warning(f"Unable to load DQA3 machine map from {path}: {e}")
+
     def dqa3_machine_to_name(self, row):
         name = f"{row['room_name']}/" if row['room_name'] else ""
         name += f"{row['machine_name']}"
@@ -213,7 +511,30 @@ class BaseDQA3:
 
     @property
     def unit_map(self):
-        return {self.dqa_machine_name_to_id[u['dqa3 name']]: u['unit name'] for u in self.get_config_values("Unit")}
+        """DQA3 machine ID -> QATrack+ unit name. During a pump run this is the
+        snapshot taken when the run started"""
+        if self.unit_map_snapshot is not None:
+            return self.unit_map_snapshot
+        return self.build_unit_map()
+
+    def build_unit_map(self):
+        """Return an immutable map of DQA3 machine ID -> QATrack+ unit name for
+        all configured units. If any of the DQA3 machine names are unknown
+        (e.g. QCPump has just been started) the saved machine map is loaded"""
+
+        units = self.get_config_values("Unit")
+        if any(u['dqa3 name'] not in self.dqa_machine_name_to_id for u in units):
+            self.load_machine_map()
+
+        unit_map = {}
+        for u in units:
+            machine_id = self.dqa_machine_name_to_id.get(u['dqa3 name'])
+            if machine_id is None:
+                self.log_warning(f"Unknown DQA3 machine '{u['dqa3 name']}'. Data for this unit will not be pumped.")
+                continue
+            unit_map[machine_id] = u['unit name']
+
+        return MappingProxyType(unit_map)
 
     def qatrack_unit_for_record(self, record):
         return self.unit_map[record['machine_id']]
@@ -235,34 +556,268 @@ class BaseDQA3:
     def min_date(self):
         return datetime.datetime.now().date() - datetime.timedelta(days=self.history_days)
 
+    def pump(self):
+        self.unit_map_snapshot = self.build_unit_map()
+        self.mirror = self.open_mirror()
+        try:
+            super().pump()
+            if self.get_config_value("Backfill", "enabled") and not self.should_terminate():
+                self.backfill()
+        finally:
+            self.unit_map_snapshot = None
+
+    def open_mirror(self):
+        """Return the local trend data mirror (or None if the mirror is disabled)"""
+
+        if not self.get_config_value("Mirror", "enabled"):
+            return None
+
+        mirror = self.mirror
+        try:
+            if mirror is None:
+                mirror = RowMirror(self.get_pump_data_path(MIRROR_FILE), stats=self.query_stats)
+                self.log_info(f"Mirroring DQA3 trend data to {mirror.path}")
+            mirror.check_config(self.mirror_config())
+            mirror.prune(self.mirror_min_date())
+        except Exception as e:
+            self.log_error(f"Unable to open the DQA3 mirror: {e}")
+            return None
+        return mirror
+
+    def mirror_config(self):
+        """Settings which determine which rows are fetched from the DQA3 database"""
+        return {'db type': self.db_type, 'beam types': self.get_included_beam_types()}
+
+    def mirror_min_date(self):
+        """Mirrored rows from before this date are outside the history window and can be dropped"""
+        return self.min_date
+
+    def backfill(self):
+        """Import historical data from the backfill start date up to the start
+        of the regular history window.  The date range is split into chunks
+        which are queried concurrently and then uploaded in order, with a
+        checkpoint saved after each chunk so an interrupted backfill resumes
+        where it left off. The checkpoint is never advanced past a chunk which
+        couldn't be queried or had records fail to upload, so those chunks are
+        retried on the next run."""
+
+        config = self.get_config_values("Backfill")[0]
+        try:
+            start_date = parse_date(config['start date'] or "")
+        except ValueError:
+            self.log_error(f"Invalid backfill start date '{config['start date']}'")
+            return
+
+        end_date = self.min_date
+        checkpoint = BackfillCheckpoint(self.get_pump_data_path("dqa3_backfill.json"))
+        completed = checkpoint.load(start_date)
+        done_chunks = len(date_chunks(start_date, completed, config['chunk days']))
+        chunks = date_chunks(completed, end_date, config['chunk days'])
+        if not chunks:
+            self.log_debug(f"Backfill from {start_date} complete")
+            return
+
+        progress = BackfillProgress(done_chunks + len(chunks), done_chunks)
+        chunks = chunks[:config['chunks per run']]
+        self.log_info(f"Backfilling {len(chunks)} chunks from {chunks[0][0]} to {chunks[-1][1]}")
+
+        executor = ThreadPoolExecutor(max_workers=config['workers'], thread_name_prefix="qcpump-backfill")
+        futures = [
+            executor.submit(self.fetch_rows, chunk_start, chunk_end, raise_errors=True)
+            for chunk_start, chunk_end in chunks
+        ]
+        try:
+            for (chunk_start, chunk_end), future in zip(chunks, futures):
+                if self.should_terminate():
+                    return
+
+                try:
+                    rows = future.result()
+                except Exception:
+                    # error logged by fetch_upstream_rows
+                    self.log_warning(f"Backfill will be retried from {chunk_start} on the next run")
+                    return
+
+                records = self.records_from_rows(rows)
+                uploaded, failed = self.upload_records(records, config['throttle'])
+                if uploaded is None:
+                    return
+
+                if failed:
+                    self.log_warning(
+                        f"Failed to backfill {len(failed)} records from {chunk_start} to {chunk_end}: "
+                        f"{', '.join(failed)}. Backfill will be retried from {chunk_start} on the next run"
+                    )
+                    return
+
+                checkpoint.save(start_date, chunk_end)
+                progress.chunk_complete()
+                self.update_progress(progress.percent, progress.message(chunk_end))
+        finally:
+            # don't wait for queries of chunks we won't get to on this run
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def records_from_rows(self, rows):
+        """Convert rows fetched for a backfill chunk into records for uploading"""
+        return rows
+
     def fetch_records(self):
+        return self.fetch_rows()
+
+    def fetch_rows(self, min_date=None, max_date=None, raise_errors=False):
+        """Fetch trend rows from min_date (default self.min_date) up to
+        max_date (default no limit). If the local mirror is enabled, newly
+        fetched rows are added to the mirror and the rows which haven't been
+        uploaded yet are read back from it. Database errors are logged and
+        either re-raised (if raise_errors is True) or treated as no rows."""
+
+        rows = self.fetch_upstream_rows(min_date, max_date, raise_errors)
+        if self.mirror is None:
+            return rows
+
         try:
-            query, params = self.prepare_dqa3_query()
-            rows = self.querier(self.db_connect_kwargs(), query, params=params, fetch_method="fetchallmap")
+            self.mirror.add(rows, advance_watermarks=max_date is None)
+            return self.mirrored_rows(min_date, max_date)
+        except Exception as e:
+            self.log_error(f"Reading rows from the DQA3 mirror {self.mirror.path} failed: {e}")
+            return rows
+
+    def mirrored_rows(self, min_date=None, max_date=None):
+        return self.mirror.rows(list(self.unit_map), min_date or self.min_date, max_date)
+
+    def fetch_upstream_rows(self, min_date=None, max_date=None, raise_errors=False):
+        """Query the DQA3 database for trend rows"""
+        try:
+            # units are split over multiple queries if there are too many for a single IN (...) list
+            units = list(self.unit_map.keys())
+            batch_size = in_batch_size(self.db_type, 3 + len(self.get_included_beam_types()))
+            prepare = self.prepare_dqa3_query
+            if min_date or max_date:
+                prepare = functools.partial(prepare, min_date=min_date, max_date=max_date)
+            rows = batched_query(
+                self.querier,
+                self.db_connect_kwargs(),
+                prepare,
+                units,
+                batch_size,
+                key="data_key",
+                fetch_method="fetchallmap",
+                stats=self.query_stats,
+                executor=query_executor,
+                kill_event=self.kill_event,
+            )
+            self.log_debug(f"Queried {self.db_type} db ({self.query_stats.last}). Last {self.query_stats}")
         except Exception as e:
-            rows = []
             self.log_critical(f"Failed to query {self.db_type} db in pump: {e}")
+            if raise_errors:
+                raise
+            rows = []
 
         return rows
 
-    def prepare_dqa3_query(self):
+    def prepare_dqa3_query(self, units=None, min_date=None, max_date=None):
 
-        # create enough ? placeholders for configured units
-        units = list(self.unit_map.keys())
-        unit_placeholders = ','.join(self.query_parameter for __ in units)
+        # query has enough placeholders for configured units & beam types
+        units = list(self.unit_map.keys()) if units is None else list(units)
         beam_types = self.get_included_beam_types()
-        beam_type_placeholders = ','.join(self.query_parameter for __ in beam_types)
-        q = self.dqa3_trend_query.format(units=unit_placeholders, beam_types=beam_type_placeholders)
-        return q, [self.min_date] + units + beam_types
+        min_date = min_date or self.min_date
+        return self.render_query(self.db_version, min_date, units, beam_types, max_date=max_date)
+
+    def render_query(self, db_version, min_date, units, beam_types, machine_ids=None, max_date=None):
+        """Return the trend query & params for the input units and beam types,
+        excluding any data_keys for machine_ids (units by default) that have
+        already been uploaded or mirrored"""
+        machine_ids = units if machine_ids is None else machine_ids
+        params = [min_date] + units + beam_types
+        if max_date:
+            params.append(max_date)
+
+        # only rows newer than those already in the mirror need to be fetched
+        data_key_after = None
+        if self.mirror is not None and not max_date:
+            data_key_after = self.mirror.watermark(machine_ids)
+        if data_key_after is not None:
+            params.append(data_key_after)
+
+        data_keys = self.excluded_data_keys(machine_ids, min_date, max_date)
+        if data_key_after is not None:
+            data_keys = [k for k in data_keys if not isinstance(k, int) or k > data_key_after]
+        max_params = MAX_QUERY_PARAMS[self.db_type] - len(params)
+        ranges, chunks = data_key_exclusions(data_keys, max_params)
+        n_excluded = sum(high - low + 1 for low, high in ranges) + sum(len(c) for c in chunks)
+        if n_excluded < len(data_keys):
+            self.log_debug(f"Only excluding {n_excluded} of {len(data_keys)} uploaded data keys from query")
+
+        q = render_trend_query(
+            self.db_type,
+            db_version,
+            len(units),
+            tuple(beam_types),
+            self.query_parameter,
+            n_ranges=len(ranges),
+            chunk_sizes=tuple(len(c) for c in chunks),
+            date_range_end=bool(max_date),
+            data_key_after=data_key_after is not None,
+        )
+        for low, high in ranges:
+            params.extend([low, high])
+        for chunk in chunks:
+            params.extend(chunk)
+        return q, params
+
+    def excluded_data_keys(self, machine_ids, min_date, max_date=None):
+        """Return uploaded data_keys for the input machines (most recent
+        first) acquired before max_date, forgetting any which are now outside
+        of the history window"""
+        if not isinstance(min_date, datetime.datetime):
+            min_date = datetime.datetime.combine(min_date, datetime.time())
+        if max_date and not isinstance(max_date, datetime.datetime):
+            max_date = datetime.datetime.combine(max_date, datetime.time())
+
+        keys = []
+        for machine_id in machine_ids:
+            machine_keys = self.uploaded_data_keys.get(machine_id, {})
+            for data_key, work_started in list(machine_keys.items()):
+                if work_started < min_date:
+                    del machine_keys[data_key]
+                elif max_date is None or work_started < max_date:
+                    keys.append((work_started, data_key))
+        keys.sort(key=lambda k: k[0], reverse=True)
+        return [data_key for __, data_key in keys]
+
+    def rows_for_record(self, record):
+        return [record]
+
+    def remember_uploaded(self, record):
+        rows = self.rows_for_record(record)
+        for row in rows:
+            self.uploaded_data_keys[row['machine_id']][data_key_param(row['data_key'])] = row['work_started']
+
+        if self.mirror is not None:
+            try:
+                self.mirror.mark_uploaded(rows)
+            except Exception as e:
+                self.log_error(f"Updating the DQA3 mirror {self.mirror.path} failed: {e}")
+
+    def _is_already_recorded(self, record):
+        recorded = super()._is_already_recorded(record)
+        if recorded:
+            self.remember_uploaded(record)
+        return recorded
 
-    def get_included_beam_types(self):
+    def post_process(self, record):
+        super().post_process(record)
+        self.remember_uploaded(record)
+
+    def get_included_beam_types(self, config=None):
         return ["Photon", "Electron", "FFF"]
 
     def test_list_for_record(self, record):
         beam_params = self.beam_params_for_row(record)
         tl_name_template = self.get_config_value("Test List", "name")
-        template = jinja2.Template(tl_name_template, undefined=jinja2.StrictUndefined)
-        return template.render(beam_params)
+        return render_template(tl_name_template, tuple(sorted(beam_params.items())))
 
     def beam_params_for_row(self, row):
 
@@ -399,6 +954,8 @@ class FirebirdDQA3(BaseDQA3, QATrackFetchAndPost, BasePump):
         QATrackFetchAndPost.QATRACK_API_CONFIG,
         BaseDQA3.TEST_LIST_CONFIG,
         BaseDQA3.UNIT_CONFIG,
+        BaseDQA3.MIRROR_CONFIG,
+        BaseDQA3.BACKFILL_CONFIG,
     ]
 
 
@@ -494,6 +1051,8 @@ class SQLServerDQA3(BaseDQA3, QATrackFetchAndPost, BasePump):
         QATrackFetchAndPost.QATRACK_API_CONFIG,
         BaseDQA3.TEST_LIST_CONFIG,
         BaseDQA3.UNIT_CONFIG,
+        BaseDQA3.MIRROR_CONFIG,
+        BaseDQA3.BACKFILL_CONFIG,
     ]
 
 
@@ -588,49 +1147,61 @@ class AtlasDQA3(BaseDQA3, QATrackFetchAndPost, BasePump):
         QATrackFetchAndPost.QATRACK_API_CONFIG,
         BaseDQA3.TEST_LIST_CONFIG,
         BaseDQA3.UNIT_CONFIG,
+        BaseDQA3.MIRROR_CONFIG,
+        BaseDQA3.BACKFILL_CONFIG,
     ]
 
 
-def group_by_machine_dates(rows, window_minutes):
-    """Group input meta data records by serial number and date/time window"""
-    machine_groups = group_by_machine(rows)
-    grouped = {}
-    for machine, machine_group in machine_groups.items():
-        grouped[machine] = group_by_dates(machine_group, window_minutes)
+def machine_date_key(row):
+    return row['machine_id'], row['work_started']
 
-    return grouped
 
+def iter_machine_date_windows(rows, window_minutes):
+    """Group input data records, which must already be ordered by
+    (machine_id, work_started), into date/time windows in a single pass.
+    Yields (machine_id, window_key, rows, max_work_started) for each window as
+    soon as it is complete"""
 
-def group_by_machine(rows):
-    """Group input records by machine names"""
-    grouped = defaultdict(list)
-    for row in rows:
-        grouped[row['machine_id']].append(row)
-    return grouped
+    window = datetime.timedelta(minutes=window_minutes)
+    cur_machine = cur_window = cur_window_key = cur_date = None
+    cur_rows = []
 
+    for row in rows:
+        machine, date = row['machine_id'], row['work_started']
+        if cur_rows and (machine != cur_machine or date > cur_window):
+            window_key = date.strftime(DATE_GROUP_FMT)
+            if machine != cur_machine or window_key != cur_window_key:
+                yield cur_machine, cur_window_key, cur_rows, cur_date
+                cur_rows = []
+            else:
+                cur_window = date + window
 
-def group_by_dates(rows, window_minutes):
-    """Group input data records by date"""
+        if not cur_rows:
+            cur_machine = machine
+            cur_window = date + window
+            cur_window_key = date.strftime(DATE_GROUP_FMT)
 
-    sorted_by_date = list(sorted(rows, key=lambda m: m['work_started']))
+        cur_rows.append(row)
+        cur_date = date
 
-    cur_date = sorted_by_date[0]['work_started']
-    cur_window = cur_date + datetime.timedelta(minutes=window_minutes)
-    cur_window_key = cur_date.strftime(DATE_GROUP_FMT)
+    if cur_rows:
+        yield cur_machine, cur_window_key, cur_rows, cur_date
 
-    grouped = defaultdict(list)
-    for row in sorted_by_date:
-        cur_date = row['work_started']
-        if cur_date > cur_window:
-            cur_window = cur_date + datetime.timedelta(minutes=window_minutes)
-            cur_window_key = cur_date.strftime(DATE_GROUP_FMT)
-        grouped[cur_window_key].append(row)
 
+def group_by_machine_dates(rows, window_minutes):
+    """Group input data records by machine and date/time window"""
+    grouped = defaultdict(dict)
+    rows = sorted(rows, key=machine_date_key)
+    for machine, window_key, window_rows, __ in iter_machine_date_windows(rows, window_minutes):
+        grouped[machine][window_key] = window_rows
     return grouped
 
 
 class BaseGroupedDQA3(BaseDQA3):
 
+    # config section holding the grouping window & wait time fields
+    grouping_section = "DQA3Reader"
+
     TEST_LIST_CONFIG = {
         'name': "Test List",
         'multiple': False,
@@ -647,14 +1218,18 @@ class BaseGroupedDQA3(BaseDQA3):
         ]
     }
 
+    def __init__(self, *args, **kwargs):
+        self.window_tracker = WindowTracker()
+        super().__init__(*args, **kwargs)
+
     def validate_test_list(self, values):
         name = values['name'].strip()
         if not name:
             return False, "You must set a test list name"
         return True, "OK"
 
-    def get_included_beam_types(self):
-        beam_types = self.get_config_value('DQA3Reader', 'beam types')
+    def get_included_beam_types(self, config=None):
+        beam_types = config['beam types'] if config else self.get_config_value('DQA3Reader', 'beam types')
         if "photon" in beam_types.lower():
             return ["Photon", "FFF"]
         elif "electron" in beam_types.lower():
@@ -662,34 +1237,39 @@ class BaseGroupedDQA3(BaseDQA3):
         return ["Photon", "FFF", "Electron"]
 
     def fetch_records(self):
-        records = super().fetch_records()
-        grouped = self.group_records(records)
-        filtered = self.filter_records(grouped)
-        return filtered
-
-    def group_records(self, rows):
-        minutes = self.get_config_value('DQA3Reader', 'grouping window')
-        results_groups = []
-        for machine, date_groups in group_by_machine_dates(rows, minutes).items():
-            for date_group, grouped in date_groups.items():
-                results_groups.append((machine, date_group, grouped))
-        return results_groups
-
-    def filter_records(self, records):
-        """Remove any groups which are not older than N minutes. This allows us
-        to wait until all beam results are written to disk before uploading"""
-
-        now = datetime.datetime.now()
-        cutoff_delta = datetime.timedelta(minutes=self.get_config_value("DQA3Reader", "wait time"))
-        filtered = []
-        for record in records:
-            machine, date, rows = record
-            max_date = sorted(rows, key=lambda m: m['work_started'], reverse=True)[0]['work_started']
-            cutoff = max_date + cutoff_delta
-            if cutoff <= now:
-                filtered.append(record)
-
-        return filtered
+        """Add any newly fetched rows to their machine & date/time windows and
+        return the windows which are older than N minutes. This allows us to
+        wait until all beam results are written to disk before uploading"""
+
+        rows = super().fetch_records()
+
+        minutes = self.get_config_value(self.grouping_section, 'grouping window')
+        wait_minutes = self.get_config_value(self.grouping_section, "wait time")
+        self.window_tracker.check_config((tuple(self.unit_map), minutes))
+
+        for row in sorted(rows, key=machine_date_key):
+            member_key = (row['machine_id'], row['data_key'])
+            self.window_tracker.add(row['machine_id'], row['work_started'], member_key, row, minutes)
+
+        self.window_tracker.prune(datetime.datetime.combine(self.min_date, datetime.time()))
+        return self.window_tracker.flush(wait_minutes)
+
+    def records_from_rows(self, rows):
+        """Group backfilled rows directly into machine & date/time windows.
+        Historical data is complete so there is no need to wait for more beams
+        to be acquired"""
+        minutes = self.get_config_value(self.grouping_section, 'grouping window')
+        rows = sorted(rows, key=machine_date_key)
+        windows = iter_machine_date_windows(rows, minutes)
+        return [(machine, key, window_rows) for machine, key, window_rows, __ in windows]
+
+    def remember_uploaded(self, record):
+        super().remember_uploaded(record)
+        machine_id, date, rows = record
+        self.window_tracker.done(machine_id, date)
+
+    def rows_for_record(self, record):
+        return record[2]
 
     def id_for_record(self, record):
         machine_id, date, rows = record
@@ -716,8 +1296,8 @@ class BaseGroupedDQA3(BaseDQA3):
                 if k in QUERY_META:
                     continue
 
-                slug = slugify(f"{k}_{slug_postfix}")
-                test_vals[slug] = {'value': v}
+                slug = test_slug(k, slug_postfix)
+                test_vals[slug] = {'value': clean_number(v)}
 
         return test_vals
 
@@ -861,6 +1441,8 @@ class FirebirdGroupedDQA3(BaseGroupedDQA3, QATrackFetchAndPost, BasePump):
         QATrackFetchAndPost.QATRACK_API_CONFIG,
         BaseGroupedDQA3.TEST_LIST_CONFIG,
         BaseDQA3.UNIT_CONFIG,
+        BaseDQA3.MIRROR_CONFIG,
+        BaseDQA3.BACKFILL_CONFIG,
     ]
 
 
@@ -983,6 +1565,8 @@ class SQLServerGroupedDQA3(BaseGroupedDQA3, QATrackFetchAndPost, BasePump):
         QATrackFetchAndPost.QATRACK_API_CONFIG,
         BaseGroupedDQA3.TEST_LIST_CONFIG,
         BaseDQA3.UNIT_CONFIG,
+        BaseDQA3.MIRROR_CONFIG,
+        BaseDQA3.BACKFILL_CONFIG,
     ]
 
 
@@ -1104,4 +1688,292 @@ class AtlasGroupedDQA3(BaseGroupedDQA3, QATrackFetchAndPost, BasePump):
         QATrackFetchAndPost.QATRACK_API_CONFIG,
         BaseGroupedDQA3.TEST_LIST_CONFIG,
         BaseDQA3.UNIT_CONFIG,
+        BaseDQA3.MIRROR_CONFIG,
+        BaseDQA3.BACKFILL_CONFIG,
     ]
+
+
+SOURCE_NAME_FIELD = {
+    'name': 'source name',
+    'label': 'Source Name',
+    'type': STRING,
+    'required': True,
+    'help': (
+        "Enter a short, unique name for this database (e.g. 'Clinic A'). It is used to "
+        "identify this databases units and must not be changed once data has been uploaded."
+    ),
+}
+
+
+GROUPING_FIELDS = ['grouping window', 'wait time']
+
+
+def multiple_database_config(config):
+    """Convert a DQA3 pump CONFIG into one where multiple DQA3Reader databases
+    can be configured. The grouping fields apply to all databases so they are
+    moved to a separate (non multiple) Grouping section"""
+    config = copy.deepcopy(config)
+    reader_config = config[0]
+    reader_config['multiple'] = True
+    reader_config['fields'].insert(0, SOURCE_NAME_FIELD)
+
+    grouping_fields = [f for f in reader_config['fields'] if f['name'] in GROUPING_FIELDS]
+    if grouping_fields:
+        reader_config['fields'] = [f for f in reader_config['fields'] if f['name'] not in GROUPING_FIELDS]
+        config.insert(1, {
+            'name': 'Grouping',
+            'multiple': False,
+            'fields': grouping_fields,
+        })
+    return config
+
+
+class BaseMultiDatabaseDQA3(BaseDQA3):
+    """DQA3 pumps which read from multiple DQA3 databases (all of the same
+    database type) and upload all of the results via a single pump. The
+    databases are queried concurrently and their rows merged into a single
+    record stream.
+
+    DQA3 machine ID's are only unique within a single database so machine
+    ID's are namespaced by the database source name (e.g. "Clinic A/3").
+    """
+
+    # maximum number of databases that will be queried at the same time
+    MAX_QUERY_WORKERS = 4
+
+    def __init__(self, *args, **kwargs):
+        self.db_versions = {}
+        self.dqa_machine_sources = {}
+        super().__init__(*args, **kwargs)
+
+    def validate_dqa3reader(self, values):
+        errors = self.dqa3reader_field_errors(values)
+
+        name = (values.get('source name') or "").strip()
+        if not name:
+            errors.append("Please set a source name for this database")
+        elif self.source_names().count(name) > 1:
+            errors.append(f"The source name '{name}' is used by more than one database")
+
+        self.db_versions.pop(name, None)
+        if not errors:
+            try:
+                db_version = self.query_db_version(self.get_querier(values['driver']), self.db_connect_kwargs(values))
+                if query_registry.has(self.db_type, "trend.sql", version=db_version):
+                    self.db_versions[name] = db_version
+                    return True, f"Successful connection to {name} (DB version: {db_version})"
+                errors.append(f"Unknown database type/version={self.db_type}/{db_version}")
+            except Exception as e:
+                errors.append(str(e))
+
+        return False, '\n'.join(errors)
+
+    @property
+    def history_days(self):
+        """Longest history window of all the configured databases"""
+        return max(c['history days'] for c in self.get_config_values("DQA3Reader"))
+
+    def source_names(self):
+        return [(c.get('source name') or "").strip() for c in self.get_config_values("DQA3Reader")]
+
+    def namespaced_machine_id(self, source_name, machine_id):
+        return f"{source_name}/{machine_id}"
+
+    def get_source_configs(self):
+        """Return the DQA3Reader configs which have been successfully validated"""
+        return [c for c in self.get_config_values("DQA3Reader") if c['source name'].strip() in self.db_versions]
+
+    def map_sources(self, func, configs):
+        """Call func(config) for each of the input configs concurrently and return a list of the results"""
+        if not configs:
+            return []
+        max_workers = min(len(configs), self.MAX_QUERY_WORKERS)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="qcpump-dqa3") as executor:
+            return list(executor.map(func, configs))
+
+    def get_dqa3_unit_choices(self):
+        self.log_debug("Fetching DQA3 unit choices")
+        configs = self.get_source_configs()
+        if not configs:
+            self.log_debug("No valid databases configured yet. Units can not be retrieved.")
+            return []
+
+        name_to_id = {}
+        machine_sources = {}
+        results = []
+        for config, rows in zip(configs, self.map_sources(self.query_source_machines, configs)):
+            source_name = config['source name'].strip()
+            for row in rows:
+                name = f"{source_name}: {self.dqa3_machine_to_name(row)}"
+                machine_id = self.namespaced_machine_id(source_name, row['machine_id'])
+                name_to_id[name] = machine_id
+                machine_sources[machine_id] = (source_name, row['machine_id'])
+                results.append(name)
+
+        self.dqa_machine_name_to_id = name_to_id
+        self.dqa_machine_sources = machine_sources
+        self.log_debug(f"Found Units {', '.join(results)}")
+        self.save_machine_map()
+        return results
+
+    def query_source_machines(self, config):
+        source_name = config['source name'].strip()
+        try:
+            uquery = query_registry.get(self.db_type, "machines.sql", version=self.db_versions[source_name])
+            querier = self.get_querier(config['driver'])
+            return query_executor.submit(
+                querier, self.db_connect_kwargs(config), uquery, fetch_method="fetchallmap", stats=self.query_stats,
+                timeout=self.validation_query_timeout, kill_event=self.kill_event,
+            ).result()
+        except Exception as e:
+            self.log_error(f"Querying units from {source_name} resulted in an error: {e}")
+            return []
+
+    def fetch_upstream_rows(self, min_date=None, max_date=None, raise_errors=False):
+        fetch = functools.partial(
+            self.fetch_source_records, min_date=min_date, max_date=max_date, raise_errors=raise_errors,
+        )
+        rows = []
+        for source_rows in self.map_sources(fetch, self.get_source_configs()):
+            rows.extend(source_rows)
+        rows.sort(key=lambda r: r['work_started'])
+        return rows
+
+    def fetch_source_records(self, config, min_date=None, max_date=None, raise_errors=False):
+        source_name = config['source name'].strip()
+        try:
+            units = self.source_units(source_name)
+            if not units:
+                self.log_debug(f"No units configured for {source_name}")
+                return []
+            batch_size = in_batch_size(self.db_type, 3 + len(self.get_included_beam_types(config)))
+            rows = batched_query(
+                self.get_querier(config['driver']),
+                self.db_connect_kwargs(config),
+                functools.partial(self.prepare_source_query, config, min_date=min_date, max_date=max_date),
+                units,
+                batch_size,
+                key="data_key",
+                fetch_method="fetchallmap",
+                stats=self.query_stats,
+                executor=query_executor,
+                kill_event=self.kill_event,
+            )
+            self.log_debug(f"Queried {source_name} ({len(rows)} rows)")
+        except Exception as e:
+            self.log_critical(f"Failed to query {self.db_type} db {source_name} in pump: {e}")
+            if raise_errors:
+                raise
+            return []
+
+        for row in rows:
+            row['machine_id'] = self.namespaced_machine_id(source_name, row['machine_id'])
+        return rows
+
+    def mirrored_rows(self, min_date=None, max_date=None):
+        """Read mirrored rows using the history window of each database"""
+        rows = []
+        for config in self.get_source_configs():
+            source_name = config['source name'].strip()
+            machine_ids = [self.namespaced_machine_id(source_name, unit) for unit in self.source_units(source_name)]
+            source_min_date = min_date or self.source_min_date(config)
+            rows.extend(self.mirror.rows(machine_ids, source_min_date, max_date))
+        rows.sort(key=lambda r: r['work_started'])
+        return rows
+
+    def mirror_config(self):
+        return {
+            'db type': self.db_type,
+            'beam types': {
+                c['source name'].strip(): self.get_included_beam_types(c) for c in self.get_source_configs()
+            },
+        }
+
+    def mirror_min_date(self):
+        today = datetime.datetime.now().date()
+        return min((self.source_min_date(c) for c in self.get_source_configs()), default=today)
+
+    def source_min_date(self, config):
+        return datetime.datetime.now().date() - datetime.timedelta(days=config['history days'])
+
+    def machine_map_state(self):
+        state = super().machine_map_state()
+        state['sources'] = self.dqa_machine_sources
+        return state
+
+    def restore_machine_map(self, state):
+        super().restore_machine_map(state)
+        self.dqa_machine_sources = {machine_id: tuple(source) for machine_id, source in state['sources'].items()}
+
+    def source_units(self, source_name):
+        """Return the (un-namespaced) DQA3 machine ID's configured for source_name"""
+        return [
+            self.dqa_machine_sources[machine_id][1] for machine_id in self.unit_map
+            if self.dqa_machine_sources.get(machine_id, (None,))[0] == source_name
+        ]
+
+    def prepare_source_query(self, config, units=None, min_date=None, max_date=None):
+        """Return the trend query & params for a single database. Query will be
+        None if there are no units configured for this database"""
+        source_name = config['source name'].strip()
+        units = self.source_units(source_name) if units is None else list(units)
+        if not units:
+            return None, []
+
+        beam_types = self.get_included_beam_types(config)
+        if min_date is None:
+            min_date = self.source_min_date(config)
+        machine_ids = [self.namespaced_machine_id(source_name, unit) for unit in units]
+        return self.render_query(
+            self.db_versions[source_name], min_date, units, beam_types, machine_ids=machine_ids, max_date=max_date,
+        )
+
+
+class FirebirdMultiDatabaseDQA3(BaseMultiDatabaseDQA3, QATrackFetchAndPost, BasePump):
+
+    DISPLAY_NAME = "DQA3: Firebird: One Beam Per Test List (Multiple Databases)"
+
+    query_parameter = "?"
+    db_type = "fdb"
+
+    db_kwargs_to_connect_kwargs = FirebirdDQA3.db_kwargs_to_connect_kwargs
+
+    CONFIG = multiple_database_config(FirebirdDQA3.CONFIG)
+
+
+class AtlasMultiDatabaseDQA3(BaseMultiDatabaseDQA3, QATrackFetchAndPost, BasePump):
+
+    DISPLAY_NAME = "DQA3: Atlas: One Beam Per Test List (Multiple Databases)"
+
+    query_parameter = "?"
+    db_type = "atlas"
+
+    db_kwargs_to_connect_kwargs = AtlasDQA3.db_kwargs_to_connect_kwargs
+
+    CONFIG = multiple_database_config(AtlasDQA3.CONFIG)
+
+
+class FirebirdMultiDatabaseGroupedDQA3(BaseGroupedDQA3, BaseMultiDatabaseDQA3, QATrackFetchAndPost, BasePump):
+
+    DISPLAY_NAME = "DQA3: Firebird: Multiple Beams Per Test List (Multiple Databases)"
+
+    query_parameter = "?"
+    db_type = "fdb"
+    grouping_section = "Grouping"
+
+    db_kwargs_to_connect_kwargs = FirebirdGroupedDQA3.db_kwargs_to_connect_kwargs
+
+    CONFIG = multiple_database_config(FirebirdGroupedDQA3.CONFIG)
+
+
+class AtlasMultiDatabaseGroupedDQA3(BaseGroupedDQA3, BaseMultiDatabaseDQA3, QATrackFetchAndPost, BasePump):
+
+    DISPLAY_NAME = "DQA3: Atlas: Multiple Beams Per Test List (Multiple Databases)"
+
+    query_parameter = "?"
+    db_type = "atlas"
+    grouping_section = "Grouping"
+
+    db_kwargs_to_connect_kwargs = AtlasGroupedDQA3.db_kwargs_to_connect_kwargs
+
+    CONFIG = multiple_database_config(AtlasGroupedDQA3.CONFIG)
@@ -76,4 +76,6 @@ WHERE
     data.created >= ?
     AND mach.MachineId IN ({units})
     AND energy.BEAMTYPE IN ({beam_types})
+    {date_range_end}
+    {exclude_data_keys}
 ORDER BY data.created asc;
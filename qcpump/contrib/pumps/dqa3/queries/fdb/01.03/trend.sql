@@ -74,4 +74,6 @@ WHERE
     tr.measured_datetime >= ?
     AND mach.mach_key IN ({units})
     AND template.beamtype IN ({beam_types})
+    {date_range_end}
+    {exclude_data_keys}
 ORDER BY tr.data_key asc;
@@ -1,5 +1,6 @@
 from collections import defaultdict
 import datetime
+from decimal import Decimal
 from unittest import mock
 
 import pytest
@@ -86,7 +87,7 @@ class TestDQA3:
         }
         pump = self.get_pump(dqa3pump.AtlasDQA3)
 
-        def fail(*args):
+        def fail(*args, **kwargs):
             raise Exception("some failure")
 
         with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.querier", side_effect=fail):
@@ -124,9 +125,10 @@ class TestDQA3:
         pump = self.get_pump(dqa3pump.AtlasDQA3)
         assert pump.get_dqa3_unit_choices() == []
 
-    def test_get_dqa3_unit_choices(self):
+    def test_get_dqa3_unit_choices(self, tmp_path):
         pump = self.get_pump(dqa3pump.AtlasDQA3)
         pump.db_version = "1.5"
+        pump.get_pump_data_path = mock.Mock(return_value=tmp_path / dqa3pump.MACHINE_MAP_FILE)
 
         return_val = [
             {'machine_id': 1, 'machine_name': 'Unit 1', 'room_name': "Room 1"},
@@ -139,6 +141,42 @@ class TestDQA3:
                 expected = ["Room 1/Unit 1", "Room 2/Unit 2", "Unit 3"]
                 assert pump.get_dqa3_unit_choices() == expected
 
+    def test_unit_map_loads_saved_machines(self, tmp_path):
+        pump = self.get_pump(dqa3pump.AtlasDQA3)
+        pump.get_pump_data_path = mock.Mock(return_value=tmp_path / dqa3pump.MACHINE_MAP_FILE)
+        pump.dqa_machine_name_to_id = {"Room 1/Unit 1": 1}
+        pump.save_machine_map()
+
+        pump = self.get_pump(dqa3pump.AtlasDQA3)
+        pump.get_pump_data_path = mock.Mock(return_value=tmp_path / dqa3pump.MACHINE_MAP_FILE)
+        units = [
+            {'dqa3 name': "Room 1/Unit 1", 'unit name': "Unit A"},
+            {'dqa3 name': "Room 2/Unit 2", 'unit name': "Unit B"},
+        ]
+        with mock.patch.object(pump, "get_config_values", return_value=units):
+            unit_map = pump.unit_map
+        assert unit_map == {1: "Unit A"}
+        assert "Unknown DQA3 machine 'Room 2/Unit 2'" in pump.log.call_args[0][1]
+        with pytest.raises(TypeError):
+            unit_map[2] = "Unit B"
+
+    def test_unit_map_snapshot(self):
+        pump = self.get_pump(dqa3pump.AtlasDQA3)
+        pump.dqa_machine_name_to_id = {"Room 1/Unit 1": 1}
+        units = [{'dqa3 name': "Room 1/Unit 1", 'unit name': "Unit A"}]
+        get_config_values = mock.Mock(return_value=units)
+
+        def pump_records(self):
+            assert pump.unit_map is pump.unit_map
+            assert pump.qatrack_unit_for_record({'machine_id': 1}) == "Unit A"
+
+        with mock.patch.object(pump, "get_config_values", get_config_values):
+            with mock.patch.object(pump, "get_config_value", return_value=False):
+                with mock.patch("qcpump.pumps.common.qatrack.QATrackFetchAndPost.pump", pump_records):
+                    pump.pump()
+        assert get_config_values.call_count == 1
+        assert pump.unit_map_snapshot is None
+
     def test_get_dqa3_unit_choices_fail(self):
         pump = self.get_pump(dqa3pump.AtlasDQA3)
         pump.db_version = "1.5"
@@ -221,8 +259,10 @@ class TestDQA3:
         with mock.patch.object(pump, "prepare_dqa3_query", return_value=["", []]):
             with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.querier", return_value=[{'some': 'results'}]):
                 with mock.patch.object(pump, "db_connect_kwargs"):
-                    records = pump.fetch_records()
-                    assert records == [{'some': 'results'}]
+                    with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.unit_map", new_callable=mock.PropertyMock) as mock_unit_map:  # noqa: E501
+                        mock_unit_map.return_value = {1: 'unit 1'}
+                        records = pump.fetch_records()
+                        assert records == [{'some': 'results'}]
 
     def test_fetch_records_fails(self):
         pump = self.get_pump(dqa3pump.AtlasDQA3)
@@ -237,8 +277,7 @@ class TestDQA3:
 
         now = datetime.datetime.now()
         pump = self.get_pump(dqa3pump.AtlasDQA3)
-        trend_query_path = pump.get_pump_path() / "queries" / "atlas" / "1.5" / "trend.sql"
-        pump.dqa3_trend_query = trend_query_path.read_text()
+        pump.db_version = "1.5"
         with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.unit_map", new_callable=mock.PropertyMock) as mock_unit_map:  # noqa: E501
             mock_unit_map.return_value = {'dqa unit 1': 'unit 1', 'dqa unit 2': 'unit 2'}
             with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.min_date", new_callable=mock.PropertyMock) as mock_min_date:  # noqa: E501
@@ -248,6 +287,230 @@ class TestDQA3:
                 assert "mach.MachineId IN (?,?)" in q
                 assert params == [now, "dqa unit 1", "dqa unit 2", "Photon", "Electron", "FFF"]
 
+    def test_render_trend_query_cached(self):
+        q1 = dqa3pump.render_trend_query("fdb", "01.04", 2, ("Photon", "FFF"))
+        q2 = dqa3pump.render_trend_query("fdb", "01.04", 2, ("Photon", "FFF"))
+        assert q1 is q2
+        assert "mach.mach_key IN (?,?)" in q1
+        assert "template.beamtype IN (?,?)" in q1
+
+    def test_query_registry_versions(self):
+        assert dqa3pump.query_registry.versions("fdb") == ["01.03", "01.04"]
+
+    def test_data_key_exclusions(self):
+        ranges, chunks = dqa3pump.data_key_exclusions([10, 9, 8, 7, 5, 3, 2, "abc"], 100)
+        assert ranges == [(7, 10)]
+        assert chunks == [[5, 3, 2, "abc"]]
+
+    def test_data_key_exclusions_max_params(self):
+        ranges, chunks = dqa3pump.data_key_exclusions([10, 9, 8, 6, 4, 2], 4)
+        assert ranges == [(8, 10)]
+        assert chunks == [[6, 4]]
+
+    def test_data_key_exclusions_chunked(self):
+        keys = list(range(0, 5000, 2))
+        max_params = dqa3pump.MAX_QUERY_PARAMS['mssql']
+        ranges, chunks = dqa3pump.data_key_exclusions(keys, max_params)
+        assert ranges == []
+        assert [len(c) for c in chunks] == [dqa3pump.MAX_IN_ITEMS, max_params - dqa3pump.MAX_IN_ITEMS]
+
+    def test_prepare_dqa3_query_excludes_uploaded(self):
+        now = datetime.datetime.now()
+        pump = self.get_pump(dqa3pump.FirebirdDQA3)
+        pump.db_version = "01.04"
+        pump.post_process({'data_key': '1', 'machine_id': 1, 'work_started': now})
+        pump.post_process({'data_key': '2', 'machine_id': 1, 'work_started': now})
+        pump.post_process({'data_key': '3', 'machine_id': 1, 'work_started': now})
+        pump.post_process({'data_key': '5', 'machine_id': 1, 'work_started': now})
+        pump.post_process({'data_key': '6', 'machine_id': 2, 'work_started': now})
+        pump.post_process({'data_key': '7', 'machine_id': 1, 'work_started': now - datetime.timedelta(days=10)})
+        with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.unit_map", new_callable=mock.PropertyMock) as mock_unit_map:  # noqa: E501
+            mock_unit_map.return_value = {1: 'unit 1'}
+            with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.min_date", new_callable=mock.PropertyMock) as mock_min_date:  # noqa: E501
+                mock_min_date.return_value = now.date() - datetime.timedelta(days=1)
+                q, params = pump.prepare_dqa3_query()
+        assert "AND tr.data_key NOT BETWEEN ? AND ?" in q
+        assert "AND tr.data_key NOT IN (?)" in q
+        assert params[1:] == [1, "Photon", "Electron", "FFF", 1, 3, 5]
+        assert 7 not in pump.uploaded_data_keys[1]
+
+    def test_prepare_dqa3_query_date_range(self):
+        now = datetime.datetime.now()
+        pump = self.get_pump(dqa3pump.FirebirdDQA3)
+        pump.db_version = "01.04"
+        pump.post_process({'data_key': '1', 'machine_id': 1, 'work_started': now - datetime.timedelta(days=5)})
+        pump.post_process({'data_key': '2', 'machine_id': 1, 'work_started': now})
+        min_date = now.date() - datetime.timedelta(days=7)
+        max_date = now.date() - datetime.timedelta(days=1)
+        with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.unit_map", new_callable=mock.PropertyMock) as mock_unit_map:  # noqa: E501
+            mock_unit_map.return_value = {1: 'unit 1'}
+            q, params = pump.prepare_dqa3_query(min_date=min_date, max_date=max_date)
+        assert "AND tr.measured_datetime < ?" in q
+        assert params == [min_date, 1, "Photon", "Electron", "FFF", max_date, 1]
+        # keys outside of the date range are not excluded but are still remembered
+        assert 2 in pump.uploaded_data_keys[1]
+
+    def test_prepare_dqa3_query_mirror_watermark(self, tmp_path):
+        now = datetime.datetime.now()
+        pump = self.get_pump(dqa3pump.FirebirdDQA3)
+        pump.db_version = "01.04"
+        pump.mirror = dqa3pump.RowMirror(tmp_path / dqa3pump.MIRROR_FILE)
+        pump.mirror.add([{'data_key': 10, 'machine_id': 1, 'work_started': now}])
+        pump.post_process({'data_key': '9', 'machine_id': 1, 'work_started': now})
+        pump.post_process({'data_key': '11', 'machine_id': 1, 'work_started': now})
+        with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.unit_map", new_callable=mock.PropertyMock) as mock_unit_map:  # noqa: E501
+            mock_unit_map.return_value = {1: 'unit 1'}
+            q, params = pump.prepare_dqa3_query(min_date=now.date())
+            assert "AND tr.data_key > ?" in q
+            # uploaded keys below the watermark don't need to be excluded
+            assert params[1:] == [1, "Photon", "Electron", "FFF", 10, 11]
+
+            # historical queries are not limited by the watermark
+            q, params = pump.prepare_dqa3_query(min_date=now.date(), max_date=now.date())
+            assert "AND tr.data_key > ?" not in q
+
+    def test_fetch_rows_mirror(self, tmp_path):
+        now = datetime.datetime.now()
+        pump = self.get_pump(dqa3pump.FirebirdDQA3)
+        pump.mirror = dqa3pump.RowMirror(tmp_path / dqa3pump.MIRROR_FILE)
+        old_row = {'data_key': 1, 'machine_id': 1, 'work_started': now - datetime.timedelta(hours=1)}
+        new_row = {'data_key': 2, 'machine_id': 1, 'work_started': now}
+        pump.mirror.add([old_row])
+        with mock.patch.object(pump, "fetch_upstream_rows", return_value=[dict(new_row)]):
+            with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.unit_map", new_callable=mock.PropertyMock) as mock_unit_map:  # noqa: E501
+                mock_unit_map.return_value = {1: 'unit 1'}
+                with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.min_date", new_callable=mock.PropertyMock) as mock_min_date:  # noqa: E501
+                    mock_min_date.return_value = now.date() - datetime.timedelta(days=1)
+                    assert pump.fetch_rows() == [old_row, new_row]
+                    pump.post_process(dict(old_row))
+                    assert pump.fetch_rows() == [new_row]
+        assert pump.mirror.watermark([1]) == 2
+
+    def test_open_mirror_prunes_old_rows(self, tmp_path):
+        now = datetime.datetime.now()
+        pump = self.get_pump(dqa3pump.FirebirdDQA3)
+        pump.mirror = dqa3pump.RowMirror(tmp_path / dqa3pump.MIRROR_FILE)
+        old_row = {'data_key': 1, 'machine_id': 1, 'work_started': now - datetime.timedelta(days=10)}
+        new_row = {'data_key': 2, 'machine_id': 1, 'work_started': now}
+        pump.mirror.add([old_row, new_row])
+        with mock.patch.object(pump, "get_config_value", return_value=True), \
+                mock.patch.object(pump, "mirror_config", return_value={}), \
+                mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.min_date", new_callable=mock.PropertyMock) as mock_min_date:  # noqa: E501
+            mock_min_date.return_value = now.date() - datetime.timedelta(days=1)
+            assert pump.open_mirror() is pump.mirror
+        assert pump.mirror.rows([1], now.date() - datetime.timedelta(days=30)) == [new_row]
+
+    @pytest.mark.parametrize("values,valid_expected,msg_expected", [
+        ({'enabled': False, 'start date': ""}, True, "disabled"),
+        ({'enabled': True, 'start date': ""}, False, "YYYY-MM-DD"),
+        ({'enabled': True, 'start date': "2021-13-01"}, False, "YYYY-MM-DD"),
+        ({'enabled': True, 'start date': "2021-01-01"}, True, "OK"),
+        ({'enabled': True, 'start date': "2999-01-01"}, True, "nothing to backfill"),
+    ])
+    def test_validate_backfill(self, values, valid_expected, msg_expected):
+        pump = self.get_pump(dqa3pump.FirebirdDQA3)
+        with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.min_date", new_callable=mock.PropertyMock) as mock_min_date:  # noqa: E501
+            mock_min_date.return_value = datetime.date(2021, 3, 1)
+            valid, msg = pump.validate_backfill(values)
+        assert valid is valid_expected
+        assert msg_expected in msg
+
+    def get_backfill_pump(self, tmp_path, **config):
+        pump = self.get_pump(dqa3pump.FirebirdDQA3)
+        backfill_config = {
+            'enabled': True,
+            'start date': "2021-01-01",
+            'chunk days': 7,
+            'chunks per run': 2,
+            'workers': 2,
+            'throttle': 0,
+        }
+        backfill_config.update(config)
+        pump.get_config_values = mock.Mock(return_value=[backfill_config])
+        pump.get_pump_data_path = mock.Mock(return_value=tmp_path / "dqa3_backfill.json")
+        pump.fetch_rows = mock.Mock(
+            side_effect=lambda start, end, raise_errors=False: [{'data_key': start, 'work_started': start}],
+        )
+        pump.upload_records = mock.Mock(side_effect=lambda records, throttle: ([r['data_key'] for r in records], []))
+        pump.update_progress = mock.Mock()
+        pump.should_terminate = mock.Mock(return_value=False)
+        return pump
+
+    def test_backfill(self, tmp_path):
+        pump = self.get_backfill_pump(tmp_path)
+        with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.min_date", new_callable=mock.PropertyMock) as mock_min_date:  # noqa: E501
+            mock_min_date.return_value = datetime.date(2021, 1, 29)
+            pump.backfill()
+            assert [c.args for c in pump.fetch_rows.call_args_list] == [
+                (datetime.date(2021, 1, 1), datetime.date(2021, 1, 8)),
+                (datetime.date(2021, 1, 8), datetime.date(2021, 1, 15)),
+            ]
+            assert pump.update_progress.call_args_list[-1].args[0] == 50
+
+            # second run resumes from the checkpoint
+            pump.fetch_rows.reset_mock()
+            pump.backfill()
+            assert [c.args[0] for c in pump.fetch_rows.call_args_list] == [
+                datetime.date(2021, 1, 15), datetime.date(2021, 1, 22),
+            ]
+            assert pump.update_progress.call_args_list[-1].args[0] == 100
+
+            pump.fetch_rows.reset_mock()
+            pump.backfill()
+            assert not pump.fetch_rows.called
+
+    def test_backfill_terminated(self, tmp_path):
+        pump = self.get_backfill_pump(tmp_path)
+        pump.upload_records = mock.Mock(return_value=(None, None))
+        with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.min_date", new_callable=mock.PropertyMock) as mock_min_date:  # noqa: E501
+            mock_min_date.return_value = datetime.date(2021, 1, 29)
+            pump.backfill()
+        assert not (tmp_path / "dqa3_backfill.json").exists()
+        assert not pump.update_progress.called
+
+    def test_backfill_fetch_failed(self, tmp_path):
+        pump = self.get_backfill_pump(tmp_path)
+        pump.fetch_rows = mock.Mock(side_effect=Exception("db down"))
+        pump.log_warning = mock.Mock()
+        with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.min_date", new_callable=mock.PropertyMock) as mock_min_date:  # noqa: E501
+            mock_min_date.return_value = datetime.date(2021, 1, 29)
+            pump.backfill()
+        assert pump.fetch_rows.call_args.kwargs == {'raise_errors': True}
+        assert not pump.upload_records.called
+        assert not (tmp_path / "dqa3_backfill.json").exists()
+
+    def test_backfill_upload_failed(self, tmp_path):
+        pump = self.get_backfill_pump(tmp_path)
+        pump.upload_records = mock.Mock(return_value=([], ["1"]))
+        pump.log_warning = mock.Mock()
+        with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.min_date", new_callable=mock.PropertyMock) as mock_min_date:  # noqa: E501
+            mock_min_date.return_value = datetime.date(2021, 1, 29)
+            pump.backfill()
+        assert pump.upload_records.call_count == 1
+        assert not (tmp_path / "dqa3_backfill.json").exists()
+        assert "retried" in pump.log_warning.call_args[0][0]
+
+    def test_fetch_upstream_rows_errors(self):
+        pump = self.get_pump(dqa3pump.FirebirdDQA3)
+        pump.log_critical = mock.Mock()
+        pump.get_querier = mock.Mock()
+        pump.db_connect_kwargs = mock.Mock(return_value={})
+        pump.get_included_beam_types = mock.Mock(return_value=[])
+        with mock.patch.object(dqa3pump.FirebirdDQA3, "unit_map", new_callable=mock.PropertyMock) as unit_map, \
+                mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.in_batch_size", return_value=10), \
+                mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.batched_query", side_effect=Exception("db down")):
+            unit_map.return_value = {1: "unit"}
+            assert pump.fetch_upstream_rows() == []
+            with pytest.raises(Exception, match="db down"):
+                pump.fetch_upstream_rows(raise_errors=True)
+
+    def test_already_recorded_remembered(self):
+        pump = self.get_pump(dqa3pump.FirebirdDQA3)
+        record = {'data_key': 12, 'machine_id': 1, 'work_started': dt1}
+        with mock.patch("qcpump.pumps.common.qatrack.QATrackFetchAndPost._is_already_recorded", return_value=True):
+            assert pump._is_already_recorded(record)
+        assert pump.uploaded_data_keys == {1: {12: dt1}}
+
     @pytest.mark.parametrize("record,expected", [
         ({"beam_type": "FfF", "beam_energy": 6, 'wedge_type': "", "wedge_angle": "", 'wedge_orient': "", "device": "", "machine_name": "", "room_name": "", "beam_name": ""}, "DQA3: 6FFF"),
         ({"beam_type": "eLecTron", "beam_energy": 6, 'wedge_type': "", "wedge_angle": "", 'wedge_orient': "", "device": "", "machine_name": "", "room_name": "", "beam_name": ""}, "DQA3: 6E"),
@@ -260,6 +523,16 @@ class TestDQA3:
         with mock.patch.object(pump, "get_config_value", return_value="DQA3: {{energy}}{{beam_type}}{{wedge_type}}{{wedge_angle}}"):
             assert pump.test_list_for_record(record) == expected
 
+    def test_test_list_for_record_cached(self):
+        record = {"beam_type": "Photon", "beam_energy": 6, 'wedge_type': "", "wedge_angle": "", 'wedge_orient': "", "device": "", "machine_name": "", "room_name": "", "beam_name": ""}  # noqa: E501
+        pump = self.get_pump(dqa3pump.AtlasDQA3)
+        assert pump.validate_test_list({'name': "DQA3: {{ energy }}{{ beam_type }}"})[0]
+        with mock.patch.object(pump, "get_config_value", return_value="DQA3: {{ energy }}{{ beam_type }}"):
+            assert pump.test_list_for_record(record) == "DQA3: 6X"
+            assert pump.test_list_for_record(dict(record)) == "DQA3: 6X"
+        assert dqa3pump.render_template.cache_info().hits == 1
+        assert dqa3pump.render_template.cache_info().misses == 1
+
 
 class TestDQA3Grouped:
 
@@ -339,6 +612,7 @@ class TestDQA3Grouped:
                     {'config_name': 'history days', 'value': 1},
                     {'config_name': 'wait time', 'value': 1},
                     {'config_name': 'grouping window', 'value': 1},
+                    {'config_name': 'beam types', 'value': 'All'},
                 ]],
             }
         }
@@ -350,8 +624,71 @@ class TestDQA3Grouped:
         with mock.patch.object(pump, "prepare_dqa3_query", return_value=["", []]):
             with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.querier", return_value=fetch_results):
                 with mock.patch.object(pump, "db_connect_kwargs"):
-                    records = pump.fetch_records()
-                    assert records == results
+                    with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.unit_map", new_callable=mock.PropertyMock) as mock_unit_map:  # noqa: E501
+                        with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.min_date", new_callable=mock.PropertyMock) as mock_min_date:  # noqa: E501
+                            mock_unit_map.return_value = {1: 'unit 1'}
+                            # windows older than the history window are pruned
+                            mock_min_date.return_value = dt1.date()
+                            records = pump.fetch_records()
+                            assert records == results
+
+    def test_iter_machine_date_windows(self):
+        dt1 = datetime.datetime(2021, 3, 31, 1, 23, 34)
+        dt2 = dt1 + datetime.timedelta(minutes=2)
+        dt3 = dt2 + datetime.timedelta(minutes=10)
+        rows = [
+            {'data_key': 1, 'machine_id': 1, 'work_started': dt1},
+            {'data_key': 2, 'machine_id': 1, 'work_started': dt2},
+            {'data_key': 3, 'machine_id': 1, 'work_started': dt3},
+            {'data_key': 4, 'machine_id': 2, 'work_started': dt1},
+        ]
+        windows = list(dqa3pump.iter_machine_date_windows(rows, 3))
+        assert [(m, k, [r['data_key'] for r in rs], d) for m, k, rs, d in windows] == [
+            (1, "2021-03-31-01-23", [1, 2], dt2),
+            (1, "2021-03-31-01-35", [3], dt3),
+            (2, "2021-03-31-01-23", [4], dt1),
+        ]
+
+    def test_fetch_records_waits_across_cycles(self):
+        pump = self.get_pump(dqa3pump.AtlasGroupedDQA3)
+        now = datetime.datetime.now()
+        old = now - datetime.timedelta(minutes=30)
+        rows = [
+            {'data_key': 3, 'machine_id': 1, 'work_started': now},
+            {'data_key': 1, 'machine_id': 1, 'work_started': old},
+            {'data_key': 2, 'machine_id': 2, 'work_started': old},
+        ]
+
+        def fetch(self):
+            return [dict(r) for r in rows]
+
+        with mock.patch.object(pump, "get_config_value", return_value=5):
+            with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.fetch_records", fetch):
+                with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.unit_map", new_callable=mock.PropertyMock) as mock_unit_map:  # noqa: E501
+                    mock_unit_map.return_value = {1: 'unit 1', 2: 'unit 2'}
+                    windows = pump.fetch_records()
+                    assert [(m, [r['data_key'] for r in rs]) for m, __, rs in windows] == [(1, [1]), (2, [2])]
+
+                    # upload of first window succeeded, second failed
+                    pump.post_process(windows[0])
+                    windows = pump.fetch_records()
+                    assert [(m, [r['data_key'] for r in rs]) for m, __, rs in windows] == [(2, [2])]
+                    assert len(pump.window_tracker) == 2
+
+    def test_records_from_rows(self):
+        pump = self.get_pump(dqa3pump.AtlasGroupedDQA3)
+        dt3 = dt1 + datetime.timedelta(minutes=10)
+        rows = [
+            {'data_key': 3, 'machine_id': 1, 'work_started': dt3},
+            {'data_key': 1, 'machine_id': 1, 'work_started': dt1},
+            {'data_key': 2, 'machine_id': 1, 'work_started': dt2},
+        ]
+        with mock.patch.object(pump, "get_config_value", return_value=5):
+            records = pump.records_from_rows(rows)
+        assert [(m, k, [r['data_key'] for r in rs]) for m, k, rs in records] == [
+            (1, "2021-03-31-01-23", [1, 2]),
+            (1, "2021-03-31-01-33", [3]),
+        ]
 
     def test_id_for_record(self):
         pump = self.get_pump(dqa3pump.AtlasGroupedDQA3)
@@ -363,6 +700,31 @@ class TestDQA3Grouped:
         rec = (1, '2021-03-31-01-23', fetch_results)
         assert pump.id_for_record(rec) == "QCPump/DQA3/1/2021-03-31-01-23/123/456"
 
+    def test_post_process_remembers_group_rows(self):
+        pump = self.get_pump(dqa3pump.AtlasGroupedDQA3)
+        rows = [
+            {'data_key': 123, 'machine_id': 1, 'work_started': dt1},
+            {'data_key': 456, 'machine_id': 1, 'work_started': dt2},
+        ]
+        pump.post_process((1, '2021-03-31-01-23', rows))
+        assert pump.uploaded_data_keys == {1: {123: dt1, 456: dt2}}
+
+    @pytest.mark.parametrize("value,expected", [
+        (1, 1),
+        (1.5, 1.5),
+        (float("nan"), None),
+        (float("-inf"), None),
+        (Decimal("1.5"), Decimal("1.5")),
+        (Decimal("NaN"), None),
+        ("123", "123"),
+        (None, None),
+    ])
+    def test_clean_number(self, value, expected):
+        assert dqa3pump.clean_number(value) == expected
+
+    def test_test_slug(self):
+        assert dqa3pump.test_slug("dose", "6 MV EDW60") == "dose_6_mv_edw60"
+
     def test_values_from_record(self):
 
         dt1 = datetime.datetime(2021, 3, 31, 1, 23)
@@ -426,3 +788,159 @@ class TestDQA3Grouped:
         with mock.patch.object(pump, "get_config_values", return_value=config):
             results = getattr(pump, method)(rec)
             assert results == expected
+
+
+class TestDQA3MultiDatabase:
+
+    def setup_class(self):
+        self.app = wx.App()
+
+    def get_pump(self, klass):
+        pump = klass()
+        pump.log = mock.Mock()
+        return pump
+
+    def sources(self):
+        base = {
+            'host': 'host',
+            'port': 3050,
+            'user': 'user',
+            'password': 'password',
+            'driver': 'fdb',
+            'charset': 'UTF-8',
+            'history days': 1,
+        }
+        return [
+            dict(base, **{'source name': 'A', 'database': 'a.fdb'}),
+            dict(base, **{'source name': 'B', 'database': 'b.fdb'}),
+        ]
+
+    def test_config(self):
+        reader_config = dqa3pump.FirebirdMultiDatabaseDQA3.CONFIG[0]
+        assert reader_config['multiple']
+        assert reader_config['fields'][0]['name'] == 'source name'
+        assert not dqa3pump.FirebirdDQA3.CONFIG[0]['multiple']
+
+    def test_grouped_config(self):
+        config = dqa3pump.AtlasMultiDatabaseGroupedDQA3.CONFIG
+        reader_fields = [f['name'] for f in config[0]['fields']]
+        assert 'grouping window' not in reader_fields
+        assert 'wait time' not in reader_fields
+        assert config[1]['name'] == 'Grouping'
+        assert not config[1]['multiple']
+        assert [f['name'] for f in config[1]['fields']] == ['grouping window', 'wait time']
+        assert 'grouping window' in [f['name'] for f in dqa3pump.AtlasGroupedDQA3.CONFIG[0]['fields']]
+
+    def test_grouped_fetch_records_uses_grouping_section(self):
+        pump = self.get_pump(dqa3pump.AtlasMultiDatabaseGroupedDQA3)
+        pump.state = {
+            "Grouping": {
+                'subsections': [[
+                    {'config_name': 'grouping window', 'value': 20},
+                    {'config_name': 'wait time', 'value': 5},
+                ]],
+            },
+        }
+        with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseMultiDatabaseDQA3.fetch_records", return_value=[]):
+            with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.unit_map", new_callable=mock.PropertyMock) as mock_unit_map:  # noqa: E501
+                with mock.patch("qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.min_date", new_callable=mock.PropertyMock) as mock_min_date:  # noqa: E501
+                    mock_unit_map.return_value = {}
+                    mock_min_date.return_value = datetime.date(2021, 3, 30)
+                    with mock.patch.object(pump.window_tracker, "flush", return_value=[]) as flush:
+                        assert pump.fetch_records() == []
+        flush.assert_called_once_with(5)
+
+    def test_validate_duplicate_source_name(self):
+        pump = self.get_pump(dqa3pump.FirebirdMultiDatabaseDQA3)
+        sources = self.sources()
+        sources[1]['source name'] = 'A'
+        with mock.patch.object(pump, "get_config_values", return_value=sources):
+            valid, msg = pump.validate_dqa3reader(sources[0])
+        assert not valid
+        assert "used by more than one database" in msg
+
+    def test_validate_sets_source_version(self):
+        pump = self.get_pump(dqa3pump.FirebirdMultiDatabaseDQA3)
+        sources = self.sources()
+        with mock.patch.object(pump, "get_config_values", return_value=sources):
+            with mock.patch.object(pump, "get_querier", return_value=mock.Mock(return_value=[("01.04.0003",)])):
+                valid, msg = pump.validate_dqa3reader(sources[1])
+        assert valid
+        assert pump.db_versions == {'B': '01.04'}
+
+    def test_mirror_min_date(self):
+        pump = self.get_pump(dqa3pump.FirebirdMultiDatabaseDQA3)
+        pump.db_versions = {'A': '01.04', 'B': '01.04'}
+        sources = self.sources()
+        sources[1]['history days'] = 5
+        with mock.patch.object(pump, "get_config_values", return_value=sources):
+            assert pump.mirror_min_date() == datetime.datetime.now().date() - datetime.timedelta(days=5)
+
+    def test_get_dqa3_unit_choices(self, tmp_path):
+        pump = self.get_pump(dqa3pump.FirebirdMultiDatabaseDQA3)
+        pump.db_versions = {'A': '01.04', 'B': '01.04'}
+        pump.get_pump_data_path = mock.Mock(return_value=tmp_path / dqa3pump.MACHINE_MAP_FILE)
+        machines = [{'machine_id': 1, 'machine_name': 'Unit 1', 'room_name': "Room 1"}]
+        with mock.patch.object(pump, "get_config_values", return_value=self.sources()):
+            with mock.patch.object(pump, "get_querier", return_value=mock.Mock(return_value=machines)):
+                choices = pump.get_dqa3_unit_choices()
+        assert choices == ["A: Room 1/Unit 1", "B: Room 1/Unit 1"]
+        assert pump.dqa_machine_name_to_id == {"A: Room 1/Unit 1": "A/1", "B: Room 1/Unit 1": "B/1"}
+        assert pump.dqa_machine_sources == {"A/1": ("A", 1), "B/1": ("B", 1)}
+
+        # a new pump instance can restore the machine map without querying the databases
+        restored = self.get_pump(dqa3pump.FirebirdMultiDatabaseDQA3)
+        restored.get_pump_data_path = pump.get_pump_data_path
+        restored.load_machine_map()
+        assert restored.dqa_machine_name_to_id == pump.dqa_machine_name_to_id
+        assert restored.dqa_machine_sources == pump.dqa_machine_sources
+
+    def test_fetch_records_merges_sources(self):
+        pump = self.get_pump(dqa3pump.FirebirdMultiDatabaseDQA3)
+        pump.db_versions = {'A': '01.04', 'B': '01.04'}
+        pump.dqa_machine_sources = {"A/1": ("A", 1), "B/1": ("B", 1)}
+
+        def querier(connect_kwargs, query, params=None, **kwargs):
+            assert "mach.mach_key IN (?)" in query
+            if connect_kwargs['database'] == 'a.fdb':
+                return [{'data_key': 1, 'machine_id': 1, 'work_started': dt2}]
+            return [{'data_key': 1, 'machine_id': 1, 'work_started': dt1}]
+
+        with mock.patch.object(pump, "get_config_values", return_value=self.sources()):
+            with mock.patch.object(pump, "get_querier", return_value=querier):
+                with mock.patch(
+                    "qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.unit_map", new_callable=mock.PropertyMock,
+                ) as mock_unit_map:
+                    mock_unit_map.return_value = {"A/1": "Unit A", "B/1": "Unit B"}
+                    rows = pump.fetch_records()
+
+        assert rows == [
+            {'data_key': 1, 'machine_id': 'B/1', 'work_started': dt1},
+            {'data_key': 1, 'machine_id': 'A/1', 'work_started': dt2},
+        ]
+
+    def test_prepare_source_query_no_units(self):
+        pump = self.get_pump(dqa3pump.FirebirdMultiDatabaseDQA3)
+        pump.db_versions = {'A': '01.04', 'B': '01.04'}
+        pump.dqa_machine_sources = {"A/1": ("A", 1)}
+        with mock.patch(
+            "qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.unit_map", new_callable=mock.PropertyMock,
+        ) as mock_unit_map:
+            mock_unit_map.return_value = {"A/1": "Unit A"}
+            query, params = pump.prepare_source_query(self.sources()[1])
+        assert query is None
+
+    def test_prepare_source_query_excludes_source_keys(self):
+        pump = self.get_pump(dqa3pump.FirebirdMultiDatabaseDQA3)
+        pump.db_versions = {'A': '01.04', 'B': '01.04'}
+        pump.dqa_machine_sources = {"A/1": ("A", 1), "B/1": ("B", 1)}
+        now = datetime.datetime.now()
+        pump.post_process({'data_key': '10', 'machine_id': 'A/1', 'work_started': now})
+        pump.post_process({'data_key': '20', 'machine_id': 'B/1', 'work_started': now})
+        with mock.patch(
+            "qcpump.contrib.pumps.dqa3.dqa3pump.BaseDQA3.unit_map", new_callable=mock.PropertyMock,
+        ) as mock_unit_map:
+            mock_unit_map.return_value = {"A/1": "Unit A", "B/1": "Unit B"}
+            query, params = pump.prepare_source_query(self.sources()[1])
+        assert "tr.data_key NOT IN (?)" in query
+        assert params[1:] == [1, "Photon", "Electron", "FFF", 20]
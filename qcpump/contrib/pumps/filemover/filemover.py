@@ -1,10 +1,12 @@
 from pathlib import Path
-import shutil
 
 from qcpump.pumps.base import BOOLEAN, DIRECTORY, MULTCHOICE, STRING, BasePump
+from qcpump.pumps.common.stability import StableFiles
+from qcpump.pumps.common.transfer import TransferFiles
+from qcpump.pumps.common.watcher import WatchDirectories
 
 
-class SimpleFileMover(BasePump):
+class SimpleFileMover(StableFiles, TransferFiles, BasePump):
 
     DISPLAY_NAME = "FileMover: Simple"
 
@@ -38,6 +40,8 @@ class SimpleFileMover(BasePump):
                 },
             ],
         },
+        TransferFiles.TRANSFER_CONFIG,
+        StableFiles.STABILITY_CONFIG,
     ]
 
     def validate_source_dest(self, values):
@@ -58,46 +62,37 @@ class SimpleFileMover(BasePump):
         moved = []
         self.log_debug("Starting to pump")
         terminate = False
+        seen = []
         for mover in self.get_config_values("SimpleFileMover"):
 
-            paths = list(Path(mover['source']).glob("*"))
+            found = list(Path(mover['source']).glob("*"))
+            seen.extend(found)
+            paths = self.stable_paths(found)
             to_dir = Path(mover['destination'])
 
             mode = mover['mode']
-            action = "Moved" if mode == "Move" else "Copied"
 
             self.log_info(f"Found {len(paths)} files to {mode.lower()}.")
-            for f in paths:
-
-                # your pumps should always periodically check whether they
-                # should terminate
-                terminate = self.should_terminate()
-                if terminate:
-                    break
-
-                try:
-                    dest = to_dir / f.name
-                    if mode == "Copy":
-                        shutil.copy(f, dest)
-                    else:
-                        f.replace(dest)
-                    msg = f"{action} {f} to {to_dir / f.name}"
-                except Exception:
-                    msg = f"Failed to {mode} {f} to {to_dir / f.name}"
-
-                self.log_info(msg)
-                moved.append(msg)
 
+            # transfer_files stops starting new transfers once
+            # should_terminate returns True. Your pumps should always
+            # periodically check whether they should terminate
+            moved.extend(self.transfer_files(paths, to_dir, mode))
+            terminate = self.should_terminate()
             if terminate:
                 self.log_debug("Terminating early")
                 break
 
+        # checksums of copied files are kept until the files are removed from the source directory
+        self.save_manifest(None if terminate else seen)
+        if not terminate:
+            self.prune_stability(seen)
         self.log_debug("Finished Pumping")
 
         return '\n'.join(moved)
 
 
-class FileMover(BasePump):
+class FileMover(StableFiles, WatchDirectories, TransferFiles, BasePump):
 
     DISPLAY_NAME = "FileMover: Advanced"
 
@@ -158,6 +153,9 @@ class FileMover(BasePump):
                 },
             ],
         },
+        WatchDirectories.WATCH_CONFIG,
+        TransferFiles.TRANSFER_CONFIG,
+        StableFiles.STABILITY_CONFIG,
     ]
 
     def validate_source_dest(self, values):
@@ -178,51 +176,52 @@ class FileMover(BasePump):
         moved = []
         self.log_debug("Starting to pump")
         terminate = False
+        seen = []
+        watched = self.recheck_paths(self.watched_paths())
         for mover in self.get_config_values("FileMover"):
 
-            paths = self.get_paths(mover)
+            found = self.get_paths(mover, watched)
+            seen.extend(found)
+            paths = self.stable_paths(found)
 
             to_dir = Path(mover['destination'])
 
             mode = mover['mode']
-            action = "Moved" if mode == "Move" else "Copied"
 
             self.log_info(f"Found {len(paths)} files to move.")
-            for f in paths:
-
-                # your pumps should always periodically check whether they should terminate
-                terminate = self.should_terminate()
-                if terminate:
-                    break
-
-                try:
-                    dest = to_dir / f.name
-                    if mode == "Copy":
-                        shutil.copy(f, dest)
-                    else:
-                        f.replace(dest)
-                    msg = f"{action} {f} to {to_dir / f.name}"
-                except Exception:
-                    msg = f"Failed to {mode} {f} to {to_dir / f.name}"
-
-                self.log_info(msg)
-                moved.append(msg)
 
+            # your pumps should always periodically check whether they should terminate
+            moved.extend(self.transfer_files(paths, to_dir, mode))
+            terminate = self.should_terminate()
             if terminate:
                 self.log_debug("Terminating early")
                 break
 
+        # only a full search lists every file so nothing can be pruned after a watched run
+        full_search = not terminate and watched is None
+        self.save_manifest(seen if full_search else None)
+        if full_search:
+            self.prune_stability(seen)
         self.log_debug("Finished Pumping")
 
         return '\n'.join(moved)
 
-    def get_paths(self, mover):
-        """Get a listing of all files in our source directory and filter them based on our config options"""
+    def get_paths(self, mover, watched=None):
+        """Get a listing of all files in our source directory (or the watched
+        paths written since the last run) and filter them based on our config
+        options"""
+        if watched is not None:
+            all_paths = self.filter_watched_paths(watched, mover['source'], mover['pattern'], mover['recursive'])
+            return self.filter_paths(all_paths, mover['ignore pattern'])
+
         globber = self.construct_globber(mover['pattern'], mover['recursive'])
         self.log_debug(f"Getting paths with globber: '{globber}' and mover: {mover}")
         all_paths = Path(mover['source']).glob(globber)
         return self.filter_paths(all_paths, mover['ignore pattern'])
 
+    def watch_roots(self):
+        return [(mover['source'], mover['recursive']) for mover in self.get_config_values("FileMover")]
+
     def construct_globber(self, pattern, recursive):
         """Consutruct a globber for reading from our source directory"""
         return f"**/{pattern}" if recursive else pattern
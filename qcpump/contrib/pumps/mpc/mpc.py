@@ -1,13 +1,24 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import csv
 import datetime
+import functools
+import io
+import os
 import re
 from pathlib import Path
 
-import jinja2
-
 from qcpump.pumps.base import BOOLEAN, DIRECTORY, BasePump, INT, STRING
-from qcpump.pumps.common.qatrack import QATrackFetchAndPost, slugify
+from qcpump.pumps.common.fingerprints import FingerprintStore, files_fingerprint
+from qcpump.pumps.common.qatrack import (
+    QATrackFetchAndPost,
+    clear_template_caches,
+    render_template,
+    slugify,
+)
+from qcpump.pumps.common.scan_cache import ScanCache, list_dir
+from qcpump.pumps.common.watcher import WatchDirectories
+from qcpump.pumps.common.windows import WindowTracker
 
 MPC_PATH_RE = re.compile(r"""
      .*                     # preamble like NDS-WKS
@@ -39,17 +50,83 @@ MPC_PATH_RE_OLD = re.compile(r"""
 
 DATE_GROUP_FMT = "%Y-%m-%d-%H-%M"
 
+# MPC writes its Results.csv files as plain comma separated values
+MPC_CSV_DIALECT = csv.excel
+
+# file in the pump data directory where the index of scanned TDS directories is saved
+SCAN_CACHE_FILE = "mpc_scan_cache.json"
+
+# file in the pump data directory where fingerprints of uploaded groups of results files are saved
+FINGERPRINTS_FILE = "mpc_fingerprints.json"
+
 ENH_COUCH_CHECKS = "Enhanced Couch Checks"
 ENH_MLC_CHECKS = "Enhanced MLC Checks"
 COLL_DEVICES_CHECKS = "Collimation Devices Checks"
 BEAM_AND_GEOMETRY_CHECKS = "Beam and Geometry Checks"
 
 
+# fields parsed from MPC results directory names (see MPCMeta)
+META_FIELDS = (
+    'path', 'serial_no', 'date', 'beam_num', 'energy', 'beam_type', 'fff', 'mvkv', 'hdtse', 'template', 'enhanced',
+)
+
+# maximum number of parsed paths to keep in memory. Only recent results are
+# parsed on each pump run so this only needs to cover a few days of results
+META_CACHE_SIZE = 16384
+
+
+class MPCMeta:
+    """Metadata parsed from an MPC results path. Fields can be accessed either
+    as attributes or by key (e.g. meta['date']) and metas compare equal to
+    dicts with the same fields"""
+
+    __slots__ = META_FIELDS + ('template_group',)
+
+    def __init__(self, template_group, **fields):
+        self.template_group = template_group
+        for name in META_FIELDS:
+            setattr(self, name, fields[name])
+
+    def __getitem__(self, name):
+        if name not in META_FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in META_FIELDS}
+
+    def __eq__(self, other):
+        if isinstance(other, MPCMeta):
+            other = other.as_dict()
+        if not isinstance(other, dict):
+            return NotImplemented
+        return self.as_dict() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"MPCMeta({self.as_dict()!r})"
+
+
+def mpc_dir_name(path):
+    """Return the MPC results directory name from path which may be either
+    the results directory itself or a file in it"""
+    parts = str(path).replace("\\", "/").rstrip("/").rsplit("/", 2)
+    name = parts[-1]
+    if "-SN" not in name and len(parts) > 1:
+        name = parts[-2]
+    return name
+
+
+@functools.lru_cache(maxsize=META_CACHE_SIZE)
 def mpc_path_to_meta(path):
+    """Parse the MPC results directory name in path to an MPCMeta. Results
+    are cached since the same paths are found on every pump run"""
+    name = mpc_dir_name(path)
     try:
-        meta = MPC_PATH_RE.match(str(path)).groupdict()
+        meta = MPC_PATH_RE.match(name).groupdict()
     except AttributeError:
-        meta = MPC_PATH_RE_OLD.match(str(path)).groupdict()
+        meta = MPC_PATH_RE_OLD.match(name).groupdict()
     meta['path'] = path
     meta['date'] = datetime.datetime(*map(int, meta['date'].split("-")))
     meta['fff'] = "FFF" if meta['fff'] else ''
@@ -63,7 +140,7 @@ def mpc_path_to_meta(path):
     meta['mvkv'] = meta['mvkv'] or ''
     meta['hdtse'] = meta['hdtse'] or ''
     meta['template'] = ("%s%s %s" % (meta['template'], meta['mvkv'], meta['enhanced'])).strip(" ")
-    return meta
+    return MPCMeta(template_group(name), **meta)
 
 
 def group_by_meta(metas, window_minutes):
@@ -93,7 +170,7 @@ def group_by_template(metas):
 
     grouped = defaultdict(list)
     for meta in metas:
-        grouped[template_group(meta['path'])].append(meta)
+        grouped[meta.template_group].append(meta)
     return grouped
 
 
@@ -139,7 +216,212 @@ def timestamp_filter(timestamp, cutoff_datetime):
     return datetime.datetime.fromtimestamp(timestamp) > cutoff_datetime
 
 
-class QATrackMPCPump(QATrackFetchAndPost, BasePump):
+def mpc_dir_date(name):
+    """Return the acquisition date embedded in an MPC results directory name
+    (or None if name is not an MPC results directory or its date is invalid)"""
+    match = MPC_PATH_RE.match(name) or MPC_PATH_RE_OLD.match(name)
+    if match is None:
+        return None
+    try:
+        return datetime.datetime(*map(int, match.group('date').split("-")))
+    except ValueError:
+        # e.g. a directory copied & renamed by hand to something like 2020-13-45
+        return None
+
+
+def walk_results(root, date_cutoff, is_result, scan_cache=None):
+    """Recursively walk root yielding paths of files for which
+    is_result(file_name) is True and which were modified after date_cutoff.
+    MPC results directories dated before date_cutoff are skipped without
+    being read so that only recent files need to be stat'ed. If a ScanCache
+    is given, directories which haven't changed since the last scan are not
+    re-listed."""
+
+    lister = scan_cache.list_dir if scan_cache is not None else list_dir
+    dirs = [root]
+    while dirs:
+        path = dirs.pop()
+        try:
+            subdirs, files = lister(path, is_result)
+        except OSError:
+            continue
+
+        for name in subdirs:
+            date = mpc_dir_date(name)
+            if date is None or date >= date_cutoff:
+                dirs.append(os.path.join(path, name))
+
+        for name, mtime in files.items():
+            if timestamp_filter(mtime, date_cutoff):
+                yield Path(path, name).absolute()
+
+
+def is_csv(name):
+    return os.path.normcase(name).endswith(".csv")
+
+
+def is_results_csv(name):
+    return os.path.normcase(name) == os.path.normcase("Results.csv")
+
+
+def find_results_files(source, date_cutoff, fast_search=True, scan_cache=None):
+    """Return paths of all MPC results files in the TDS directory source
+    modified after date_cutoff. With fast_search, only csv files in the
+    MPCChecks directory of each machine are considered (i.e.
+    source/*/MPCChecks/**/*.csv), otherwise all Results.csv files are found
+    (i.e. source/**/Results.csv)"""
+
+    if not fast_search:
+        return list(walk_results(source, date_cutoff, is_results_csv, scan_cache))
+
+    lister = scan_cache.list_dir if scan_cache is not None else list_dir
+    try:
+        machine_dirs, __ = lister(source, is_csv)
+    except OSError:
+        return []
+
+    paths = []
+    for machine_dir in machine_dirs:
+        root = os.path.join(source, machine_dir, "MPCChecks")
+        if os.path.isdir(root):
+            paths.extend(walk_results(root, date_cutoff, is_csv, scan_cache))
+    return paths
+
+
+def parse_float(value, decimal_comma=False):
+    try:
+        value = value.strip()
+        if decimal_comma:
+            value = value.replace(",", ".")
+        return float(value)
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+def is_results_header(header):
+    """Does header look like a Results.csv header (Name [Unit],Value,...)?"""
+    return len(header) >= 2 and header[0].strip().startswith("Name") and header[1].strip().lower() == "value"
+
+
+def parse_results_csv(text, dialect):
+    """Parse the contents of a Results.csv file into a list of (name, value,
+    threshold, result) tuples with value and threshold converted to floats
+    (or None).
+
+    Returns None if text doesn't appear to be written in dialect, i.e. the
+    header isn't Name [Unit],Value,..., a row has more columns than the
+    header, or none of the values are numeric. Other short rows are padded
+    with empty values.
+
+    Raises ValueError if the file is empty or its last row is short (i.e.
+    the file was truncated or is still being written)."""
+    rows = [row for row in csv.reader(io.StringIO(text), dialect) if row]
+    if not rows:
+        raise ValueError("Results file is empty")
+
+    headers, rows = rows[0], rows[1:]
+    if not is_results_header(headers):
+        return None
+
+    if any(len(row) > len(headers) for row in rows):
+        return None
+
+    if rows and len(rows[-1]) < len(headers):
+        raise ValueError("Results file is truncated")
+
+    # e.g. 0,52 in files written with a ; delimiter
+    decimal_comma = dialect.delimiter != ","
+
+    results = []
+    for row in rows:
+        name, value, threshold, result = (row + [""] * 4)[:4]
+        results.append((name, parse_float(value, decimal_comma), parse_float(threshold, decimal_comma), result))
+
+    if results and all(value is None for __, value, __, __ in results):
+        return None
+
+    return results
+
+
+def read_results_csv(text, dialect=None):
+    """Parse the contents of a Results.csv file trying dialect (e.g. the
+    dialect that last worked for the TDS directory) and then the standard MPC
+    dialect, and only falling back to sniffing the dialect if neither works.
+    Returns a tuple of (rows, dialect used) and raises ValueError if the file
+    can't be parsed."""
+    # files saved by some editors start with a UTF-8 byte order mark
+    text = text.lstrip("\ufeff")
+    for candidate in (dialect, MPC_CSV_DIALECT):
+        if candidate is not None:
+            rows = parse_results_csv(text, candidate)
+            if rows is not None:
+                return rows, candidate
+
+    try:
+        dialect = csv.Sniffer().sniff(text[:1024])
+    except csv.Error:
+        raise ValueError("Unable to determine the format of the results file")
+
+    rows = parse_results_csv(text, dialect)
+    if rows is None:
+        raise ValueError("Unable to parse the results file")
+    return rows, dialect
+
+
+def compile_excluded_tests(names):
+    """Compile a list of test names (or parts of test names) into a single
+    regex which matches any test name containing one of them"""
+    names = sorted({name for name in names if name}, key=len, reverse=True)
+    if not names:
+        return re.compile(r"(?!)")  # never matches
+    return re.compile("|".join(re.escape(name) for name in names))
+
+
+def relative_parts(path, source):
+    """Return the parts of path relative to source (or None if path is not below source)"""
+    try:
+        return Path(path).absolute().relative_to(Path(source).absolute()).parts
+    except ValueError:
+        return None
+
+
+def is_results_dir(path, source, date_cutoff, fast_search=True):
+    """Return True if the directory path (below source) would be searched by find_results_files"""
+    parts = relative_parts(path, source)
+    if not parts:
+        return False
+    if fast_search and len(parts) >= 2 and os.path.normcase(parts[1]) != os.path.normcase("MPCChecks"):
+        return False
+    date = mpc_dir_date(parts[-1])
+    return date is None or date >= date_cutoff
+
+
+def filter_results_files(paths, source, date_cutoff, fast_search=True):
+    """Return the paths which find_results_files would return for the TDS
+    directory source (e.g. to check paths reported by a directory watcher)"""
+    results = []
+    for path in paths:
+        parts = relative_parts(path, source)
+        if not parts:
+            continue
+        if fast_search:
+            in_checks = len(parts) >= 3 and os.path.normcase(parts[1]) == os.path.normcase("MPCChecks")
+            if not (in_checks and is_csv(parts[-1])):
+                continue
+        elif not is_results_csv(parts[-1]):
+            continue
+        dates = (mpc_dir_date(part) for part in parts[:-1])
+        if any(date is not None and date < date_cutoff for date in dates):
+            continue
+        try:
+            if timestamp_filter(os.stat(path).st_mtime, date_cutoff):
+                results.append(Path(path).absolute())
+        except OSError:
+            continue
+    return results
+
+
+class QATrackMPCPump(WatchDirectories, QATrackFetchAndPost, BasePump):
 
     DISPLAY_NAME = "MPC: QATrack MPC Pump"
 
@@ -196,6 +478,32 @@ class QATrackMPCPump(QATrackFetchAndPost, BasePump):
                         "written to disk before uploading grouped results"
                     ),
                 },
+                {
+                    'name': 'read workers',
+                    'label': 'Concurrent file reads',
+                    'type': INT,
+                    'required': False,
+                    'default': 4,
+                    'help': (
+                        "Enter the maximum number of Results.csv files to read at the same time. "
+                        "Reading files concurrently is faster when the TDS directory is on a slow network share."
+                    ),
+                    'validation': {
+                        'min': 1,
+                        'max': 32,
+                    },
+                },
+                {
+                    'name': 'excluded tests',
+                    'label': 'Excluded tests',
+                    'type': STRING,
+                    'required': False,
+                    'default': "",
+                    'help': (
+                        "Enter a comma separated list of test names (or parts of test names) to exclude "
+                        "from uploads in addition to the individual MLC leaf results which are always excluded"
+                    ),
+                },
             ],
         },
         QATrackFetchAndPost.QATRACK_API_CONFIG,
@@ -215,8 +523,8 @@ class QATrackMPCPump(QATrackFetchAndPost, BasePump):
                     )
                 },
             ]
-        }
-
+        },
+        WatchDirectories.WATCH_CONFIG,
     ]
 
     EXCLUDED_TESTS = [
@@ -234,6 +542,16 @@ class QATrackMPCPump(QATrackFetchAndPost, BasePump):
         "CollimationDevicesGroup/MLCBacklashGroup/MLCBacklashLeavesB/MLCBacklashLeaf"
     ]
 
+    def __init__(self, *args, **kwargs):
+        self.window_tracker = WindowTracker()
+        self.scan_cache = None
+        self.fingerprints = None
+        self._read_fingerprints = {}
+        self._unparsed_paths = set()
+        self._excluded_tests = None
+        self._csv_dialects = {}
+        super().__init__(*args, **kwargs)
+
     @property
     def autoskip(self):
         return True
@@ -262,13 +580,18 @@ class QATrackMPCPump(QATrackFetchAndPost, BasePump):
         name = values['name'].replace(" ", "")
         if "{{check_type}}" not in name:
             return False, "You must include a '{{ check_type }}' template variable in your test list name"
+        clear_template_caches()
         return True, "OK"
 
     def pump(self):
         self._unit_cache = {}
         self._record_meta_cache = {}
+        self._read_fingerprints = {}
         self.set_qatrack_unit_names_to_ids()
-        return super().pump()
+        try:
+            return super().pump()
+        finally:
+            self.save_fingerprints()
 
     def set_qatrack_unit_names_to_ids(self):
         """Fetch all available qatrack unit names.  We are overriding common.qatrack version
@@ -281,47 +604,159 @@ class QATrackMPCPump(QATrackFetchAndPost, BasePump):
             self.qatrack_unit_names_to_ids[unit['name']] = unit['number']
 
     def fetch_records(self):
-        """Return a llist of Path objects representing Results.csv files"""
+        """Return a list of (sn, template_type, date, metas) groups of Results.csv files"""
         source = self.get_config_value("MPC", "tds directory").replace("\\", "/")
         fast_search = self.get_config_value("MPC", 'fast search')
-        globber = '*/MPCChecks/**/*.csv' if fast_search else '**/Results.csv'
+        minutes = self.get_config_value('MPC', 'grouping window')
+        self.window_tracker.check_config((source, fast_search, minutes))
+
         date_cutoff = self.history_cutoff_date()
-        paths = Path(source).glob(globber)
-        paths = [p.absolute() for p in paths if timestamp_filter(p.stat().st_mtime, date_cutoff)]
-        grouped = self.group_records(paths)
-        filtered = self.filter_records(grouped)
-        return filtered
+        watched = self.watched_paths()
+        if watched is None:
+            paths = self.find_results_files(source, date_cutoff, fast_search)
+        else:
+            paths = filter_results_files(watched, source, date_cutoff, fast_search)
+            self.log_debug(f"Found {len(paths)} results files written since the last run")
+        self.add_paths(paths, minutes)
+        self.window_tracker.prune(date_cutoff)
+
+        return self.complete_groups()
+
+    def find_results_files(self, source, date_cutoff, fast_search):
+        """Find results files using the persistent scan cache"""
+        scan_cache = self.get_scan_cache()
+        scan_cache.check_config((source, fast_search))
+        scan_cache.begin_scan()
+        hits, misses = scan_cache.hits, scan_cache.misses
+
+        paths = find_results_files(source, date_cutoff, fast_search, scan_cache)
+
+        try:
+            scan_cache.end_scan()
+        except OSError as e:
+            self.log_warning(f"Unable to save the scan cache to {scan_cache.path}: {e}")
+
+        self.log_debug(
+            f"Found {len(paths)} results files (scan cache hits: {scan_cache.hits - hits}, "
+            f"misses: {scan_cache.misses - misses})"
+        )
+        return paths
+
+    def get_scan_cache(self):
+        if self.scan_cache is None:
+            self.scan_cache = ScanCache(self.get_pump_data_path(SCAN_CACHE_FILE))
+            self.scan_cache.load()
+        return self.scan_cache
+
+    def watch_roots(self):
+        return [(self.get_config_value("MPC", "tds directory").replace("\\", "/"), True)]
+
+    def watch_include_dir(self):
+        """Only watch the directories find_results_files would search"""
+        source = self.get_config_value("MPC", "tds directory").replace("\\", "/")
+        fast_search = self.get_config_value("MPC", 'fast search')
+        date_cutoff = self.history_cutoff_date()
+        return lambda path: is_results_dir(path, source, date_cutoff, fast_search)
+
+    def get_fingerprints(self):
+        if self.fingerprints is None:
+            self.fingerprints = FingerprintStore(self.get_pump_data_path(FINGERPRINTS_FILE))
+            self.fingerprints.load()
+        return self.fingerprints
+
+    def save_fingerprints(self):
+        """Forget fingerprints of groups older than the history window and save the rest"""
+        if self.fingerprints is None:
+            return
+        self.fingerprints.prune(self.history_cutoff_date().strftime(DATE_GROUP_FMT))
+        try:
+            self.fingerprints.save()
+        except OSError as e:
+            self.log_warning(f"Unable to save the results fingerprints to {self.fingerprints.path}: {e}")
+
+    def fingerprint_for_record(self, record):
+        """Return a fingerprint of the paths, sizes & modification times of the
+        records results files (or None if any of them can't be read)"""
+        sn, template_type, date, metas = record
+        try:
+            return files_fingerprint(m['path'] for m in metas)
+        except OSError:
+            return None
+
+    def remember_fingerprint(self, record, fingerprint):
+        if fingerprint is not None:
+            sn, template_type, date, metas = record
+            self.get_fingerprints().add(self.id_for_record(record), fingerprint, date)
 
     def history_cutoff_date(self):
         """Return the date before which files should not be considered"""
         days_delta = datetime.timedelta(days=self.get_config_value("MPC", "history days"))
         return datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - days_delta
 
-    def group_records(self, paths):
-        metas = [mpc_path_to_meta(p) for p in paths]
-        minutes = self.get_config_value('MPC', 'grouping window')
-        results_groups = []
-        for sn, templ_groups in group_by_meta(metas, minutes).items():
-            for templ_group, date_groups in templ_groups.items():
-                for date_group, grouped in date_groups.items():
-                    results_groups.append((sn, templ_group, date_group, grouped))
-        return results_groups
-
-    def filter_records(self, records):
-        """Remove any groups which are not older than N minutes. This allows us
+    def add_paths(self, paths, minutes):
+        """Add any paths not seen before to their serial number/template/date/time
+        window. Windows are kept between pump runs so results only need to be
+        grouped once"""
+        metas = []
+        for path in paths:
+            if path in self.window_tracker or path in self._unparsed_paths:
+                continue
+            try:
+                metas.append(mpc_path_to_meta(path))
+            except (AttributeError, ValueError):
+                # e.g. a directory renamed by hand or a file nested below a results directory
+                self._unparsed_paths.add(path)
+                self.log_warning(f"Skipping {path} since it is not in a valid MPC results directory")
+
+        for meta in sorted(metas, key=lambda m: m['date']):
+            template = meta.template_group
+            window_minutes = minutes if do_timewindow_grouping(template) else 0
+            self.window_tracker.add((meta['serial_no'], template), meta['date'], meta['path'], meta, window_minutes)
+
+    def complete_groups(self):
+        """Return any groups which are older than N minutes. This allows us
         to wait until all beam results are written to disk before uploading"""
+        wait_minutes = self.get_config_value("MPC", "wait time")
+        groups = self.window_tracker.flush(wait_minutes)
+        return [(sn, template, date, metas) for (sn, template), date, metas in groups]
 
-        now = datetime.datetime.now()
-        cutoff_delta = datetime.timedelta(minutes=self.get_config_value("MPC", "wait time"))
-        filtered = []
-        for record in records:
-            sn, template_type, date, path_metas = record
-            max_date = sorted(path_metas, key=lambda m: m['date'], reverse=True)[0]['date']
-            cutoff = max_date + cutoff_delta
-            if cutoff <= now:
-                filtered.append(record)
+    def _is_already_recorded(self, record):
+        """Groups with a saved fingerprint have already been uploaded and can
+        be skipped without querying the API. If the fingerprint has changed
+        the results files were modified after they were uploaded so the group
+        is flagged with a warning (but not uploaded again)"""
 
-        return filtered
+        sn, template_type, date, metas = record
+        record_id = self.id_for_record(record)
+        fingerprint = self.fingerprint_for_record(record)
+        saved = self.get_fingerprints().get(record_id) if fingerprint is not None else None
+        if saved is not None:
+            if fingerprint != saved:
+                paths = "\n\t".join(str(m['path']) for m in metas)
+                self.log_warning(
+                    f"Results files for record with id={record_id} have changed since they were uploaded:\n\t{paths}"
+                )
+                self.fingerprints.add(record_id, fingerprint, date, changed=True)
+            self.group_done(record)
+            return True
+
+        recorded = super()._is_already_recorded(record)
+        if recorded:
+            self.group_done(record)
+            self.remember_fingerprint(record, fingerprint)
+        return recorded
+
+    def post_process(self, record):
+        super().post_process(record)
+        self.group_done(record)
+        # remember the files as they were when they were read rather than now,
+        # so that changes made while uploading are flagged on the next run
+        self.remember_fingerprint(record, self._read_fingerprints.pop(self.id_for_record(record), None))
+
+    def group_done(self, record):
+        """Stop tracking a group once it has been uploaded"""
+        sn, template_type, date, metas = record
+        self.window_tracker.done((sn, template_type), date)
 
     def id_for_record(self, record):
         sn, template_type, date, metas = record
@@ -330,8 +765,7 @@ class QATrackMPCPump(QATrackFetchAndPost, BasePump):
     def test_list_for_record(self, record):
         sn, template_type, date, metas = record
         tl_name_template = self.get_config_value("Test List", "name")
-        template = jinja2.Template(tl_name_template, undefined=jinja2.StrictUndefined)
-        return template.render({'check_type': template_type})
+        return render_template(tl_name_template, (('check_type', template_type),))
 
     def comment_for_record(self, record):
         sn, template_type, date, metas = record
@@ -360,53 +794,89 @@ class QATrackMPCPump(QATrackFetchAndPost, BasePump):
         sn, template_type, date, metas = record
 
         include_comment = self.get_config_value('QATrack+ API', 'include comment')
+        excluded = self.excluded_tests_matcher()
+        workers = self.get_config_value('MPC', 'read workers') or 1
 
-        for meta in metas:
+        # fingerprint before reading so any change made during the read results in a different fingerprint
+        self._read_fingerprints[self.id_for_record(record)] = self.fingerprint_for_record(record)
+        try:
+            results = self.read_results_files(metas, workers)
+        except (OSError, ValueError) as e:
+            # the group will be tried again on the next run
+            self.log_error(f"Unable to read results for record with id={self.id_for_record(record)}: {e}")
+            return None
+
+        # values are merged in the same order as metas regardless of the order files are read in
+        for meta, rows in zip(metas, results):
 
             beam_type = f"{meta['energy']}{meta['beam_type']}"
 
-            for row in self.csv_values(meta['path'].open('r', encoding="utf-8")):
-                if not self.include_test(row[0]):
+            for tname, tvalue, tol, result in rows:
+                if not self.include_test(tname, excluded):
                     continue
-                slug = self.slugify(row[0], beam_type)
+                slug = self.slugify(tname, beam_type)
                 test_vals[slug] = {
-                    'value': self.test_value(row[1]),
+                    'value': tvalue,
                 }
                 if include_comment:
-                    tname, tvalue, tol, result = row
-                    if tol:
-                        tol = self.test_value(tol)
+                    if tol is not None:
                         test_vals[slug]['comment'] = "Threshold: %.3f,Result: %s" % (tol, result)
                     else:
                         test_vals[slug]['comment'] = "Threshold: N/A,Result: %s" % (result)
 
         return test_vals
 
-    def csv_values(self, file_):
-        with file_ as csvfile:
-            dialect = csv.Sniffer().sniff(csvfile.read(1024))
-            csvfile.seek(0)
-            reader = csv.reader(csvfile, dialect)
-            headers = next(reader)  # noqa: F841
-            for row in reader:
-                yield row
+    def read_results_files(self, metas, workers):
+        """Read the rows from the Results.csv file of each of the input metas
+        using up to workers threads. Returns a list of row lists in the same
+        order as metas"""
+        workers = min(workers, len(metas))
+        if workers <= 1:
+            return [self.read_results_file(meta) for meta in metas]
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="qcpump-mpc") as executor:
+            return list(executor.map(self.read_results_file, metas))
+
+    def read_results_file(self, meta):
+        """Return a list of (name, value, threshold, result) tuples from the
+        Results.csv file for meta. A non-standard dialect which parses
+        correctly is remembered for the TDS directory so later files only need
+        to be sniffed if they can't be read using it or the usual MPC dialect.
+        Raises ValueError if the file can't be parsed."""
+        with meta['path'].open('r', encoding="utf-8") as f:
+            text = f.read()
+
+        root = self.get_config_value("MPC", "tds directory")
+        try:
+            rows, dialect = read_results_csv(text, self._csv_dialects.get(root))
+        except ValueError as e:
+            raise ValueError(f"{meta['path']}: {e}")
+
+        if dialect is not MPC_CSV_DIALECT:
+            # never replace a dialect which is already known to work
+            self._csv_dialects.setdefault(root, dialect)
+        return rows
 
-    def include_test(self, test_name):
+    def include_test(self, test_name, excluded=None):
         """Check if the input test name should be included (excludes e.g. individual leaf results)"""
-        for exclude in self.EXCLUDED_TESTS:
-            if exclude in test_name:
-                return False
-        return True
+        excluded = excluded or self.excluded_tests_matcher()
+        return excluded.search(test_name) is None
+
+    def excluded_tests_matcher(self):
+        """Return a compiled regex matching any of the excluded test names.
+        The regex is only recompiled when the excluded tests config changes"""
+        extra = self.get_config_value("MPC", "excluded tests") or ""
+        if self._excluded_tests is None or self._excluded_tests[0] != extra:
+            excluded = self.EXCLUDED_TESTS + [name.strip() for name in extra.split(",")]
+            self._excluded_tests = (extra, compile_excluded_tests(excluded))
+        return self._excluded_tests[1]
 
     def slugify(self, test_name, beam_type):
         """Take a test name read from CSV file and return a valid test slug"""
         return slugify(test_name + "_" + beam_type)
 
     def test_value(self, test_val):
-        try:
-            return float(test_val.strip())
-        except (ValueError, TypeError):
-            return None
+        return parse_float(test_val)
 
     def work_datetimes_for_record(self, record):
         sn, template_type, date, metas = record
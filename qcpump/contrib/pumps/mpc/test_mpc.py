@@ -1,5 +1,9 @@
+import csv
 import io
+import os
+import time
 from datetime import datetime as dt, timedelta
+from pathlib import Path
 from unittest import mock
 
 import pytest
@@ -229,6 +233,37 @@ def test_mpc_path_to_meta(path, expected):
     assert mpc.mpc_path_to_meta(path) == expected
 
 
+def test_mpc_path_to_meta_results_file():
+    path = Path("/TDS/H191234/MPCChecks/NDS-WKS-SN1234-2020-11-06-09-59-21-0007-BeamCheckTemplate16e/Results.csv")
+    meta = mpc.mpc_path_to_meta(path)
+    assert meta['path'] == path
+    assert meta.serial_no == "1234"
+    assert meta['template'] == "BeamCheckTemplate"
+    assert meta.template_group == mpc.BEAM_AND_GEOMETRY_CHECKS
+
+
+def test_mpc_path_to_meta_cached():
+    path = "NDS-WKS-SN1234-2020-11-06-09-59-21-0007-BeamCheckTemplate16e"
+    assert mpc.mpc_path_to_meta(path) is mpc.mpc_path_to_meta(path)
+
+
+def test_mpc_meta_slotted():
+    meta = mpc.mpc_path_to_meta("NDS-WKS-SN1234-2020-11-06-09-59-21-0007-BeamCheckTemplate16e")
+    assert not hasattr(meta, "__dict__")
+    with pytest.raises(KeyError):
+        meta['template_group']
+
+
+@pytest.mark.parametrize("path,expected", [
+    ("NDS-WKS-SN1234-2020-11-06-09-59-21-0007-6e-Beam", "NDS-WKS-SN1234-2020-11-06-09-59-21-0007-6e-Beam"),
+    ("I:\\TDS\\MPCChecks\\NDS-WKS-SN1234-2020-11-06-09-59-21-0007-6e-Beam\\Results.csv",
+     "NDS-WKS-SN1234-2020-11-06-09-59-21-0007-6e-Beam"),
+    ("/TDS/NDS-WKS-SN1234-2020-11-06-09-59-21-0007-6e-Beam/", "NDS-WKS-SN1234-2020-11-06-09-59-21-0007-6e-Beam"),
+])
+def test_mpc_dir_name(path, expected):
+    assert mpc.mpc_dir_name(path) == expected
+
+
 def test_group_by_metas():
 
     dir_names = [
@@ -423,6 +458,200 @@ def test_timestamp_filter(ts, cutoff, expected):
     assert mpc.timestamp_filter(ts, cutoff) == expected
 
 
+@pytest.mark.parametrize("name,expected", [
+    ("NDS-WKS-SN5678-2020-06-25-07-11-30-0000-GeometryCheckTemplate6xMVkVEnhancedCouch", dt(2020, 6, 25, 7, 11, 30)),
+    ("NDS-WKS-SN4321-2019-02-12-20-42-28-0009-6x-Geometry", dt(2019, 2, 12, 20, 42, 28)),
+    ("MPCChecks", None),
+    ("NDS-WKS-SN4321-2019-13-45-20-42-28-0009-6x-Geometry", None),
+])
+def test_mpc_dir_date(name, expected):
+    assert mpc.mpc_dir_date(name) == expected
+
+
+@pytest.fixture
+def tds_dir(tmp_path):
+    """TDS directory with one old and one recent MPC result"""
+    old = "NDS-WKS-SN1234-2019-02-12-20-42-28-0000-BeamCheckTemplate6x"
+    new = "NDS-WKS-SN1234-2020-06-25-07-11-30-0000-BeamCheckTemplate6x"
+    for name in [old, new]:
+        results_dir = tmp_path / "H191234" / "MPCChecks" / name
+        results_dir.mkdir(parents=True)
+        (results_dir / "Results.csv").write_text("")
+        (results_dir / "Other.csv").write_text("")
+    (tmp_path / "H191234" / "Other" / new).mkdir(parents=True)
+    (tmp_path / "H191234" / "Other" / new / "Results.csv").write_text("")
+    (tmp_path / "H191234" / "MPCChecks" / "Results.txt").write_text("")
+    return tmp_path
+
+
+def test_find_results_files_fast(tds_dir):
+    paths = mpc.find_results_files(str(tds_dir), dt(2020, 6, 1))
+    assert sorted(p.relative_to(tds_dir).as_posix() for p in paths) == [
+        "H191234/MPCChecks/NDS-WKS-SN1234-2020-06-25-07-11-30-0000-BeamCheckTemplate6x/Other.csv",
+        "H191234/MPCChecks/NDS-WKS-SN1234-2020-06-25-07-11-30-0000-BeamCheckTemplate6x/Results.csv",
+    ]
+
+
+def test_find_results_files_slow(tds_dir):
+    paths = mpc.find_results_files(str(tds_dir), dt(2020, 6, 1), fast_search=False)
+    assert sorted(p.relative_to(tds_dir).as_posix() for p in paths) == [
+        "H191234/MPCChecks/NDS-WKS-SN1234-2020-06-25-07-11-30-0000-BeamCheckTemplate6x/Results.csv",
+        "H191234/Other/NDS-WKS-SN1234-2020-06-25-07-11-30-0000-BeamCheckTemplate6x/Results.csv",
+    ]
+
+
+def test_find_results_files_prunes_old_dirs(tds_dir):
+    with mock.patch("qcpump.contrib.pumps.mpc.mpc.timestamp_filter", return_value=True) as ts_filter:
+        paths = mpc.find_results_files(str(tds_dir), dt(2020, 6, 1))
+    assert len(paths) == 2
+    assert ts_filter.call_count == 2
+
+
+@pytest.mark.parametrize("fast_search", [True, False])
+def test_find_results_files_invalid_dir_date(tds_dir, fast_search):
+    bad = tds_dir / "H191234" / "MPCChecks" / "NDS-WKS-SN1234-2020-13-45-07-11-30-0000-BeamCheckTemplate6x"
+    bad.mkdir()
+    (bad / "Results.csv").write_text("")
+    paths = mpc.find_results_files(str(tds_dir), dt(2020, 6, 1), fast_search=fast_search)
+    assert bad / "Results.csv" in paths
+
+
+def test_find_results_files_missing_dir(tmp_path):
+    assert mpc.find_results_files(str(tmp_path / "missing"), dt(2020, 6, 1)) == []
+
+
+@pytest.mark.parametrize("fast_search", [True, False])
+def test_find_results_files_cached(tds_dir, tmp_path, fast_search):
+    cache = mpc.ScanCache(tmp_path / "cache.json")
+    cache.check_config((str(tds_dir), fast_search))
+    expected = mpc.find_results_files(str(tds_dir), dt(2020, 6, 1), fast_search)
+    assert sorted(mpc.find_results_files(str(tds_dir), dt(2020, 6, 1), fast_search, cache)) == sorted(expected)
+    assert cache.hits == 0
+
+    misses = cache.misses
+    assert sorted(mpc.find_results_files(str(tds_dir), dt(2020, 6, 1), fast_search, cache)) == sorted(expected)
+    assert cache.hits == misses
+    assert cache.misses == misses
+
+
+@pytest.mark.parametrize("fast_search", [True, False])
+def test_filter_results_files(tds_dir, fast_search):
+    all_paths = [p for p in tds_dir.rglob("*") if p.is_file()] + [tds_dir / "missing.csv"]
+    expected = mpc.find_results_files(str(tds_dir), dt(2020, 6, 1), fast_search)
+    filtered = mpc.filter_results_files(all_paths, str(tds_dir), dt(2020, 6, 1), fast_search)
+    assert sorted(filtered) == sorted(expected)
+
+
+@pytest.mark.parametrize("path,fast_search,expected", [
+    ("H191234", True, True),
+    ("H191234/MPCChecks", True, True),
+    ("H191234/Other", True, False),
+    ("H191234/Other", False, True),
+    ("H191234/MPCChecks/NDS-WKS-SN1234-2020-06-25-07-11-30-0000-BeamCheckTemplate6x", True, True),
+    ("H191234/MPCChecks/NDS-WKS-SN1234-2019-02-12-20-42-28-0000-BeamCheckTemplate6x", True, False),
+])
+def test_is_results_dir(tmp_path, path, fast_search, expected):
+    assert mpc.is_results_dir(tmp_path / path, str(tmp_path), dt(2020, 6, 1), fast_search) == expected
+
+
+@pytest.mark.parametrize("name,expected", [
+    ("CollimationGroup/MLCGroup/MLCLeavesA/MLCLeaf1 [mm]", True),
+    ("CollimationDevicesGroup/MLCBacklashGroup/MLCBacklashLeavesB/MLCBacklashLeaf60 [mm]", True),
+    ("CollimationGroup/MLCGroup/MLCMaxOffsetA [mm]", False),
+    ("Some.Test (1+2)", True),
+])
+def test_compile_excluded_tests(name, expected):
+    excluded = mpc.compile_excluded_tests(mpc.QATrackMPCPump.EXCLUDED_TESTS + ["Some.Test (1+2)", ""])
+    assert bool(excluded.search(name)) == expected
+
+
+def test_compile_excluded_tests_empty():
+    assert mpc.compile_excluded_tests(["", ""]).search("anything") is None
+
+
+RESULTS_CSV = """Name [Unit],Value,Threshold,Evaluation Result
+BeamGroup/BeamOutputChange [%],0.52,2,Pass
+BeamGroup/BeamUniformityChange [%],abc,,Pass
+"""
+
+
+def test_parse_results_csv():
+    assert mpc.parse_results_csv(RESULTS_CSV, mpc.MPC_CSV_DIALECT) == [
+        ("BeamGroup/BeamOutputChange [%]", 0.52, 2.0, "Pass"),
+        ("BeamGroup/BeamUniformityChange [%]", None, None, "Pass"),
+    ]
+
+
+def test_parse_results_csv_wrong_dialect():
+    text = RESULTS_CSV.replace(",", ";").replace("0.52", "0,52")
+    assert mpc.parse_results_csv(text, mpc.MPC_CSV_DIALECT) is None
+
+
+def test_read_results_csv_known_dialect():
+    with mock.patch("csv.Sniffer.sniff") as sniff:
+        rows, dialect = mpc.read_results_csv(RESULTS_CSV)
+    assert not sniff.called
+    assert dialect is mpc.MPC_CSV_DIALECT
+    assert rows[0] == ("BeamGroup/BeamOutputChange [%]", 0.52, 2.0, "Pass")
+
+
+def test_read_results_csv_sniffed():
+    text = RESULTS_CSV.replace(",", ";").replace("0.52", "0,52")
+    rows, dialect = mpc.read_results_csv(text)
+    assert dialect.delimiter == ";"
+    assert rows[0] == ("BeamGroup/BeamOutputChange [%]", 0.52, 2.0, "Pass")
+
+    # sniffed dialect is tried first next time
+    with mock.patch("csv.Sniffer.sniff") as sniff:
+        __, dialect2 = mpc.read_results_csv(text, dialect)
+    assert not sniff.called
+    assert dialect2 is dialect
+
+
+def test_parse_results_csv_truncated():
+    text = RESULTS_CSV.strip()[:-8]
+    with pytest.raises(ValueError, match="truncated"):
+        mpc.parse_results_csv(text, mpc.MPC_CSV_DIALECT)
+    with mock.patch("csv.Sniffer.sniff") as sniff:
+        with pytest.raises(ValueError):
+            mpc.read_results_csv(text)
+    assert not sniff.called
+
+
+def test_parse_results_csv_short_row_padded():
+    text = RESULTS_CSV.replace("abc,,Pass", "abc") + "BeamGroup/BeamCenterShift [mm],0.1,0.5,Pass\n"
+    assert mpc.parse_results_csv(text, mpc.MPC_CSV_DIALECT) == [
+        ("BeamGroup/BeamOutputChange [%]", 0.52, 2.0, "Pass"),
+        ("BeamGroup/BeamUniformityChange [%]", None, None, ""),
+        ("BeamGroup/BeamCenterShift [mm]", 0.1, 0.5, "Pass"),
+    ]
+
+
+def test_read_results_csv_bom():
+    rows, dialect = mpc.read_results_csv("\ufeff" + RESULTS_CSV)
+    assert dialect is mpc.MPC_CSV_DIALECT
+    assert rows[0] == ("BeamGroup/BeamOutputChange [%]", 0.52, 2.0, "Pass")
+
+
+def test_parse_results_csv_empty():
+    with pytest.raises(ValueError):
+        mpc.read_results_csv("")
+
+
+def test_parse_results_csv_bad_header():
+    bracket = csv.excel()
+    bracket.delimiter = "]"
+    assert mpc.parse_results_csv(RESULTS_CSV, bracket) is None
+
+
+def test_read_results_csv_ignores_bad_known_dialect():
+    bracket = csv.excel()
+    bracket.delimiter = "]"
+    rows, dialect = mpc.read_results_csv(RESULTS_CSV, bracket)
+    assert dialect is mpc.MPC_CSV_DIALECT
+    assert rows[0] == ("BeamGroup/BeamOutputChange [%]", 0.52, 2.0, "Pass")
+
+
 class TestQATrackMPCPump:
 
     def setup_class(self):
@@ -536,27 +765,117 @@ class TestQATrackMPCPump:
         for sn, template, date, paths in expected_grouped:
             expected_grouped_with_meta.append((sn, template, date, list([mpc.mpc_path_to_meta(p) for p in paths])))
 
+        self.pump.window_tracker = mpc.WindowTracker()
         self.pump.state = {
-            "MPC": {'subsections': [[{'config_name': 'grouping window', 'value': 3}]]}
+            "MPC": {'subsections': [[{'config_name': 'wait time', 'value': 0}]]}
         }
-        assert self.pump.group_records(dir_names) == expected_grouped_with_meta
+        self.pump.add_paths(dir_names, 3)
+        key = lambda r: (r[0], r[1], r[2])  # noqa: E731
+        assert sorted(self.pump.complete_groups(), key=key) == sorted(expected_grouped_with_meta, key=key)
 
-    def test_filter_records(self):
+    def test_complete_groups(self):
 
-        records = [
-            ("5678", mpc.ENH_COUCH_CHECKS, "2020-06-25-07-11", [
-                mpc.mpc_path_to_meta("NDS-WKS-SN5678-2020-06-25-07-11-30-0000-GeometryCheckTemplate6xMVkVEnhancedCouch")]),  # noqa: E501
-            ("6789", mpc.ENH_MLC_CHECKS, "2020-09-30-09-15", [
-                mpc.mpc_path_to_meta("NDS-WKS-SN6789-2020-09-30-09-15-17-0011-EnhancedMLCCheckTemplate6x")]),
-            ("1234", mpc.ENH_MLC_CHECKS, "2020-09-30-09-15", [
-                mpc.mpc_path_to_meta("NDS-WKS-SN1234-2020-09-30-09-15-17-0011-EnhancedMLCCheckTemplate6x")]),
+        dir_names = [
+            "NDS-WKS-SN5678-2020-06-25-07-11-30-0000-GeometryCheckTemplate6xMVkVEnhancedCouch",
+            "NDS-WKS-SN6789-2020-09-30-09-15-17-0011-EnhancedMLCCheckTemplate6x",
+            "NDS-WKS-SN1234-2020-09-30-09-15-17-0011-EnhancedMLCCheckTemplate6x",
         ]
+        self.pump.window_tracker = mpc.WindowTracker()
+        self.pump.add_paths(dir_names, 3)
 
         cutoff = (dt.now() - dt(2020, 7, 1)).days*24*60
         self.pump.state = {
             "MPC": {'subsections': [[{'config_name': 'wait time', 'value': cutoff}]]}
         }
-        assert self.pump.filter_records(records) == records[:1]
+        expected = [
+            ("5678", mpc.ENH_COUCH_CHECKS, "2020-06-25-07-11", [mpc.mpc_path_to_meta(dir_names[0])]),
+        ]
+        assert self.pump.complete_groups() == expected
+
+        # groups are returned until they are marked done
+        assert self.pump.complete_groups() == expected
+        with mock.patch("qcpump.pumps.common.qatrack.QATrackFetchAndPost._is_already_recorded", return_value=True):
+            assert self.pump._is_already_recorded(expected[0])
+        assert self.pump.complete_groups() == []
+
+        # known paths are not grouped again
+        self.pump.add_paths(dir_names, 3)
+        assert len(self.pump.window_tracker) == 2
+
+    def read_and_post(self, record, during_upload=None):
+        """Read the record's files then post process it as an upload would"""
+        with mock.patch.object(self.pump, "get_config_value", return_value=None), \
+                mock.patch.object(self.pump, "excluded_tests_matcher"), \
+                mock.patch.object(self.pump, "read_results_files", return_value=[]):
+            assert self.pump.test_values_from_record(record) == {}
+        if during_upload:
+            during_upload()
+        with mock.patch("qcpump.pumps.common.qatrack.QATrackFetchAndPost.post_process"):
+            self.pump.post_process(record)
+
+    def test_fingerprinted_records_skipped(self, tmp_path):
+        results = tmp_path / "Results.csv"
+        results.write_text("")
+        record = ("5678", mpc.ENH_COUCH_CHECKS, "2020-06-25-07-11", [{'path': results}])
+        self.pump.get_pump_data_path = mock.Mock(return_value=tmp_path / mpc.FINGERPRINTS_FILE)
+        self.pump.fingerprints = None
+        self.pump.group_done = mock.Mock()
+        self.pump.log_warning = mock.Mock()
+        try:
+            self.read_and_post(record)
+            with mock.patch("qcpump.pumps.common.qatrack.QATrackFetchAndPost._is_already_recorded") as api_check:
+                assert self.pump._is_already_recorded(record)
+            assert not api_check.called
+            assert not self.pump.log_warning.called
+
+            # files changed after upload are flagged but not uploaded again
+            os.utime(results, ns=(0, 10**9))
+            with mock.patch("qcpump.pumps.common.qatrack.QATrackFetchAndPost._is_already_recorded") as api_check:
+                assert self.pump._is_already_recorded(record)
+            assert not api_check.called
+            assert "have changed" in self.pump.log_warning.call_args[0][0]
+            assert self.pump.fingerprints.changed(self.pump.id_for_record(record))
+        finally:
+            del self.pump.group_done
+            del self.pump.log_warning
+            del self.pump.get_pump_data_path
+            self.pump.fingerprints = None
+
+    def test_files_changed_during_upload_flagged(self, tmp_path):
+        results = tmp_path / "Results.csv"
+        results.write_text("")
+        record = ("5678", mpc.ENH_COUCH_CHECKS, "2020-06-25-07-11", [{'path': results}])
+        self.pump.get_pump_data_path = mock.Mock(return_value=tmp_path / mpc.FINGERPRINTS_FILE)
+        self.pump.fingerprints = None
+        self.pump.group_done = mock.Mock()
+        self.pump.log_warning = mock.Mock()
+        try:
+            self.read_and_post(record, during_upload=lambda: os.utime(results, ns=(0, 10**9)))
+            assert self.pump._is_already_recorded(record)
+            assert "have changed" in self.pump.log_warning.call_args[0][0]
+        finally:
+            del self.pump.group_done
+            del self.pump.log_warning
+            del self.pump.get_pump_data_path
+            self.pump.fingerprints = None
+
+    def test_unfingerprinted_records_checked(self, tmp_path):
+        results = tmp_path / "Results.csv"
+        results.write_text("")
+        record = ("5678", mpc.ENH_COUCH_CHECKS, "2020-06-25-07-11", [{'path': results}])
+        self.pump.get_pump_data_path = mock.Mock(return_value=tmp_path / mpc.FINGERPRINTS_FILE)
+        self.pump.fingerprints = None
+        self.pump.group_done = mock.Mock()
+        try:
+            api_check_path = "qcpump.pumps.common.qatrack.QATrackFetchAndPost._is_already_recorded"
+            with mock.patch(api_check_path, return_value=True) as api_check:
+                assert self.pump._is_already_recorded(record)
+            assert api_check.called
+            assert self.pump.fingerprints.get(self.pump.id_for_record(record))
+        finally:
+            del self.pump.group_done
+            del self.pump.get_pump_data_path
+            self.pump.fingerprints = None
 
     def test_id_for_record(self):
         record = ("5678", mpc.BEAM_AND_GEOMETRY_CHECKS, "2020-06-25-07-11", [])
@@ -587,7 +906,11 @@ class TestQATrackMPCPump:
 
     def test_values_from_record(self):
         self.pump.state = {
-            "QATrack+ API": {'subsections': [[{'config_name': 'include comment', 'value': True}]]}
+            "QATrack+ API": {'subsections': [[{'config_name': 'include comment', 'value': True}]]},
+            "MPC": {'subsections': [[
+                {'config_name': 'tds directory', 'value': "I:/TDS"},
+                {'config_name': 'excluded tests', 'value': ""},
+            ]]},
         }
         rows = io.StringIO("""Name [Unit],Value,Threshold,Evaluation Result
 CollimationGroup/MLCGroup/MLCMaxOffsetA [mm],0.4,1,Pass
@@ -632,7 +955,11 @@ CollimationGroup/MLCGroup/MLCLeavesA/MLCLeaf4 [mm],0.23,1,Pass
 
     def test_values_from_record_no_comment(self):
         self.pump.state = {
-            "QATrack+ API": {'subsections': [[{'config_name': 'include comment', 'value': False}]]}
+            "QATrack+ API": {'subsections': [[{'config_name': 'include comment', 'value': False}]]},
+            "MPC": {'subsections': [[
+                {'config_name': 'tds directory', 'value': "I:/TDS"},
+                {'config_name': 'excluded tests', 'value': ""},
+            ]]},
         }
         rows = io.StringIO("""Name [Unit],Value,Threshold,Evaluation Result
 CollimationGroup/MLCGroup/MLCMaxOffsetA [mm],0.4,1,Pass
@@ -663,9 +990,73 @@ CollimationGroup/MLCGroup/MLCLeavesA/MLCLeaf4 [mm],0.23,1,Pass
         }
         assert res == expected
 
-    def test_fetch_records(self):
+    def test_values_from_record_concurrent_reads(self):
+        self.pump.state = {
+            "QATrack+ API": {'subsections': [[{'config_name': 'include comment', 'value': False}]]},
+            "MPC": {'subsections': [[
+                {'config_name': 'tds directory', 'value': "I:/TDS"},
+                {'config_name': 'excluded tests', 'value': ""},
+                {'config_name': 'read workers', 'value': 4},
+            ]]},
+        }
+
+        metas = []
+        for idx in range(8):
+            path_mock = mock.MagicMock()
+            path_mock.open.return_value = io.StringIO(
+                "Name [Unit],Value,Threshold,Evaluation Result\n"
+                f"BeamGroup/BeamOutputChange [%],{idx},2,Pass\n"
+                f"BeamGroup/Beam{idx} [%],{idx},2,Pass\n"
+            )
+            metas.append({'path': path_mock, 'energy': '6', 'beam_type': 'X', 'delay': 0.01 * (8 - idx)})
+
+        read_results_file = self.pump.read_results_file
+
+        def slow_read_results_file(meta):
+            # make earlier files finish reading last
+            time.sleep(meta['delay'])
+            return read_results_file(meta)
+
+        record = ("5678", mpc.BEAM_AND_GEOMETRY_CHECKS, "2020-06-25-07-11", metas)
+        with mock.patch.object(self.pump, "read_results_file", side_effect=slow_read_results_file):
+            res = self.pump.test_values_from_record(record)
+
+        assert res['beamgroup_beamoutputchange_per_6x'] == {'value': 7.0}
+        assert len(res) == 9
+
+    def test_values_from_record_unreadable(self):
+        self.pump.state = {
+            "QATrack+ API": {'subsections': [[{'config_name': 'include comment', 'value': False}]]},
+            "MPC": {'subsections': [[
+                {'config_name': 'tds directory', 'value': "I:/TDS"},
+                {'config_name': 'excluded tests', 'value': ""},
+            ]]},
+        }
+        self.pump._csv_dialects = {}
+        truncated = mock.MagicMock()
+        truncated.open.return_value = io.StringIO(RESULTS_CSV.strip()[:-8])
+        good = mock.MagicMock()
+        good.open.return_value = io.StringIO(RESULTS_CSV)
+        record = ("5678", mpc.BEAM_AND_GEOMETRY_CHECKS, "2020-06-25-07-11", [
+            {'path': truncated, 'energy': '6', 'beam_type': 'X'},
+        ])
+        with mock.patch.object(self.pump, "log_error") as log_error:
+            assert self.pump.test_values_from_record(record) is None
+        assert "truncated" in log_error.call_args[0][0]
+
+        # the truncated file doesn't change how later files are read
+        assert self.pump._csv_dialects == {}
+        record = ("5678", mpc.BEAM_AND_GEOMETRY_CHECKS, "2020-06-25-07-11", [
+            {'path': good, 'energy': '6', 'beam_type': 'X'},
+        ])
+        res = self.pump.test_values_from_record(record)
+        assert res['beamgroup_beamoutputchange_per_6x'] == {'value': 0.52}
+
+    def test_fetch_records(self, tmp_path):
         """This test is weak :p"""
 
+        self.pump.get_pump_data_path = mock.Mock(return_value=tmp_path / mpc.SCAN_CACHE_FILE)
+
         self.pump.state = {
             "MPC": {
                 'subsections': [[
@@ -673,10 +1064,69 @@ CollimationGroup/MLCGroup/MLCLeavesA/MLCLeaf4 [mm],0.23,1,Pass
                     {'config_name': 'history days', 'value': 1},
                     {'config_name': 'wait time', 'value': 1},
                 ]],
-            }
+            },
+            "Watch": {
+                'subsections': [[
+                    {'config_name': 'enabled', 'value': False},
+                ]],
+            },
         }
         assert self.pump.fetch_records() == []
 
+    def test_fetch_records_skips_invalid_dirs(self, tmp_path):
+        tds = tmp_path / "TDS"
+        good = tds / "H191234" / "MPCChecks" / (dt.now() - timedelta(hours=1)).strftime(
+            "NDS-WKS-SN1234-%Y-%m-%d-%H-%M-%S-0000-BeamCheckTemplate6x"
+        )
+        bad = tds / "H191234" / "MPCChecks" / "NDS-WKS-SN1234-2020-13-45-07-11-30-0000-BeamCheckTemplate6x"
+        for results_dir in [good, bad, good / "Nested"]:
+            results_dir.mkdir(parents=True)
+            (results_dir / "Results.csv").write_text("")
+
+        pump = mpc.QATrackMPCPump()
+        pump.log = mock.Mock()
+        pump.get_pump_data_path = mock.Mock(return_value=tmp_path / mpc.SCAN_CACHE_FILE)
+        pump.state = {
+            "MPC": {
+                'subsections': [[
+                    {'config_name': 'tds directory', 'value': str(tds)},
+                    {'config_name': 'fast search', 'value': False},
+                    {'config_name': 'history days', 'value': 1},
+                    {'config_name': 'grouping window', 'value': 20},
+                    {'config_name': 'wait time', 'value': 1},
+                ]],
+            },
+            "Watch": {'subsections': [[{'config_name': 'enabled', 'value': False}]]},
+        }
+        with mock.patch.object(pump, "log_warning") as log_warning:
+            records = pump.fetch_records()
+            assert [[m['path'] for m in metas] for sn, template, date, metas in records] == [
+                [(good / "Results.csv").absolute()],
+            ]
+            assert log_warning.call_count == 2
+
+            # unparseable paths are only reported once
+            pump.fetch_records()
+            assert log_warning.call_count == 2
+
+    def test_include_test(self):
+        self.pump.state = {
+            "MPC": {'subsections': [[{'config_name': 'excluded tests', 'value': "MLCMaxOffsetA, Couch"}]]},
+        }
+        assert not self.pump.include_test("CollimationGroup/MLCGroup/MLCLeavesA/MLCLeaf1 [mm]")
+        assert not self.pump.include_test("CollimationGroup/MLCGroup/MLCMaxOffsetA [mm]")
+        assert not self.pump.include_test("CouchGroup/CouchLat [mm]")
+        assert self.pump.include_test("CollimationGroup/MLCGroup/MLCMaxOffsetB [mm]")
+
+    def test_excluded_tests_matcher_cached(self):
+        self.pump.state = {
+            "MPC": {'subsections': [[{'config_name': 'excluded tests', 'value': "Foo"}]]},
+        }
+        matcher = self.pump.excluded_tests_matcher()
+        assert self.pump.excluded_tests_matcher() is matcher
+        self.pump.state["MPC"]['subsections'][0][0]['value'] = "Bar"
+        assert self.pump.excluded_tests_matcher() is not matcher
+
     def test_comment_for_record(self):
         res = self.pump.comment_for_record(("123", "", "", [{'path': r"I:\Foo\Bar"}]))
         assert res == "Fileset:\n\tI:\\Foo\\Bar"
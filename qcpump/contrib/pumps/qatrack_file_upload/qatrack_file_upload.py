@@ -4,9 +4,12 @@ from pathlib import Path
 
 from qcpump.pumps.base import STRING, BasePump, DIRECTORY, BOOLEAN, MULTCHOICE
 from qcpump.pumps.common.qatrack import QATrackFetchAndPostTextFile, QATrackFetchAndPostBinaryFile
+from qcpump.pumps.common.stability import StableFiles
+from qcpump.pumps.common.transfer import VERIFY_FIELD, move_file
+from qcpump.pumps.common.watcher import WatchDirectories
 
 
-class BaseQATrackGenericUploader:
+class BaseQATrackGenericUploader(StableFiles, WatchDirectories):
 
     TEST_LIST_CONFIG = {
         'name': "Test List",
@@ -74,6 +77,20 @@ class BaseQATrackGenericUploader:
         ],
     }
 
+    TRANSFER_CONFIG = {
+        'name': 'Transfer',
+        'multiple': False,
+        'fields': [
+            dict(
+                VERIFY_FIELD,
+                help=(
+                    "When uploaded files are moved to another volume, compare SHA-256 checksums of each file "
+                    "and its copy before removing the original."
+                ),
+            ),
+        ],
+    }
+
     DIRECTORY_CONFIG = {
         'name': 'Directories',
         'multiple': True,
@@ -130,6 +147,8 @@ class BaseQATrackGenericUploader:
 
         records = []
         self.move_to = {}
+        seen = []
+        watched = self.recheck_paths(self.watched_paths())
         for unit_dir in self.get_config_values("Directories"):
             path_searcher = searcher_config.copy()
             path_searcher.update(unit_dir)
@@ -137,32 +156,50 @@ class BaseQATrackGenericUploader:
             from_dir = path_searcher['source']
             to_dir = path_searcher['destination']
 
-            paths = self.get_paths(path_searcher)
-            for path in paths:
+            found = self.get_paths(path_searcher, watched)
+            seen.extend(found)
+            for path in self.stable_paths(found):
                 move_to = Path(str(path).replace(from_dir, to_dir)) if to_dir else None
                 records.append((unit_dir['unit name'], path, move_to))
 
+        if watched is None:
+            self.prune_stability(seen)
+
         return records
 
     def post_process(self, record):
         unit, path, move_to = record
 
+        verify = bool(self.get_config_value("Transfer", "verify"))
         try:
             move_to.parent.mkdir(parents=True, exist_ok=True)
-            path.replace(move_to)
+            # moves to another volume are copied (and optionally verified) before the upload is removed
+            __, digest = move_file(path, move_to, verify=verify)
             msg = f"Moved {path} to {move_to}"
+            if digest is not None:
+                msg += f" (verified sha256 {digest})"
         except Exception as e:
             msg = f"Failed to move {path} to {move_to}: {e}"
 
         self.log_info(msg)
 
-    def get_paths(self, mover):
-        """Get a listing of all files in our source directory and filter them based on our config options"""
+    def get_paths(self, mover, watched=None):
+        """Get a listing of all files in our source directory (or the watched
+        paths written since the last run) and filter them based on our config
+        options"""
+        if watched is not None:
+            all_paths = self.filter_watched_paths(watched, mover['source'], mover['pattern'], mover['recursive'])
+            return self.filter_paths(all_paths, mover['ignore pattern'])
+
         globber = self.construct_globber(mover['pattern'], mover['recursive'])
         self.log_debug(f"Getting paths with globber: '{globber}' and mover: {mover}")
         all_paths = Path(mover['source']).glob(globber)
         return self.filter_paths(all_paths, mover['ignore pattern'])
 
+    def watch_roots(self):
+        recursive = self.get_config_value("File Types", "recursive")
+        return [(unit_dir['source'], recursive) for unit_dir in self.get_config_values("Directories")]
+
     def construct_globber(self, pattern, recursive):
         """Consutruct a globber for reading from our source directory"""
         return f"**/{pattern}" if recursive else pattern
@@ -214,6 +251,9 @@ class QATrackGenericTextFileUploader(BaseQATrackGenericUploader, QATrackFetchAnd
         BaseQATrackGenericUploader.TEST_LIST_CONFIG,
         BaseQATrackGenericUploader.FILE_TYPE_CONFIGS,
         BaseQATrackGenericUploader.DIRECTORY_CONFIG,
+        BaseQATrackGenericUploader.WATCH_CONFIG,
+        BaseQATrackGenericUploader.STABILITY_CONFIG,
+        BaseQATrackGenericUploader.TRANSFER_CONFIG,
     ]
 
 
@@ -227,4 +267,7 @@ class QATrackGenericBinaryFileUploader(BaseQATrackGenericUploader, QATrackFetchA
         BaseQATrackGenericUploader.TEST_LIST_CONFIG,
         BaseQATrackGenericUploader.FILE_TYPE_CONFIGS,
         BaseQATrackGenericUploader.DIRECTORY_CONFIG,
+        BaseQATrackGenericUploader.WATCH_CONFIG,
+        BaseQATrackGenericUploader.STABILITY_CONFIG,
+        BaseQATrackGenericUploader.TRANSFER_CONFIG,
     ]
@@ -1,6 +1,12 @@
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import contextlib
+import logging
 import os
+from pathlib import Path
 import sqlite3
+import threading
+import time
 
 import fdb
 import firebirdsql
@@ -11,24 +17,137 @@ from qcpump.settings import Settings
 
 settings = Settings()
 
+logger = logging.getLogger(__name__)
 
-def db_query(driver, connect_kwargs, statement, params=None, fetch_method="fetchall"):
+# Firebird allows at most 1500 items in an IN (...) list and SQL Server allows
+# at most 2100 parameters in a single statement
+MAX_IN_ITEMS = 1500
+MAX_QUERY_PARAMS = {
+    'fdb': 1500,
+    'firebirdsql': 1500,
+    'mssql': 2100,
+    'atlas': 2100,
+    'sqlite': 999,
+}
+
+
+class QueryTiming(namedtuple("QueryTiming", ["statement", "connect", "execute", "fetch", "rows"])):
+    """Durations (in ms) spent connecting, executing and fetching results for a single statement"""
+
+    __slots__ = ()
+
+    @property
+    def total(self):
+        return self.connect + self.execute + self.fetch
+
+    @property
+    def label(self):
+        """Short single line description of the statement suitable for logging"""
+        label = ' '.join(self.statement.split())
+        return label if len(label) <= 60 else label[:57] + "..."
+
+    def __str__(self):
+        return (
+            f"connect={self.connect:.0f}ms execute={self.execute:.0f}ms fetch={self.fetch:.0f}ms "
+            f"total={self.total:.0f}ms rows={self.rows}"
+        )
+
+
+class QueryStats:
+    """
+    Rolling statistics for the most recent `maxlen` queries.  Pumps can
+    create one of these and pass it to any of the query functions below as
+    the `stats` argument. If `warn` is set, it will be called with a
+    message for any query which takes longer than settings.SLOW_QUERY_MS.
+    """
+
+    def __init__(self, maxlen=100, warn=None):
+        self.timings = deque(maxlen=maxlen)
+        self.warn = warn
+        self._lock = threading.Lock()
+
+    def record(self, timing):
+        with self._lock:
+            self.timings.append(timing)
+
+    @property
+    def last(self):
+        with self._lock:
+            return self.timings[-1] if self.timings else None
+
+    def summary(self):
+        """Return a dict of mean connect/execute/fetch durations (ms), max total duration & mean row count"""
+        with self._lock:
+            timings = list(self.timings)
+
+        if not timings:
+            return {'count': 0}
+
+        n = len(timings)
+        return {
+            'count': n,
+            'connect': sum(t.connect for t in timings) / n,
+            'execute': sum(t.execute for t in timings) / n,
+            'fetch': sum(t.fetch for t in timings) / n,
+            'max': max(t.total for t in timings),
+            'rows': sum(t.rows for t in timings) / n,
+        }
+
+    def __str__(self):
+        s = self.summary()
+        if not s['count']:
+            return "No queries recorded"
+        return (
+            f"{s['count']} queries: mean connect={s['connect']:.0f}ms execute={s['execute']:.0f}ms "
+            f"fetch={s['fetch']:.0f}ms max total={s['max']:.0f}ms mean rows={s['rows']:.0f}"
+        )
+
+
+def record_query_timing(timing, stats=None):
+    """Add timing to stats (if given) and warn about slow queries"""
+
+    if stats is not None:
+        stats.record(timing)
+
+    slow_query_ms = settings.SLOW_QUERY_MS
+    if slow_query_ms and timing.total > slow_query_ms:
+        warn = stats.warn if stats is not None and stats.warn else logger.warning
+        warn(f"Slow query ({timing}): {timing.label}")
+
+
+def db_query(driver, connect_kwargs, statement, params=None, fetch_method="fetchall", stats=None):
 
     params = params or ()
     params = tuple(params)
 
+    start = time.perf_counter()
     with contextlib.closing(driver.connect(**connect_kwargs)) as conn:
+        connected = time.perf_counter()
         with conn:
             with contextlib.closing(conn.cursor()) as cursor:
                 cursor.execute(statement, params)
+                executed = time.perf_counter()
                 if fetch_method == "fetchallmap":
                     columns = [d[0].lower() for d in cursor.description]
-                    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+                    results = [dict(zip(columns, row)) for row in cursor.fetchall()]
                 else:
-                    return getattr(cursor, fetch_method, cursor.fetchall)()
+                    results = getattr(cursor, fetch_method, cursor.fetchall)()
+                fetched = time.perf_counter()
+
+    rows = len(results) if isinstance(results, list) else int(results is not None)
+    timing = QueryTiming(
+        statement,
+        1000 * (connected - start),
+        1000 * (executed - connected),
+        1000 * (fetched - executed),
+        rows,
+    )
+    record_query_timing(timing, stats)
 
+    return results
 
-def fdb_query(connect_kwargs, statement, params=None, fetch_method="fetchall"):
+
+def fdb_query(connect_kwargs, statement, params=None, fetch_method="fetchall", stats=None):
     """
     Execute an FDB query and return results. Form of connect_kwargs is e.g.
 
@@ -40,10 +159,10 @@ def fdb_query(connect_kwargs, statement, params=None, fetch_method="fetchall"):
         "port": 3050,
     }
     """
-    return db_query(fdb, connect_kwargs, statement, params=params, fetch_method=fetch_method)
+    return db_query(fdb, connect_kwargs, statement, params=params, fetch_method=fetch_method, stats=stats)
 
 
-def firebirdsql_query(connect_kwargs, statement, params=None, fetch_method="fetchall"):
+def firebirdsql_query(connect_kwargs, statement, params=None, fetch_method="fetchall", stats=None):
     """
     Execute an FDB query and return results. Form of connect_kwargs is e.g.
 
@@ -59,10 +178,10 @@ def firebirdsql_query(connect_kwargs, statement, params=None, fetch_method="fetc
     if 'timeout' not in connect_kwargs:
         connect_kwargs['timeout'] = settings.DB_CONNECT_TIMEOUT
 
-    return db_query(firebirdsql, connect_kwargs, statement, params=params, fetch_method=fetch_method)
+    return db_query(firebirdsql, connect_kwargs, statement, params=params, fetch_method=fetch_method, stats=stats)
 
 
-def sqlite_query(connect_kwargs, statement, params=None, fetch_method="fetchall"):
+def sqlite_query(connect_kwargs, statement, params=None, fetch_method="fetchall", stats=None):
     """
     Execute an SQLite3 query and return results. Form of connect_kwargs is e.g.
 
@@ -71,10 +190,10 @@ def sqlite_query(connect_kwargs, statement, params=None, fetch_method="fetchall"
     }
     """
 
-    return db_query(sqlite3, connect_kwargs, statement, params=params, fetch_method=fetch_method)
+    return db_query(sqlite3, connect_kwargs, statement, params=params, fetch_method=fetch_method, stats=stats)
 
 
-def mssql_query(connect_kwargs, statement, params=None, fetch_method="fetchall"):
+def mssql_query(connect_kwargs, statement, params=None, fetch_method="fetchall", stats=None):
     """
     Execute an MSSQL query and return results. Form of connect_kwargs is e.g.
 
@@ -94,4 +213,305 @@ def mssql_query(connect_kwargs, statement, params=None, fetch_method="fetchall")
     if 'timeout' not in connect_kwargs:
         connect_kwargs['timeout'] = settings.DB_CONNECT_TIMEOUT
 
-    return db_query(pyodbc, connect_kwargs, statement, params=params, fetch_method=fetch_method)
+    return db_query(pyodbc, connect_kwargs, statement, params=params, fetch_method=fetch_method, stats=stats)
+
+
+def in_batch_size(db_type, n_other_params=0):
+    """Return the maximum number of IN (...) items which can be used in a
+    single db_type query which also has n_other_params parameters"""
+    max_params = MAX_QUERY_PARAMS.get(db_type, MAX_IN_ITEMS)
+    return max(1, min(MAX_IN_ITEMS, max_params - n_other_params))
+
+
+def batched_query(
+    querier, connect_kwargs, prepare, items, batch_size, key=None, max_workers=1, fetch_method="fetchall", stats=None,
+    executor=None, timeout=None, kill_event=None,
+):
+    """
+    Run a query with an IN (...) list of items too large for a single
+    statement as multiple queries of at most batch_size items each.
+    prepare(batch) must return the (statement, params) for a batch of items.
+    Batches are run concurrently when max_workers > 1 or when a QueryExecutor
+    is given (in which case timeout & kill_event are passed to
+    QueryExecutor.submit).
+
+    When more than one batch is required and key is given, the results are
+    de-duplicated and sorted by row[key], e.g.
+
+        rows = batched_query(
+            fdb_query, connect_kwargs, prepare, unit_ids, in_batch_size("fdb", 2),
+            key="data_key", fetch_method="fetchallmap",
+        )
+    """
+
+    if not items:
+        return []
+
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+    def run(batch):
+        statement, params = prepare(batch)
+        return querier(connect_kwargs, statement, params=params, fetch_method=fetch_method, stats=stats)
+
+    if executor is not None:
+        futures = []
+        for batch in batches:
+            statement, params = prepare(batch)
+            futures.append(executor.submit(
+                querier, connect_kwargs, statement, params=params, fetch_method=fetch_method, stats=stats,
+                timeout=timeout, kill_event=kill_event,
+            ))
+        try:
+            results = [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+    elif max_workers > 1 and len(batches) > 1:
+        workers = min(max_workers, len(batches))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="qcpump-query") as executor:
+            results = list(executor.map(run, batches))
+    else:
+        results = [run(batch) for batch in batches]
+
+    if len(results) == 1:
+        return results[0]
+
+    if key is None:
+        return [row for batch_results in results for row in batch_results]
+
+    merged = {}
+    for batch_results in results:
+        for row in batch_results:
+            merged.setdefault(row[key], row)
+    return [merged[k] for k in sorted(merged)]
+
+
+class QueryCancelled(Exception):
+    """Raised when waiting for a query is abandoned because the pump was stopped"""
+
+
+class QueryTimeout(TimeoutError):
+    """Raised when a query did not complete within its timeout"""
+
+
+def server_key(connect_kwargs):
+    """Return a key identifying the database server for connect_kwargs"""
+    host = connect_kwargs.get('host') or connect_kwargs.get('server') or ""
+    if not host and connect_kwargs.get('dsn'):
+        host = connect_kwargs['dsn'].split(":")[0]
+    return (host.lower(), connect_kwargs.get('port'))
+
+
+class QueryFuture:
+    """
+    Wraps the concurrent.futures.Future for a submitted query. result()
+    raises QueryTimeout if the query has not completed within the timeout
+    (measured from when the query was submitted) and QueryCancelled as soon
+    as kill_event is set.
+
+    Most drivers can not interrupt a statement that is already executing so
+    a timed out or cancelled query is abandoned rather than stopped: it
+    continues to run in the background (holding its worker thread) until the
+    driver returns, and its results are discarded.
+    """
+
+    # how often (s) to check the kill_event while waiting for results
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, future, timeout=None, kill_event=None):
+        self.future = future
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.kill_event = kill_event
+        self.abandoned = threading.Event()
+
+    def cancel(self):
+        """Cancel the query if it hasn't started yet, otherwise abandon its results"""
+        self.abandoned.set()
+        return self.future.cancel()
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        while True:
+            wait = self.POLL_INTERVAL
+            if self.deadline is not None:
+                remaining = self.deadline - time.monotonic()
+                if remaining <= 0:
+                    self.cancel()
+                    raise QueryTimeout("Query did not complete before the timeout")
+                wait = min(wait, remaining)
+
+            try:
+                return self.future.result(timeout=wait)
+            except FutureTimeoutError:
+                pass
+
+            if self.kill_event is not None and self.kill_event.is_set():
+                self.cancel()
+                raise QueryCancelled("Query cancelled")
+
+
+class QueryExecutor:
+    """
+    Runs queries in the background on a bounded thread pool for each
+    querier (i.e. database driver), limiting the number of queries running
+    against any single database server at once, e.g.
+
+        future = query_executor.submit(fdb_query, connect_kwargs, "SELECT ...", timeout=10, kill_event=kill_event)
+        rows = future.result()
+
+    Since queries from pumps & config validation share the pools & server
+    limits, a slow query in one of them can't tie up the database server for
+    the others. Queries waiting for a server slot are held back until one is
+    free, rather than taking a pool thread, so that a slow server doesn't
+    starve queries to other servers of workers.
+    """
+
+    def __init__(self, max_workers=None, max_server_queries=None):
+        self.max_workers = max_workers or settings.DB_QUERY_WORKERS
+        self.max_server_queries = max_server_queries or settings.DB_SERVER_MAX_QUERIES
+        self.pools = {}
+        self.server_running = {}  # server key -> number of queries submitted to a pool
+        self.server_waiting = {}  # server key -> deque of (pool, run, future) waiting for a slot
+        self.lock = threading.Lock()
+
+    def get_pool(self, querier):
+        name = getattr(querier, "__name__", "query")
+        with self.lock:
+            if name not in self.pools:
+                self.pools[name] = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"qcpump-{name}")
+            return self.pools[name]
+
+    def submit(
+        self, querier, connect_kwargs, statement, params=None, fetch_method="fetchall", stats=None, timeout=None,
+        kill_event=None,
+    ):
+        """Submit a query to be run in the background and return a QueryFuture for its results"""
+
+        if timeout is None:
+            timeout = settings.DB_QUERY_TIMEOUT
+
+        def run():
+            if query_future.abandoned.is_set() or (kill_event is not None and kill_event.is_set()):
+                raise QueryCancelled("Query cancelled before it started")
+            return querier(connect_kwargs, statement, params=params, fetch_method=fetch_method, stats=stats)
+
+        query_future = QueryFuture(Future(), timeout=timeout, kill_event=kill_event)
+        job = (self.get_pool(querier), run, query_future.future)
+
+        key = server_key(connect_kwargs)
+        with self.lock:
+            running = self.server_running.get(key, 0)
+            if running >= self.max_server_queries:
+                self.server_waiting.setdefault(key, deque()).append(job)
+                return query_future
+            self.server_running[key] = running + 1
+
+        if not self.start(key, job):
+            self.release(key)
+        return query_future
+
+    def start(self, key, job):
+        """Submit a job holding a slot for server key to its pool. Returns
+        False if the job was cancelled before it could start"""
+
+        pool, run, future = job
+        if not future.set_running_or_notify_cancel():
+            return False
+
+        def work():
+            try:
+                result = run()
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                self.release(key)
+
+        try:
+            pool.submit(work)
+        except RuntimeError:
+            # pool was shut down while the job was waiting
+            future.set_exception(QueryCancelled("Query cancelled before it started"))
+            return False
+        return True
+
+    def release(self, key):
+        """Hand the slot held for server key to the next waiting job, if any"""
+        while True:
+            with self.lock:
+                waiting = self.server_waiting.get(key)
+                if not waiting:
+                    self.server_running[key] -= 1
+                    return
+                job = waiting.popleft()
+            if self.start(key, job):
+                return
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            pools, self.pools = self.pools, {}
+        for pool in pools.values():
+            pool.shutdown(wait=wait)
+
+
+query_executor = QueryExecutor()
+
+
+class QueryRegistry:
+    """
+    Loads and indexes a directory tree of SQL query files once so that
+    repeated lookups don't hit the disk. Queries are expected to be laid out
+    like:
+
+        <root>/<db_type>/<name>.sql  # version independent queries
+        <root>/<db_type>/<version>/<name>.sql
+
+    e.g.
+
+        registry = QueryRegistry("/path/to/queries")
+        registry.get("fdb", "db_version.sql")
+        registry.get("fdb", "trend.sql", version="01.04")
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._queries = None
+        self._lock = threading.Lock()
+
+    @property
+    def queries(self):
+        """Return dict of form {(db_type, version, name): query_text}, loading from disk on first access"""
+        if self._queries is None:
+            with self._lock:
+                if self._queries is None:
+                    self._queries = self.load()
+        return self._queries
+
+    def load(self):
+        """Read all the .sql files under our root directory"""
+        queries = {}
+        for path in self.root.glob("*/*.sql"):
+            queries[(path.parent.name, None, path.name)] = path.read_text()
+        for path in self.root.glob("*/*/*.sql"):
+            queries[(path.parent.parent.name, path.parent.name, path.name)] = path.read_text()
+        return queries
+
+    def get(self, db_type, name, version=None):
+        """Return the text of the requested query. Raises KeyError if the query doesn't exist"""
+        return self.queries[(db_type, version, name)]
+
+    def has(self, db_type, name, version=None):
+        """Is the requested query available?"""
+        return (db_type, version, name) in self.queries
+
+    def versions(self, db_type):
+        """Return a sorted list of the versions available for db_type"""
+        return sorted({v for t, v, __ in self.queries if t == db_type and v is not None})
+
+    def clear(self):
+        """Force queries to be reloaded from disk on next access"""
+        with self._lock:
+            self._queries = None
@@ -16,7 +16,8 @@ import wx.lib.agw.hyperlink as hl
 from qcpump.pumps import dependencies
 from qcpump.logs import get_log_level
 from qcpump.pumps.registry import register_pump_type
-from qcpump.settings import Settings
+from qcpump.settings import Settings, get_config_dir
+from qcpump.utils import clean_filename
 
 
 class BaseValidator(wx.Validator):
@@ -202,6 +203,9 @@ class BasePump(wx.Panel):
 
     HELP_URL = "https://qcpump.readthedocs.org"
 
+    # set to a threading.Event by run() which is set when the pump should stop
+    kill_event = None
+
     # All pumps have some common options which are defined by the BASE_CONFIG
     BASE_CONFIG = [
         {
@@ -1266,6 +1270,15 @@ class BasePump(wx.Panel):
             p /= filename
         return p.absolute()
 
+    def get_pump_data_path(self, filename=""):
+        """Return the directory where this pump instance's configuration and
+        any other persistent data (e.g. caches, checkpoints) is stored. If
+        filename is defined then it will be a file path in that directory."""
+        p = get_config_dir() / "pumps" / clean_filename(self.name)
+        if filename:
+            p /= filename
+        return p
+
     def set_dirty(self, dirty):
         """Set the dirty (unsaved) state"""
         self.dirty = dirty
@@ -1284,7 +1297,7 @@ class BasePump(wx.Panel):
 
     def should_terminate(self):
         """Should the current pumping operation be stopped?"""
-        return self.kill_event.is_set()
+        return self.kill_event is not None and self.kill_event.is_set()
 
     def terminate(self):
         """Set the kill event"""
@@ -1300,6 +1313,14 @@ class BasePump(wx.Panel):
         evt = PumpEvent(_EVT_PUMP_PROGRESS, wx.ID_ANY, data)
         wx.PostEvent(self.parent, evt)
 
+    def has_pending_work(self):
+        """Return True if the pump has work waiting (e.g. new files in a
+        watched directory) and should be run before its next interval"""
+        return False
+
+    def pumping_stopped(self):
+        """Called when the application stops pumping (e.g. to stop any background watchers)"""
+
     def pump_complete(self):
         """Send event indicating that this pumping iteration is complete"""
         evt = PumpEvent(_EVT_PUMP_COMPLETE, wx.ID_ANY)
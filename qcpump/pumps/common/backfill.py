@@ -0,0 +1,97 @@
+import datetime
+import time
+
+from qcpump.pumps.common.json_store import read_json, write_json
+
+DATE_FMT = "%Y-%m-%d"
+
+
+def parse_date(value):
+    """Convert a YYYY-MM-DD string to a date"""
+    return datetime.datetime.strptime(value.strip(), DATE_FMT).date()
+
+
+def date_chunks(start, end, days):
+    """Split the date range [start, end) into a list of (chunk_start,
+    chunk_end) pairs of at most days days each"""
+    chunks = []
+    step = datetime.timedelta(days=max(1, days))
+    while start < end:
+        chunks.append((start, min(start + step, end)))
+        start += step
+    return chunks
+
+
+def format_duration(seconds):
+    """Format a number of seconds as H:MM:SS"""
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+class BackfillCheckpoint:
+    """
+    Records backfill progress on disk so that an interrupted backfill can
+    resume where it left off. The checkpoint file is a small JSON document
+    like:
+
+        {"start date": "2021-01-01", "completed": "2021-02-15"}
+
+    where completed is the date up to which all data has been processed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, start_date):
+        """Return the date up to which the backfill starting at start_date has
+        been completed (or start_date if there is no valid checkpoint)"""
+        try:
+            data = read_json(self.path)
+            if data['start date'] == start_date.strftime(DATE_FMT):
+                return max(parse_date(data['completed']), start_date)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            pass
+        return start_date
+
+    def save(self, start_date, completed):
+        """Atomically write the checkpoint to disk"""
+        write_json(self.path, {
+            'start date': start_date.strftime(DATE_FMT),
+            'completed': completed.strftime(DATE_FMT),
+        })
+
+
+class BackfillProgress:
+    """Estimate the time remaining for a backfill from the average time
+    taken by each completed chunk"""
+
+    def __init__(self, total_chunks, completed_chunks=0):
+        self.total_chunks = total_chunks
+        self.completed_chunks = completed_chunks
+        self.run_chunks = 0
+        self.start = time.monotonic()
+
+    def chunk_complete(self):
+        self.completed_chunks += 1
+        self.run_chunks += 1
+
+    @property
+    def percent(self):
+        if not self.total_chunks:
+            return 100
+        return int(100 * self.completed_chunks / self.total_chunks)
+
+    @property
+    def eta(self):
+        """Estimated number of seconds remaining (None until a chunk has completed)"""
+        if not self.run_chunks:
+            return None
+        per_chunk = (time.monotonic() - self.start) / self.run_chunks
+        return per_chunk * (self.total_chunks - self.completed_chunks)
+
+    def message(self, chunk_end):
+        eta = self.eta
+        eta_msg = f", ETA {format_duration(eta)}" if eta is not None else ""
+        return (
+            f"Backfilled to {chunk_end.strftime(DATE_FMT)} "
+            f"({self.completed_chunks}/{self.total_chunks} chunks{eta_msg})"
+        )
@@ -0,0 +1,72 @@
+import hashlib
+import os
+
+from qcpump.pumps.common.json_store import JSONStore
+
+
+def files_fingerprint(paths):
+    """Return a hash of the paths, sizes and modification times of the input
+    files. Only the files' metadata is read so this is cheap to compute even
+    for files on slow network shares. Raises OSError if any of the files
+    can't be stat'ed."""
+    digest = hashlib.sha256()
+    for path in sorted(str(p) for p in paths):
+        stat = os.stat(path)
+        digest.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8", "surrogateescape"))
+    return digest.hexdigest()
+
+
+class FingerprintStore(JSONStore):
+    """
+    Persistent record of the fingerprints (see files_fingerprint) of the files
+    making up each uploaded record, so that records can be recognized as
+    already uploaded (or as having changed since they were uploaded) without
+    querying the QATrack+ API or re-reading the files, e.g.
+
+        store = FingerprintStore(path)
+        store.load()
+        fingerprint = files_fingerprint(paths)
+        if store.get(record_id) == fingerprint:
+            skip()
+        ...
+        store.add(record_id, fingerprint, date)
+        store.prune(cutoff_date)
+        store.save()
+
+    Dates are only used for pruning and may be any strings which sort
+    chronologically (e.g. YYYY-MM-DD-HH-MM)
+    """
+
+    def clear(self):
+        self.records = {}
+
+    def to_json(self):
+        return {'records': self.records}
+
+    def from_json(self, data):
+        self.records = data['records']
+
+    def get(self, record_id):
+        """Return the fingerprint recorded for record_id (or None)"""
+        record = self.records.get(record_id)
+        return record['fingerprint'] if record else None
+
+    def add(self, record_id, fingerprint, date, changed=False):
+        """Record the fingerprint for record_id. changed should be True if the
+        record's files changed after the record was uploaded"""
+        record = {'fingerprint': fingerprint, 'date': date, 'changed': changed}
+        if self.records.get(record_id) != record:
+            self.records[record_id] = record
+            self.dirty = True
+
+    def changed(self, record_id):
+        """Has record_id been flagged as having changed after it was uploaded?"""
+        record = self.records.get(record_id)
+        return bool(record and record['changed'])
+
+    def prune(self, cutoff_date):
+        """Forget records dated before cutoff_date"""
+        old = [record_id for record_id, record in self.records.items() if record['date'] < cutoff_date]
+        for record_id in old:
+            del self.records[record_id]
+        self.dirty = self.dirty or bool(old)
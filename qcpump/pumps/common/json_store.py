@@ -0,0 +1,71 @@
+import json
+
+
+def write_json(path, data):
+    """Atomically write data to path as a JSON document, creating the parent
+    directory if required. The document is written to a temporary file which
+    then replaces path so an interrupted write never leaves a partial file"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(data))
+    tmp_path.replace(path)
+
+
+def read_json(path):
+    """Return the JSON document at path. Raises OSError if it can't be read
+    and ValueError if it isn't valid JSON"""
+    return json.loads(path.read_text())
+
+
+class JSONStore:
+    """
+    Base class for small persistent stores kept as a JSON document in a
+    pump's data directory. Subclasses implement clear (reset to an empty
+    store), to_json and from_json and set dirty whenever they are modified,
+    e.g.
+
+        class Store(JSONStore):
+
+            def clear(self):
+                self.items = {}
+
+            def to_json(self):
+                return {'items': self.items}
+
+            def from_json(self, data):
+                self.items = data['items']
+
+    A missing or invalid file is treated as an empty store and the store is
+    only written to disk by save when it has changed. If path is None the
+    store is kept in memory only.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.dirty = False
+        self.clear()
+
+    def clear(self):
+        raise NotImplementedError
+
+    def to_json(self):
+        raise NotImplementedError
+
+    def from_json(self, data):
+        raise NotImplementedError
+
+    def load(self):
+        """Load the store from disk (if it exists)"""
+        if self.path is None:
+            return
+        try:
+            self.from_json(read_json(self.path))
+        except (OSError, ValueError, KeyError, TypeError):
+            self.clear()
+
+    def save(self):
+        """Atomically write the store to disk if it has changed"""
+        if self.path is None or not self.dirty:
+            return
+        write_json(self.path, self.to_json())
+        self.dirty = False
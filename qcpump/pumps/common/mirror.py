@@ -0,0 +1,239 @@
+import datetime
+from decimal import Decimal
+import json
+import sqlite3
+import threading
+
+from qcpump.core.db import in_batch_size, sqlite_query
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS rows (
+        machine_id,
+        data_key,
+        work_started TEXT NOT NULL,
+        uploaded INTEGER NOT NULL DEFAULT 0,
+        row TEXT NOT NULL,
+        PRIMARY KEY (machine_id, data_key)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS rows_machine_work_started ON rows (machine_id, work_started)",
+    "CREATE INDEX IF NOT EXISTS rows_work_started ON rows (work_started)",
+    """
+    CREATE TABLE IF NOT EXISTS watermarks (
+        machine_id PRIMARY KEY,
+        data_key INTEGER NOT NULL
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)",
+]
+
+ROW_COLUMNS = ("machine_id", "data_key", "work_started", "row")
+
+
+def encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'__date__': value.isoformat()}
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def decode_value(obj):
+    if '__datetime__' in obj:
+        return datetime.datetime.fromisoformat(obj['__datetime__'])
+    if '__date__' in obj:
+        return datetime.date.fromisoformat(obj['__date__'])
+    return obj
+
+
+def int_key(data_key):
+    """Return data_key as an int or None if it is not an integer key"""
+    if isinstance(data_key, bool):
+        return None
+    if isinstance(data_key, int):
+        return data_key
+    if isinstance(data_key, str) and data_key.isdigit():
+        return int(data_key)
+    return None
+
+
+def normalize_key(data_key):
+    """Pumps may convert data keys to strings (e.g. for record ids) so store
+    integer keys as ints to ensure they always compare equal"""
+    key = int_key(data_key)
+    return data_key if key is None else key
+
+
+class RowMirror:
+    """
+    A local SQLite copy of rows fetched from an upstream database. Rows are
+    stored as JSON documents keyed by (machine_id, data_key) and indexed by
+    work_started so that they can be queried locally (by the pump or by
+    anyone wanting to run ad-hoc queries) without touching the upstream
+    database.
+
+    The mirror also keeps a per machine watermark of the highest integer
+    data_key seen so that upstream queries only need to fetch newer rows, and
+    an uploaded flag so rows that have already been uploaded are not returned
+    again. e.g.
+
+        mirror = RowMirror(path)
+        mirror.check_config(beam_types)
+        after = mirror.watermark(machine_ids)  # add "data_key > after" to upstream query
+        mirror.add(upstream_rows)
+        for row in mirror.rows(machine_ids, min_date):
+            upload(row)
+            mirror.mark_uploaded([row])
+        mirror.prune(min_date)  # forget rows which are too old to be uploaded
+    """
+
+    # UPSERT (INSERT ... ON CONFLICT DO UPDATE) requires SQLite 3.24.0+ but
+    # older versions are still bundled with some Python builds
+    upsert = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+    def __init__(self, path, stats=None):
+        self.path = path
+        self.stats = stats
+        self.lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        for statement in SCHEMA:
+            self.query(statement)
+
+    @property
+    def connect_kwargs(self):
+        return {'database': str(self.path)}
+
+    def query(self, statement, params=None, fetch_method="fetchall"):
+        return sqlite_query(self.connect_kwargs, statement, params=params, fetch_method=fetch_method, stats=self.stats)
+
+    def check_config(self, config):
+        """Forget all watermarks if the configuration used to query the upstream
+        database has changed (e.g. a beam type was added) since rows matching
+        the new configuration may be older than the current watermarks"""
+        config = json.dumps(config)
+        with self.lock:
+            current = self.query("SELECT value FROM meta WHERE name = 'config'")
+            if current and current[0][0] == config:
+                return
+            self.query("DELETE FROM watermarks")
+            self.query("INSERT OR REPLACE INTO meta (name, value) VALUES ('config', ?)", [config])
+
+    def add(self, rows, advance_watermarks=True):
+        """Insert or update the input rows and (optionally) advance the machine
+        watermarks. Watermarks should only be advanced for rows from queries
+        covering everything up to the present (i.e. not for historical date
+        ranges) since data may be written to the upstream database out of
+        order."""
+
+        if not rows:
+            return
+
+        watermarks = {}
+        for row in rows if advance_watermarks else []:
+            key = int_key(row['data_key'])
+            if key is not None:
+                watermarks[row['machine_id']] = max(key, watermarks.get(row['machine_id'], key))
+
+        if self.upsert:
+            row_values = "(?, ?, ?, ?)"
+            insert_rows = (
+                f"INSERT INTO rows ({', '.join(ROW_COLUMNS)}) VALUES {{values}} "
+                "ON CONFLICT (machine_id, data_key) DO UPDATE SET "
+                "work_started = excluded.work_started, row = excluded.row"
+            )
+            insert_watermark = (
+                "INSERT INTO watermarks (machine_id, data_key) VALUES (?, ?) "
+                "ON CONFLICT (machine_id) DO UPDATE SET data_key = MAX(data_key, excluded.data_key)"
+            )
+        else:
+            # replacing a row deletes it first so its uploaded flag has to be carried over
+            row_values = "(?, ?, ?, ?, COALESCE((SELECT uploaded FROM rows WHERE machine_id = ? AND data_key = ?), 0))"
+            insert_rows = f"INSERT OR REPLACE INTO rows ({', '.join(ROW_COLUMNS)}, uploaded) VALUES {{values}}"
+            insert_watermark = (
+                "INSERT OR REPLACE INTO watermarks (machine_id, data_key) VALUES "
+                "(?, MAX(?, COALESCE((SELECT data_key FROM watermarks WHERE machine_id = ?), ?)))"
+            )
+
+        batch_size = in_batch_size("sqlite") // row_values.count("?")
+        with self.lock:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                params = []
+                for row in batch:
+                    machine_id, data_key = row['machine_id'], normalize_key(row['data_key'])
+                    params.extend([
+                        machine_id,
+                        data_key,
+                        row['work_started'].isoformat(),
+                        json.dumps(row, default=encode_value),
+                    ])
+                    if not self.upsert:
+                        params.extend([machine_id, data_key])
+                self.query(insert_rows.format(values=", ".join([row_values] * len(batch))), params)
+
+            for machine_id, data_key in watermarks.items():
+                params = [machine_id, data_key] if self.upsert else [machine_id, data_key, machine_id, data_key]
+                self.query(insert_watermark, params)
+
+    def watermark(self, machine_ids):
+        """Return the data_key all rows for the input machines have been
+        mirrored up to (i.e. the lowest machine watermark) or None if any of
+        the machines does not have a watermark yet"""
+
+        machine_ids = list(machine_ids)
+        if not machine_ids:
+            return None
+
+        placeholders = ", ".join("?" * len(machine_ids))
+        marks = self.query(f"SELECT data_key FROM watermarks WHERE machine_id IN ({placeholders})", machine_ids)
+        if len(marks) < len(set(machine_ids)):
+            return None
+        return min(mark[0] for mark in marks)
+
+    def rows(self, machine_ids, min_date, max_date=None, include_uploaded=False):
+        """Return mirrored rows for the input machines acquired on or after
+        min_date (and before max_date), ordered by work_started"""
+
+        machine_ids = list(machine_ids)
+        if not machine_ids:
+            return []
+
+        if not isinstance(min_date, datetime.datetime):
+            min_date = datetime.datetime.combine(min_date, datetime.time())
+
+        statement = (
+            f"SELECT row FROM rows WHERE machine_id IN ({', '.join('?' * len(machine_ids))}) "
+            "AND work_started >= ?"
+        )
+        params = machine_ids + [min_date.isoformat()]
+        if max_date:
+            if not isinstance(max_date, datetime.datetime):
+                max_date = datetime.datetime.combine(max_date, datetime.time())
+            statement += " AND work_started < ?"
+            params.append(max_date.isoformat())
+        if not include_uploaded:
+            statement += " AND uploaded = 0"
+        statement += " ORDER BY work_started, data_key"
+
+        return [json.loads(row[0], object_hook=decode_value) for row in self.query(statement, params)]
+
+    def mark_uploaded(self, rows):
+        """Flag the input rows as uploaded so they are not returned by rows() again"""
+        with self.lock:
+            for row in rows:
+                self.query(
+                    "UPDATE rows SET uploaded = 1 WHERE machine_id = ? AND data_key = ?",
+                    [row['machine_id'], normalize_key(row['data_key'])],
+                )
+
+    def prune(self, before):
+        """Forget rows acquired before the input date (e.g. rows which have
+        fallen out of the history window) so the mirror doesn't grow forever"""
+
+        if not isinstance(before, datetime.datetime):
+            before = datetime.datetime.combine(before, datetime.time())
+        with self.lock:
+            self.query("DELETE FROM rows WHERE work_started < ?", [before.isoformat()])
@@ -1,11 +1,13 @@
 import base64
 import datetime
+import functools
 import json
 import re
 import time
 import traceback
 import unicodedata
 
+import jinja2
 from pypac import PACSession
 import requests
 
@@ -21,6 +23,10 @@ HTTP_BAD_REQUEST = requests.codes['bad_request']
 
 MISSING_TEST_DATA_ERR = 'missing data for tests'.lower()
 
+# test names are drawn from a small fixed set (e.g. MPC & DQA3 result names)
+# so the slug cache should never need to evict anything
+SLUG_CACHE_SIZE = 8192
+
 TEST_TO_SLUG_REPLACEMENTS = [
     ("Â", ""),
     ("/", "_"),
@@ -48,8 +54,10 @@ def django_slugify(value):
     return re.sub(r'[-\s]+', '-', value).strip('-_')
 
 
+@functools.lru_cache(maxsize=SLUG_CACHE_SIZE)
 def slugify(value):
-    """Convert value to valid QATrack+ slug"""
+    """Convert value to valid QATrack+ slug. Slugs are cached for the whole
+    process since pumps slugify the same test names on every pump run"""
 
     for repl, with_ in TEST_TO_SLUG_REPLACEMENTS:
         value = value.replace(repl, with_)
@@ -65,6 +73,35 @@ def slugify(value):
     return value.lower()
 
 
+def slug_cache_stats():
+    """Return a short summary of slug cache usage suitable for logging"""
+    info = slugify.cache_info()
+    lookups = info.hits + info.misses
+    hit_rate = 100 * info.hits / lookups if lookups else 0
+    return f"{info.currsize} slugs cached, {hit_rate:.1f}% hit rate"
+
+
+@functools.lru_cache(maxsize=64)
+def compile_template(source, undefined=jinja2.StrictUndefined):
+    """Return a compiled Jinja2 template for source. Compiling is much slower
+    than rendering so compiled templates are cached for the whole process"""
+    return jinja2.Template(source, undefined=undefined)
+
+
+@functools.lru_cache(maxsize=1024)
+def render_template(source, context, undefined=jinja2.StrictUndefined):
+    """Render the template source with context, a tuple of (name, value)
+    pairs. Results are cached since pumps generally render the same handful of
+    contexts (e.g. one per beam) over and over again"""
+    return compile_template(source, undefined).render(dict(context))
+
+
+def clear_template_caches():
+    """Clear compiled templates & rendered results (e.g. when a test list name template is changed)"""
+    compile_template.cache_clear()
+    render_template.cache_clear()
+
+
 class QATrackAPIMixin:
 
     QATRACK_API_CONFIG = {
@@ -274,15 +311,34 @@ class QATrackFetchAndPost(QATrackAPIMixin):
 
         throttle = self.get_config_value("QATrack+ API", "throttle")
 
+        fetch_start = time.perf_counter()
         records = self.fetch_records()
+        fetch_time = time.perf_counter() - fetch_start
+        self.log_debug(f"Fetched {len(records)} records in {fetch_time:.2f}s")
+
+        upload_start = time.perf_counter()
+        uploaded, __ = self.upload_records(records, throttle)
+        if uploaded is None:
+            return
+
+        upload_time = time.perf_counter() - upload_start
+        self.log_info(f"Pumping complete (fetch: {fetch_time:.2f}s, QATrack+ API: {upload_time:.2f}s)")
+        self.log_debug(f"Slug cache: {slug_cache_stats()}")
 
+    def upload_records(self, records, throttle):
+        """Upload any of the input records which haven't been uploaded yet.
+        Returns a tuple of (uploaded record ids, failed record ids) or (None,
+        None) if the pump was terminated before all records were processed."""
+
+        uploaded = []
+        failed = []
         for record in records:
 
             # don't run a DOS attack on your QATrack+ instance!
             time.sleep(throttle)
 
             if self.should_terminate():
-                return
+                return None, None
 
             record_id = self.id_for_record(record)
 
@@ -294,11 +350,13 @@ class QATrackFetchAndPost(QATrackAPIMixin):
 
             payload = self._generate_payload(record)
             if payload is None:
+                failed.append(record_id)
                 continue
 
             upload_response = self._upload_payload(payload)
             if upload_response is None:
                 # exception logged in upload_payload
+                failed.append(record_id)
                 continue
 
             if upload_response.status_code != HTTP_CREATED:
@@ -310,6 +368,7 @@ class QATrackFetchAndPost(QATrackAPIMixin):
                     f"Uploading record={record_id} resulted in status code={upload_response.status_code}: "
                     f"{err_msg}"
                 )
+                failed.append(record_id)
                 continue
 
             self.log_info(
@@ -317,10 +376,11 @@ class QATrackFetchAndPost(QATrackAPIMixin):
             )
 
             self.post_process(record)
+            uploaded.append(record_id)
         else:
             self.log_info("No new records found")
 
-        self.log_info("Pumping complete")
+        return uploaded, failed
 
     def fetch_records(self):
         return []
@@ -344,6 +404,8 @@ class QATrackFetchAndPost(QATrackAPIMixin):
         return now, now + datetime.timedelta(seconds=1)
 
     def test_values_from_record(self, record):
+        """Return a dict of test values for record, or None if the values
+        can't be read and the record should be skipped"""
         return {}
 
     def get_comment_for_record(self, record):
@@ -390,6 +452,9 @@ class QATrackFetchAndPost(QATrackAPIMixin):
         comment = self.get_comment_for_record(record)
         day = self.cycle_day_for_record(record)
         test_values_from_record = self.test_values_from_record(record)
+        if test_values_from_record is None:
+            # the record's values couldn't be read (error logged by test_values_from_record)
+            return
 
         payload = {
             'unit_test_collection': utc_url,
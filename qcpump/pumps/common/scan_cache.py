@@ -0,0 +1,109 @@
+import os
+
+from qcpump.pumps.common.json_store import JSONStore
+
+
+def list_dir(path, is_result):
+    """Return (subdirectory names, {file name: mtime}) for the directory path
+    including only files for which is_result(file_name) is True"""
+    dirs = []
+    files = {}
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                elif is_result(entry.name):
+                    files[entry.name] = entry.stat().st_mtime
+            except OSError:
+                continue
+    return dirs, files
+
+
+class ScanCache(JSONStore):
+    """
+    Persistent index of directory listings keyed by directory mtime so that
+    repeated scans of a directory tree only need to stat each directory (and
+    the files of interest in it) and re-list the ones which have changed, e.g.
+
+        cache = ScanCache(path_to_cache_file)
+        cache.load()
+        cache.check_config(root)
+        cache.begin_scan()
+        subdirs, files = cache.list_dir(some_dir, lambda name: name.endswith(".csv"))
+        ...
+        cache.end_scan()  # forget directories not visited & save
+
+    A directory's mtime changes when entries are added, removed or renamed
+    but not when an existing file is modified in place, so the mtimes of the
+    cached files are always re-read rather than trusted.
+    """
+
+    def __init__(self, path=None):
+        super().__init__(path)
+        self.visited = set()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.config = None
+        self.dirs = {}
+
+    def to_json(self):
+        return {'config': self.config, 'dirs': self.dirs}
+
+    def from_json(self, data):
+        self.config = data['config']
+        self.dirs = data['dirs']
+
+    def check_config(self, config):
+        """Forget all cached directories if the configuration (e.g. the root directory) has changed"""
+        config = list(config) if isinstance(config, (list, tuple)) else config
+        if config != self.config:
+            self.config = config
+            self.dirs = {}
+            self.dirty = True
+
+    def begin_scan(self):
+        self.visited = set()
+
+    def end_scan(self):
+        """Forget any directories that weren't visited during this scan
+        (e.g. they were deleted or are now too old to be scanned) and save"""
+        unvisited = set(self.dirs) - self.visited
+        for path in unvisited:
+            del self.dirs[path]
+        self.dirty = self.dirty or bool(unvisited)
+        self.save()
+
+    def list_dir(self, path, is_result):
+        """Return (subdirectory names, {file name: mtime}) for path, only
+        re-listing the directory if its mtime has changed since it was
+        cached"""
+
+        self.visited.add(path)
+        mtime = os.stat(path).st_mtime
+        cached = self.dirs.get(path)
+        if cached is not None and cached['mtime'] == mtime:
+            self.hits += 1
+            return cached['dirs'], self.restat_files(path, cached)
+
+        self.misses += 1
+        dirs, files = list_dir(path, is_result)
+        self.dirs[path] = {'mtime': mtime, 'dirs': dirs, 'files': files}
+        self.dirty = True
+        return dirs, files
+
+    def restat_files(self, path, cached):
+        """Update the mtimes of the files in a cached listing, which may have
+        been modified in place since the directory was listed"""
+        files = {}
+        for name in cached['files']:
+            try:
+                files[name] = os.stat(os.path.join(path, name)).st_mtime
+            except OSError:
+                continue
+        if files != cached['files']:
+            cached['files'] = files
+            self.dirty = True
+        return files
@@ -0,0 +1,158 @@
+import os
+import time
+
+from qcpump.pumps.base import UINT
+
+
+class StabilityIndex:
+    """
+    In-memory index of the sizes and modification times of files found by a
+    pump, used to hold back files which may still be being written (e.g. by
+    an imaging device or a network copy).
+
+    A file is considered stable once it has been seen with the same size and
+    modification time on two observations at least `settle` seconds apart,
+    and its modification time is at least `settle` seconds old. Requiring two
+    observations catches copies which preserve the original modification
+    time. Stable files are remembered and not stat'ed again until they are
+    reset (e.g. because a watcher reported them as modified) or pruned.
+    """
+
+    def __init__(self, settle):
+        self.settle = settle
+        self.pending = {}  # path -> (size, mtime_ns, monotonic time first seen with that size & mtime)
+        self.stable = set()
+        self.next_check = None
+
+    def filter(self, paths, now=None):
+        """Return the paths which are stable, recording observations of the others"""
+
+        now = time.monotonic() if now is None else now
+        wall_now = time.time()
+
+        stable = []
+        for path in paths:
+            if path in self.stable:
+                stable.append(path)
+                continue
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # gone (or inaccessible), forget it and let it be found again later
+                self.pending.pop(path, None)
+                continue
+
+            signature = (stat.st_size, stat.st_mtime_ns)
+            seen = self.pending.get(path)
+            if seen is None or seen[:2] != signature:
+                self.pending[path] = signature + (now,)
+            elif now - seen[2] < self.settle:
+                continue
+            elif wall_now - stat.st_mtime >= self.settle:
+                del self.pending[path]
+                self.stable.add(path)
+                stable.append(path)
+            else:
+                # modified too recently (or in the future because of clock skew
+                # on a network share) so start a new observation rather than
+                # leaving the recheck time in the past
+                self.pending[path] = signature + (now,)
+
+        self.update_next_check()
+        return stable
+
+    def update_next_check(self):
+        # computed here so that recheck_due can be called from another thread
+        # without iterating over pending while it's being modified
+        self.next_check = min((seen[2] for seen in self.pending.values()), default=None)
+        if self.next_check is not None:
+            self.next_check += self.settle
+
+    def recheck_due(self, now=None):
+        """Is it time to check whether any held back files are now stable?"""
+        now = time.monotonic() if now is None else now
+        next_check = self.next_check
+        return next_check is not None and now >= next_check
+
+    def held(self):
+        """Return the paths currently being held back"""
+        return list(self.pending)
+
+    def reset(self, paths):
+        """Forget that paths were stable (e.g. because they were modified)"""
+        for path in paths:
+            self.stable.discard(path)
+
+    def prune(self, seen):
+        """Forget any paths not in seen (e.g. files which have been moved)"""
+        seen = set(seen)
+        self.stable &= seen
+        for path in [p for p in self.pending if p not in seen]:
+            del self.pending[path]
+        self.update_next_check()
+
+
+class StableFiles:
+    """
+    Mixin for pumps which should only process files once they have finished
+    being written. Pumps using it should add STABILITY_CONFIG to their CONFIG,
+    pass the paths they find through stable_paths and, when using
+    WatchDirectories, come before it in the list of base classes and pass
+    the watched paths through recheck_paths.
+    """
+
+    STABILITY_CONFIG = {
+        'name': 'Stability',
+        'multiple': False,
+        'fields': [
+            {
+                'name': 'settle time (s)',
+                'type': UINT,
+                'required': False,
+                'default': 0,
+                'help': (
+                    "Only process files once their size and modification time have not changed for this many "
+                    "seconds. Set to 0 to process files as soon as they are found."
+                ),
+            },
+        ],
+    }
+
+    stability = None
+
+    def stable_paths(self, paths):
+        """Return the paths which have finished being written"""
+
+        paths = list(paths)
+        settle = self.get_config_value("Stability", "settle time (s)") or 0
+        if not settle:
+            self.stability = None
+            return paths
+
+        if self.stability is None or self.stability.settle != settle:
+            self.stability = StabilityIndex(settle)
+
+        stable = self.stability.filter(paths)
+        if len(stable) < len(paths):
+            self.log_info(f"Holding back {len(paths) - len(stable)} files which may still be being written")
+        return stable
+
+    def recheck_paths(self, watched):
+        """Add any held back paths to the watched paths so they are checked
+        again, and forget the stability of watched paths which have been
+        modified. Returns None (i.e. do a full search) if watched is None"""
+        if watched is None or self.stability is None:
+            return watched
+        self.stability.reset(watched)
+        watched_set = set(watched)
+        return list(watched) + [p for p in self.stability.held() if p not in watched_set]
+
+    def prune_stability(self, seen):
+        """Forget files which weren't found on a full search"""
+        if self.stability is not None:
+            self.stability.prune(seen)
+
+    def has_pending_work(self):
+        stability = self.stability
+        return (stability is not None and stability.recheck_due()) or super().has_pending_work()
@@ -0,0 +1,394 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import errno
+import functools
+import hashlib
+import os
+from pathlib import Path
+import shutil
+import time
+from uuid import uuid4
+
+from qcpump.pumps.base import BOOLEAN, INT
+from qcpump.pumps.common.json_store import JSONStore
+
+COPY_CHUNK_SIZE = 1024 * 1024  # bytes per read/write for chunked copies
+OFFLOAD_CHUNK_SIZE = 64 * 1024 * 1024  # bytes per copy_file_range/sendfile call
+
+# file in the pump data directory where checksums of verified copies are saved
+MANIFEST_FILE = "transfer_manifest.json"
+
+# errors indicating the kernel can't copy between these two files so a
+# regular chunked copy should be used instead
+OFFLOAD_UNSUPPORTED_ERRORS = {
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTSOCK,
+    errno.EOPNOTSUPP,
+    errno.EXDEV,
+    getattr(errno, "ENOTSUP", errno.EOPNOTSUPP),
+}
+
+
+def _copy_file_range(infd, outfd, offset, count):
+    return os.copy_file_range(infd, outfd, count)
+
+
+def _sendfile(infd, outfd, offset, count):
+    return os.sendfile(outfd, infd, offset, count)
+
+
+def offload_methods():
+    """Return the kernel copy functions available on this platform"""
+    methods = []
+    if hasattr(os, "copy_file_range"):
+        methods.append(_copy_file_range)
+    if hasattr(os, "sendfile") and os.name == "posix":
+        methods.append(_sendfile)
+    return methods
+
+
+def offload_copy(method, fsrc, fdst):
+    """Copy fsrc to fdst in the kernel using method. Returns the number of
+    bytes copied or None if method isn't supported for these files. Some
+    file systems return 0 rather than an error for unsupported copies so
+    nothing being copied at all is also treated as unsupported."""
+    infd, outfd = fsrc.fileno(), fdst.fileno()
+    copied = 0
+    while True:
+        try:
+            n = method(infd, outfd, copied, OFFLOAD_CHUNK_SIZE)
+        except OSError as e:
+            if copied == 0 and e.errno in OFFLOAD_UNSUPPORTED_ERRORS:
+                return None
+            raise
+        if n == 0:
+            return copied or None
+        copied += n
+
+
+def chunked_copy(fsrc, fdst, digest=None):
+    """Copy fsrc to fdst in COPY_CHUNK_SIZE chunks, updating digest (a
+    hashlib hash object) with each chunk if given. Returns the number of
+    bytes copied"""
+    copied = 0
+    while True:
+        chunk = fsrc.read(COPY_CHUNK_SIZE)
+        if not chunk:
+            return copied
+        if digest is not None:
+            digest.update(chunk)
+        fdst.write(chunk)
+        copied += len(chunk)
+
+
+def file_digest(path):
+    """Return the SHA-256 hex digest of the file at path"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_fileobj(fsrc, fdst):
+    """Copy the open binary file fsrc to fdst using kernel copy offload
+    (copy_file_range or sendfile) where possible and falling back to a
+    chunked copy otherwise. Returns the number of bytes copied."""
+    for method in offload_methods():
+        copied = offload_copy(method, fsrc, fdst)
+        if copied is not None:
+            return copied
+    return chunked_copy(fsrc, fdst)
+
+
+def temp_path(dest):
+    """Return a unique hidden temporary path in the same directory as dest"""
+    dest = Path(dest)
+    return dest.with_name(f".{dest.name}.{uuid4().hex[:8]}.tmp")
+
+
+def copy_file(src, dest, verify=False):
+    """Copy src (data & permissions) to a temporary file next to dest and
+    then atomically rename it to dest so that a partially copied file is
+    never visible at dest. An OSError is raised if the number of bytes
+    copied doesn't match the size of src.
+
+    If verify is True, the source is hashed as it is copied (so it is only
+    read once) and the copy is read back and compared with it before being
+    renamed. An OSError is raised if they don't match.
+
+    Returns a tuple of (number of bytes copied, SHA-256 hex digest or None if
+    verify is False)."""
+    tmp = temp_path(dest)
+    digest = None
+    try:
+        with open(src, "rb") as fsrc, open(tmp, "wb") as fdst:
+            if verify:
+                # the data has to pass through user space to be hashed so no copy offload here
+                hasher = hashlib.sha256()
+                copied = chunked_copy(fsrc, fdst, hasher)
+                digest = hasher.hexdigest()
+            else:
+                copied = copy_fileobj(fsrc, fdst)
+            size = os.fstat(fsrc.fileno()).st_size
+        if copied != size:
+            raise OSError(errno.EIO, f"Copied {copied} of {size} bytes from {src}", str(dest))
+        if verify and file_digest(tmp) != digest:
+            raise OSError(errno.EIO, f"Checksum of copy does not match source {src}", str(dest))
+        shutil.copymode(src, tmp)
+        os.replace(tmp, dest)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return copied, digest
+
+
+def move_file(src, dest, verify=False):
+    """Move src to dest. Files are renamed where possible and otherwise (e.g.
+    when moving between volumes) copied to dest (see copy_file for verify)
+    then removed. Returns a tuple of (number of bytes moved, SHA-256 hex
+    digest or None if the file was renamed or verify is False)."""
+    size = os.stat(src).st_size
+    try:
+        os.replace(src, dest)
+        return size, None
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    result = copy_file(src, dest, verify)
+    os.unlink(src)
+    return result
+
+
+def iter_transfers(transfers, move=False, workers=1, should_terminate=None, verify=False):
+    """Copy (or move) each (src, dest) pair in transfers using up to workers
+    threads, yielding (src, dest, bytes transferred, digest, exception or
+    None) as each transfer completes (see copy_file for verify & digest).
+    Transfers which haven't started yet are cancelled once
+    should_terminate() returns True."""
+
+    transfer = functools.partial(move_file if move else copy_file, verify=verify)
+    should_terminate = should_terminate or (lambda: False)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="qcpump-transfer")
+    futures = {}
+    try:
+        for src, dest in transfers:
+            futures[executor.submit(transfer, src, dest)] = (src, dest)
+
+        for future in as_completed(futures):
+            src, dest = futures[future]
+            try:
+                nbytes, digest = future.result()
+            except Exception as e:
+                yield src, dest, 0, None, e
+            else:
+                yield src, dest, nbytes, digest, None
+            if should_terminate():
+                break
+    finally:
+        for future in futures:
+            future.cancel()
+        # wait for any transfers in progress so no temporary files are left behind
+        executor.shutdown(wait=True)
+
+
+class TransferStats:
+    """Track the number of files & bytes transferred and the throughput"""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.start = time.monotonic()
+
+    def add(self, nbytes):
+        self.files += 1
+        self.bytes += nbytes
+
+    @property
+    def mb_per_s(self):
+        elapsed = time.monotonic() - self.start
+        return self.bytes / 1e6 / elapsed if elapsed > 0 else 0.
+
+
+class TransferManifest(JSONStore):
+    """
+    Persistent record of the size, modification time and SHA-256 digest of
+    each source file verified when copied, so that unchanged files can be
+    recognized and skipped on later cycles with a single stat.
+    """
+
+    def clear(self):
+        self.files = {}
+
+    def to_json(self):
+        return {'files': self.files}
+
+    def from_json(self, data):
+        self.files = data['files']
+
+    def unchanged(self, src, dest, stat):
+        """Was src (with os.stat result stat) already copied to dest, and does
+        that copy still exist?"""
+        entry = self.files.get(str(src))
+        return bool(
+            entry and entry['dest'] == str(dest) and entry['size'] == stat.st_size
+            and entry['mtime_ns'] == stat.st_mtime_ns and os.path.exists(dest)
+        )
+
+    def add(self, src, dest, stat, digest):
+        """Record that src (with os.stat result stat) was copied to dest"""
+        self.files[str(src)] = {
+            'dest': str(dest),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': digest,
+        }
+        self.dirty = True
+
+    def remove(self, src):
+        if self.files.pop(str(src), None) is not None:
+            self.dirty = True
+
+    def prune(self, seen):
+        """Forget any source files not in seen"""
+        seen = {str(p) for p in seen}
+        old = [src for src in self.files if src not in seen]
+        for src in old:
+            del self.files[src]
+        self.dirty = self.dirty or bool(old)
+
+
+# also used by pumps which only move files without the TransferFiles mixin
+VERIFY_FIELD = {
+    'name': 'verify',
+    'label': "Verify checksums",
+    'type': BOOLEAN,
+    'required': False,
+    'default': False,
+    'help': (
+        "Compare SHA-256 checksums of each source file and its copy. Verified copies are recorded "
+        "so that unchanged files are not copied again."
+    ),
+}
+
+
+class TransferFiles:
+    """
+    Mixin for pumps which copy or move files. Pumps using it should add
+    TRANSFER_CONFIG to their CONFIG and call transfer_files.
+    """
+
+    TRANSFER_CONFIG = {
+        'name': 'Transfer',
+        'multiple': False,
+        'fields': [
+            {
+                'name': 'workers',
+                'label': "Concurrent transfers",
+                'type': INT,
+                'required': False,
+                'default': 4,
+                'help': "Enter the maximum number of files to copy or move at the same time.",
+                'validation': {
+                    'min': 1,
+                    'max': 32,
+                },
+            },
+            VERIFY_FIELD,
+        ],
+    }
+
+    manifest = None
+
+    def transfer_files(self, paths, to_dir, mode):
+        """Copy or move (depending on mode) paths into to_dir reporting
+        progress and throughput as each file is transferred. Returns a list
+        of messages describing each transfer."""
+
+        action = "Moved" if mode == "Move" else "Copied"
+        move = mode == "Move"
+        workers = self.get_config_value("Transfer", "workers") or 1
+        verify = bool(self.get_config_value("Transfer", "verify"))
+        transfers = [(f, to_dir / f.name) for f in paths]
+
+        stats = {}
+        if verify:
+            transfers, stats = self.unverified_transfers(transfers, move)
+
+        totals = TransferStats()
+        messages = []
+        results = iter_transfers(transfers, move, workers, self.should_terminate, verify)
+        for src, dest, nbytes, digest, error in results:
+            if error is None:
+                totals.add(nbytes)
+                msg = f"{action} {src} to {dest}"
+                if verify:
+                    self.record_transfer(src, dest, stats.get(src), digest, move)
+            else:
+                msg = f"Failed to {mode} {src} to {dest}: {error}"
+
+            self.log_info(msg)
+            messages.append(msg)
+            self.update_progress(
+                int(100 * len(messages) / len(transfers)),
+                f"{action} {totals.files} of {len(transfers)} files ({totals.mb_per_s:.1f} MB/s)",
+            )
+
+        if totals.files:
+            self.log_info(f"{action} {totals.files} files ({totals.bytes / 1e6:.1f} MB) at {totals.mb_per_s:.1f} MB/s")
+
+        return messages
+
+    def unverified_transfers(self, transfers, move):
+        """Stat each source file and drop copies of files which are recorded
+        in the manifest as already copied and unchanged. Returns the remaining
+        transfers and a dict of {src: stat result}"""
+        manifest = self.get_manifest()
+        remaining = []
+        stats = {}
+        for src, dest in transfers:
+            try:
+                stats[src] = os.stat(src)
+            except OSError:
+                # let the transfer itself report the error
+                remaining.append((src, dest))
+                continue
+            if not move and manifest.unchanged(src, dest, stats[src]):
+                self.log_debug(f"Skipping {src} which is unchanged since it was copied to {dest}")
+                continue
+            remaining.append((src, dest))
+        return remaining, stats
+
+    def record_transfer(self, src, dest, stat, digest, move):
+        """Record a verified copy in the manifest"""
+        manifest = self.get_manifest()
+        if move or stat is None:
+            manifest.remove(src)
+        else:
+            manifest.add(src, dest, stat, digest)
+        if digest is not None:
+            self.log_debug(f"Verified {dest} (sha256 {digest})")
+
+    def get_manifest(self):
+        if self.manifest is None:
+            self.manifest = TransferManifest(self.get_pump_data_path(MANIFEST_FILE))
+            self.manifest.load()
+        return self.manifest
+
+    def save_manifest(self, seen=None):
+        """Forget files which are no longer in the source directories (if
+        seen, the paths found on a full search, is given) and save the
+        manifest"""
+        if self.manifest is None:
+            return
+        if seen is not None:
+            self.manifest.prune(seen)
+        try:
+            self.manifest.save()
+        except OSError as e:
+            self.log_warning(f"Unable to save the transfer manifest to {self.manifest.path}: {e}")
@@ -0,0 +1,495 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+from pathlib import Path
+import select
+import struct
+import sys
+import threading
+import time
+
+from qcpump.pumps.base import BOOLEAN, UINT
+
+# inotify event flags (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0)
+
+# files are only reported once they have been closed after writing (or moved
+# into place). IN_CREATE is still needed to watch new subdirectories and
+# IN_MODIFY restarts the quiet time of files which are written to again
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+EVENT_BUFFER_SIZE = 64 * 1024
+
+STOP_CHECK_INTERVAL = 0.5  # how often (s) watcher threads check whether they should stop
+DEFAULT_POLL_INTERVAL = 60  # how often (s) directories are rescanned when change notifications aren't available
+
+_libc = None
+
+
+def get_libc():
+    """Return the C library if it provides inotify (i.e. on Linux) or None"""
+    global _libc
+    if _libc is None and sys.platform.startswith("linux"):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            _libc = libc
+        except (OSError, AttributeError):
+            _libc = False
+    return _libc or None
+
+
+def inotify_available():
+    return get_libc() is not None
+
+
+class DebouncedQueue:
+    """
+    A set of paths which are only released once no new events have been
+    seen for them for delay seconds. This allows e.g. a file which is being
+    written in several chunks to be processed once, after it has been
+    completely written.
+
+        queue = DebouncedQueue(5)
+        queue.add("/some/file.csv")
+        ...
+        queue.ready()  # -> ["/some/file.csv"] once 5s have passed since the last add
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, path):
+        with self.lock:
+            self.pending[path] = time.monotonic()
+
+    def touch(self, path):
+        """Restart the delay for path if it is already queued"""
+        with self.lock:
+            if path in self.pending:
+                self.pending[path] = time.monotonic()
+
+    def has_ready(self):
+        cutoff = time.monotonic() - self.delay
+        with self.lock:
+            return any(t <= cutoff for t in self.pending.values())
+
+    def ready(self):
+        """Remove and return all paths which have been quiet for at least delay seconds"""
+        cutoff = time.monotonic() - self.delay
+        with self.lock:
+            paths = [p for p, t in self.pending.items() if t <= cutoff]
+            for p in paths:
+                del self.pending[p]
+        return sorted(paths)
+
+    def clear(self):
+        with self.lock:
+            self.pending = {}
+
+
+class WatcherThread(threading.Thread):
+    """Base class for threads reporting changed files below root to on_path.
+    include_dir(path) can be used to skip subdirectories which don't need
+    to be watched and on_modify(path) is called (where supported) each time
+    a file is written to"""
+
+    def __init__(self, root, recursive, on_path, on_overflow, include_dir=None, on_modify=None):
+        super().__init__(daemon=True)
+        self.root = os.fspath(root)
+        self.recursive = recursive
+        self.on_path = on_path
+        self.on_overflow = on_overflow
+        self.include_dir = include_dir or (lambda path: True)
+        self.on_modify = on_modify or (lambda path: None)
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class InotifyWatcher(WatcherThread):
+    """Report files written (once they are closed) or moved below root using
+    Linux's inotify API"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.libc = get_libc()
+        if self.libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available on this platform")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.watches = {}
+        try:
+            self.add_tree(self.root, report_files=False)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"{os.strerror(err)}: {path}")
+        self.watches[wd] = path
+
+    def add_tree(self, path, report_files=True):
+        """Watch path (and its subdirectories if recursive). Files already
+        present in newly created directories are reported since they may
+        have been written before the watch was added."""
+        self.add_watch(path)
+        if not (self.recursive or report_files):
+            return
+
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if is_dir and self.recursive and self.include_dir(entry.path):
+                    try:
+                        self.add_tree(entry.path, report_files)
+                    except OSError:
+                        continue
+                elif not is_dir and report_files:
+                    self.on_path(entry.path)
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                readable, __, __ = select.select([self.fd], [], [], STOP_CHECK_INTERVAL)
+                if readable:
+                    try:
+                        data = os.read(self.fd, EVENT_BUFFER_SIZE)
+                    except BlockingIOError:
+                        continue
+                    self.handle_events(data)
+        finally:
+            os.close(self.fd)
+
+    def handle_events(self, data):
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.on_overflow()
+                continue
+
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+
+            parent = self.watches.get(wd)
+            if parent is None or not name:
+                continue
+
+            path = os.path.join(parent, name)
+            if mask & IN_ISDIR:
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO) and self.include_dir(path):
+                    try:
+                        self.add_tree(path)
+                    except OSError:
+                        # couldn't watch the new directory so make sure its files get found
+                        self.on_overflow()
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self.on_path(path)
+            elif mask & IN_MODIFY:
+                self.on_modify(path)
+
+
+class PollingWatcher(WatcherThread):
+    """Report files created or modified below root by periodically comparing
+    directory listings. This works for network shares and other file systems
+    which don't support change notifications."""
+
+    def __init__(self, *args, interval=DEFAULT_POLL_INTERVAL, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.interval = interval
+        if not os.path.isdir(self.root):
+            raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), self.root)
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self):
+        """Return {file path: (size, mtime)} for all files below root"""
+        snapshot = {}
+        dirs = [self.root]
+        while dirs:
+            path = dirs.pop()
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir():
+                                if self.recursive and self.include_dir(entry.path):
+                                    dirs.append(entry.path)
+                            else:
+                                stat = entry.stat()
+                                snapshot[entry.path] = (stat.st_size, stat.st_mtime)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return snapshot
+
+    def poll(self):
+        """Report any files which are new or have changed since the last poll"""
+        snapshot = self.take_snapshot()
+        for path, signature in snapshot.items():
+            if self.snapshot.get(path) != signature:
+                self.on_path(path)
+        self.snapshot = snapshot
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.poll()
+
+
+class DirectoryWatcher:
+    """
+    Watch one or more directories for new or modified files and collect the
+    changed paths in a DebouncedQueue. inotify is used where available and
+    directory polling otherwise (or if polling is True). e.g.
+
+        watcher = DirectoryWatcher([("/some/dir", True)], delay=5)
+        errors = watcher.start()
+        ...
+        if watcher.needs_rescan():
+            paths = full_scan()
+        else:
+            paths = watcher.ready()
+        ...
+        watcher.stop()
+
+    needs_rescan is True if events may have been missed (e.g. the kernel
+    event queue overflowed) and the watched directories should be scanned in
+    full.
+    """
+
+    def __init__(self, roots, delay=5, polling=False, poll_interval=DEFAULT_POLL_INTERVAL, include_dir=None):
+        self.roots = roots
+        self.polling = polling or not inotify_available()
+        self.poll_interval = poll_interval
+        self.include_dir = include_dir
+        self.queue = DebouncedQueue(delay)
+        self.threads = []
+        self.rescan_event = threading.Event()
+
+    def start(self):
+        """Start watching all roots and return a list of error messages for
+        any that couldn't be watched"""
+        errors = []
+        for root, recursive in self.roots:
+            try:
+                thread = self.create_thread(root, recursive)
+            except OSError as e:
+                errors.append(f"Unable to watch {root}: {e}")
+                continue
+            thread.start()
+            self.threads.append(thread)
+        return errors
+
+    def create_thread(self, root, recursive):
+        args = (root, recursive, self.queue.add, self.rescan_event.set, self.include_dir)
+        if not self.polling:
+            try:
+                return InotifyWatcher(*args, on_modify=self.queue.touch)
+            except OSError as e:
+                if e.errno != errno.ENOSPC:
+                    raise
+                # out of inotify watches so fall back to polling this root
+        return PollingWatcher(*args, interval=self.poll_interval)
+
+    def stop(self):
+        for thread in self.threads:
+            thread.stop()
+        self.threads = []
+
+    def needs_rescan(self):
+        """Return True (once) if events may have been missed since the last call"""
+        rescan = self.rescan_event.is_set()
+        self.rescan_event.clear()
+        return rescan
+
+    def has_ready(self):
+        return self.queue.has_ready()
+
+    def ready(self):
+        return [Path(p) for p in self.queue.ready()]
+
+    def clear(self):
+        self.queue.clear()
+
+
+class WatchDirectories:
+    """
+    Mixin allowing pumps which look for files to be processed to react to
+    files being written rather than searching for files on every pump run.
+    Pumps using it should add WATCH_CONFIG to their CONFIG, implement
+    watch_roots and call watched_paths at the start of each search.
+    """
+
+    WATCH_CONFIG = {
+        'name': 'Watch',
+        'multiple': False,
+        'fields': [
+            {
+                'name': 'enabled',
+                'type': BOOLEAN,
+                'required': False,
+                'default': False,
+                'help': (
+                    "Check to watch the source directories for new files and process them "
+                    "as soon as they are written, rather than only searching for new files "
+                    "every pump interval."
+                ),
+            },
+            {
+                'name': 'polling',
+                'type': BOOLEAN,
+                'required': False,
+                'default': False,
+                'help': (
+                    "Check to detect new files by periodically listing the source directories. "
+                    "Use this for network shares which don't report file changes. "
+                    "Polling is always used on platforms other than Linux."
+                ),
+            },
+            {
+                'name': 'poll interval (s)',
+                'label': "Polling interval (s)",
+                'type': UINT,
+                'required': False,
+                'default': DEFAULT_POLL_INTERVAL,
+                'help': (
+                    "How often to list the source directories when polling. Each poll reads every "
+                    "watched directory, so avoid short intervals for large trees on network shares."
+                ),
+            },
+            {
+                'name': 'debounce (s)',
+                'label': "Quiet time (s)",
+                'type': UINT,
+                'required': False,
+                'default': 5,
+                'help': "Wait until a file hasn't changed for this many seconds before processing it.",
+            },
+            {
+                'name': 'rescan (min)',
+                'label': "Full search interval (min)",
+                'type': UINT,
+                'required': False,
+                'default': 60,
+                'help': (
+                    "Search the source directories in full this often as a safety net for any "
+                    "missed files. Set to 0 to only search when the pump starts."
+                ),
+            },
+        ],
+    }
+
+    watcher = None
+    watcher_config = None
+    last_full_search = None
+
+    def watch_roots(self):
+        """Return a list of (directory, recursive) pairs to watch. Must be overridden in subclasses"""
+        raise NotImplementedError
+
+    def watch_include_dir(self):
+        """Return a function include_dir(path) used to skip watching some
+        subdirectories (or None to watch all subdirectories)"""
+        return None
+
+    def watched_paths(self):
+        """Return a list of paths which have been written since the last call
+        or None if a full search for files should be done instead (e.g. watch
+        mode is disabled or the watcher was just started)"""
+
+        if not self.get_config_value("Watch", "enabled"):
+            self.stop_watching()
+            return None
+
+        polling = self.get_config_value("Watch", "polling")
+        delay = self.get_config_value("Watch", "debounce (s)")
+        poll_interval = max(1, self.get_config_value("Watch", "poll interval (s)") or DEFAULT_POLL_INTERVAL)
+        config = (tuple(self.watch_roots()), polling, delay, poll_interval)
+        if self.watcher is None or config != self.watcher_config:
+            self.start_watching(config)
+
+        rescan_minutes = self.get_config_value("Watch", "rescan (min)")
+        now = time.monotonic()
+        rescan_due = (
+            self.last_full_search is None or
+            (rescan_minutes and now - self.last_full_search >= rescan_minutes * 60)
+        )
+        if self.watcher.needs_rescan() or rescan_due:
+            self.last_full_search = now
+            self.watcher.clear()
+            return None
+
+        return self.watcher.ready()
+
+    def start_watching(self, config):
+        self.stop_watching()
+        roots, polling, delay, poll_interval = config
+        self.watcher = DirectoryWatcher(
+            roots, delay=delay, polling=polling, poll_interval=poll_interval, include_dir=self.watch_include_dir(),
+        )
+        for error in self.watcher.start():
+            self.log_warning(error)
+        mode = "polling" if self.watcher.polling else "change notifications"
+        self.log_info(f"Watching {', '.join(str(r) for r, __ in roots)} for new files using {mode}")
+        self.watcher_config = config
+        self.last_full_search = None
+
+    def stop_watching(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.watcher = None
+        self.watcher_config = None
+
+    def has_pending_work(self):
+        watcher = self.watcher
+        return watcher is not None and watcher.has_ready()
+
+    def pumping_stopped(self):
+        self.stop_watching()
+        super().pumping_stopped()
+
+    @staticmethod
+    def filter_watched_paths(paths, source, pattern, recursive):
+        """Return the paths which are files in (or below if recursive) the
+        source directory and whose names match the glob pattern"""
+        source = Path(source).absolute()
+        filtered = []
+        for path in paths:
+            abs_path = path.absolute()
+            in_source = source in abs_path.parents if recursive else abs_path.parent == source
+            if in_source and path.match(pattern) and path.is_file():
+                filtered.append(path)
+        return filtered
@@ -0,0 +1,144 @@
+import datetime
+
+DATE_GROUP_FMT = "%Y-%m-%d-%H-%M"
+
+
+class Window:
+    """A group of records which were acquired within window_minutes of the
+    first record in the group"""
+
+    def __init__(self, group, start, window_minutes):
+        self.group = group
+        self.start = start
+        self.end = start + datetime.timedelta(minutes=window_minutes)
+        self.key = start.strftime(DATE_GROUP_FMT)
+        self.latest = start
+        self.members = {}
+        self.flushed = False
+
+    def add(self, member_key, timestamp, member):
+        self.members[member_key] = (timestamp, member)
+        self.latest = max(self.latest, timestamp)
+
+    def contains(self, timestamp):
+        return self.start <= timestamp <= self.end
+
+    def sorted_members(self):
+        return [member for __, member in sorted(self.members.values(), key=lambda m: m[0])]
+
+
+class WindowTracker:
+    """
+    Keeps track of date/time windows of grouped records across pump cycles so
+    that each cycle only needs to add newly found records and then flush the
+    windows whose deadline (time of the latest record + wait time) has
+    passed.
+
+    Flushed windows are returned again on every flush until the pump marks
+    them as done (e.g. after a successful upload) so that failed uploads are
+    retried on the next cycle. Members of done windows are remembered (until
+    pruned) so they are not grouped again when they are fetched again. e.g.
+
+        tracker = WindowTracker()
+        tracker.check_config((tds_directory, window_minutes))
+        for row in new_rows:
+            tracker.add(row['machine_id'], row['work_started'], row['data_key'], row, window_minutes)
+
+        for group, window_key, rows in tracker.flush(wait_minutes):
+            upload(rows)
+            tracker.done(group, window_key)
+    """
+
+    def __init__(self):
+        self.config = None
+        self.clear()
+
+    def clear(self):
+        # group -> list of open/flushed windows ordered by start time
+        self.windows = {}
+        # member_key -> Window for all open/flushed members
+        self.members = {}
+        # member_key -> timestamp for all members of completed windows
+        self.done_members = {}
+
+    def check_config(self, config):
+        """Forget all windows if the configuration they were created with has changed"""
+        if config != self.config:
+            self.clear()
+            self.config = config
+
+    def __contains__(self, member_key):
+        return member_key in self.members or member_key in self.done_members
+
+    def __len__(self):
+        return sum(len(windows) for windows in self.windows.values())
+
+    def add(self, group, timestamp, member_key, member, window_minutes):
+        """Add member to an existing open window for group or start a new
+        one. Returns False if the member is already known"""
+
+        if member_key in self:
+            return False
+
+        windows = self.windows.setdefault(group, [])
+        window = None
+        key = timestamp.strftime(DATE_GROUP_FMT)
+        for candidate in reversed(windows):
+            if not candidate.flushed and (candidate.contains(timestamp) or candidate.key == key):
+                window = candidate
+                break
+
+        if window is None:
+            window = Window(group, timestamp, window_minutes)
+            windows.append(window)
+            windows.sort(key=lambda w: w.start)
+        elif timestamp > window.end:
+            window.end = timestamp + datetime.timedelta(minutes=window_minutes)
+
+        window.add(member_key, timestamp, member)
+        self.members[member_key] = window
+        return True
+
+    def flush(self, wait_minutes, now=None):
+        """Return a list of (group, window_key, members) for all windows whose
+        deadline has passed and which have not been marked done yet"""
+
+        now = now or datetime.datetime.now()
+        wait = datetime.timedelta(minutes=wait_minutes)
+        flushed = []
+        for group, windows in self.windows.items():
+            for window in windows:
+                if window.flushed or window.latest + wait <= now:
+                    window.flushed = True
+                    flushed.append((group, window.key, window.sorted_members()))
+        return flushed
+
+    def done(self, group, window_key):
+        """Mark a flushed window as complete so it is not returned by flush again"""
+
+        windows = self.windows.get(group, [])
+        for window in windows:
+            if window.key == window_key and window.flushed:
+                windows.remove(window)
+                for member_key, (timestamp, __) in window.members.items():
+                    self.members.pop(member_key, None)
+                    self.done_members[member_key] = timestamp
+                break
+
+        if not windows:
+            self.windows.pop(group, None)
+
+    def prune(self, before):
+        """Forget completed members with timestamps before the input date and
+        any open/flushed windows (e.g. ones which repeatedly failed to upload)
+        whose latest member is before the input date"""
+        self.done_members = {k: ts for k, ts in self.done_members.items() if ts >= before}
+
+        for group in list(self.windows):
+            windows = self.windows[group]
+            for window in [w for w in windows if w.latest < before]:
+                windows.remove(window)
+                for member_key in window.members:
+                    self.members.pop(member_key, None)
+            if not windows:
+                del self.windows[group]
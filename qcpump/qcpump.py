@@ -22,6 +22,7 @@ import qcpump.ui as ui
 settings = Settings()
 
 PUMP_THREAD_JOIN_TIMEOUT = 5  # timeout after 5s while waiting for pump threads to finish
+PENDING_WORK_CHECK_INTERVAL = 1  # how often (s) to check whether pumps have work waiting between intervals
 
 TOOL_TIP_PUMPING_START = "Click to begin pumping"
 TOOL_TIP_PUMPING_PAUSE = "Click to pause pumping"
@@ -491,6 +492,8 @@ class PumpWindow(wx.SplitterWindow):
         self.timer = wx.Timer(self)
         self.pump_thread = None
         self.Bind(wx.EVT_TIMER, self.OnPumpTimer, source=self.timer)
+        self.pending_work_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnPendingWorkTimer, source=self.pending_work_timer)
 
         self.Bind(EVT_PUMP_PROGRESS, self.OnPumpProgress)
         self.Bind(EVT_PUMP_COMPLETE, self.OnPumpComplete)
@@ -504,6 +507,11 @@ class PumpWindow(wx.SplitterWindow):
         """Interval timer triggered. Run the pump!"""
         self._run_pump()
 
+    def OnPendingWorkTimer(self, evt):
+        """Run the pump early if it has work waiting (e.g. new files in a watched directory)"""
+        if self.pump.has_pending_work():
+            self._run_pump()
+
     def OnPumpProgress(self, evt):
         """Pump thread sent a progress event. Update the status accordingly"""
         result = evt.GetValue()
@@ -529,6 +537,7 @@ class PumpWindow(wx.SplitterWindow):
         self._run_pump()
         interval = self.pump.get_config_value("Pump", "interval (s)")
         self.timer.Start(interval * 1000)
+        self.pending_work_timer.Start(PENDING_WORK_CHECK_INTERVAL * 1000)
 
     def _run_pump(self):
         """If our pump is not already running, start it up."""
@@ -539,10 +548,12 @@ class PumpWindow(wx.SplitterWindow):
     def stop_pumping(self):
         """App requested we stop pumping. Note the apps kill_event is set by this point"""
         self.timer.Stop()
+        self.pending_work_timer.Stop()
         if self.pump_thread:
             # Give the thread some time to finish if it needs it
             self.pump_thread.join(PUMP_THREAD_JOIN_TIMEOUT)
             self.pump_thread = None
+        self.pump.pumping_stopped()
         self.app.pump_stopped(self.name)
 
     def set_dirty(self, dirty):
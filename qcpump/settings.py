@@ -73,6 +73,10 @@ class Settings:
     PUMP_DIRECTORIES = None  # set to list of other directories to include user defined pump types from
 
     DB_CONNECT_TIMEOUT = 30  # timeout for database connections where available
+    SLOW_QUERY_MS = 5000  # log a warning for database queries that take longer than this (ms). 0 to disable
+    DB_QUERY_WORKERS = 4  # maximum number of concurrent queries per database driver
+    DB_SERVER_MAX_QUERIES = 2  # maximum number of concurrent queries to a single database server
+    DB_QUERY_TIMEOUT = 0  # stop waiting for database queries that take longer than this (s). 0 to disable
 
     MAX_HTTP_307_COUNT = 3
     HTTP_307_SLEEP_TIME = 0.5
@@ -0,0 +1,59 @@
+import datetime
+
+from qcpump.pumps.common.backfill import BackfillCheckpoint, BackfillProgress, date_chunks, parse_date
+
+d1 = datetime.date(2021, 1, 1)
+
+
+def days(n):
+    return d1 + datetime.timedelta(days=n)
+
+
+def test_parse_date():
+    assert parse_date(" 2021-01-01 ") == d1
+
+
+def test_date_chunks():
+    assert date_chunks(d1, days(17), 7) == [(d1, days(7)), (days(7), days(14)), (days(14), days(17))]
+
+
+def test_date_chunks_empty():
+    assert date_chunks(days(7), d1, 7) == []
+
+
+class TestBackfillCheckpoint:
+
+    def test_load_missing(self, tmp_path):
+        assert BackfillCheckpoint(tmp_path / "checkpoint.json").load(d1) == d1
+
+    def test_save_load(self, tmp_path):
+        checkpoint = BackfillCheckpoint(tmp_path / "pump" / "checkpoint.json")
+        checkpoint.save(d1, days(14))
+        assert checkpoint.load(d1) == days(14)
+        assert not (tmp_path / "pump" / "checkpoint.json.tmp").exists()
+
+    def test_start_date_changed(self, tmp_path):
+        checkpoint = BackfillCheckpoint(tmp_path / "checkpoint.json")
+        checkpoint.save(d1, days(14))
+        assert checkpoint.load(days(-7)) == days(-7)
+
+    def test_corrupt(self, tmp_path):
+        path = tmp_path / "checkpoint.json"
+        path.write_text("{not json")
+        assert BackfillCheckpoint(path).load(d1) == d1
+
+
+class TestBackfillProgress:
+
+    def test_percent(self):
+        progress = BackfillProgress(4, 1)
+        assert progress.percent == 25
+        assert progress.eta is None
+        progress.chunk_complete()
+        assert progress.percent == 50
+        assert progress.eta >= 0
+
+    def test_message(self):
+        progress = BackfillProgress(4)
+        progress.chunk_complete()
+        assert progress.message(days(7)).startswith("Backfilled to 2021-01-08 (1/4 chunks, ETA ")
@@ -0,0 +1,235 @@
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from qcpump.core import db
+
+
+@pytest.fixture
+def query_root(tmp_path):
+    (tmp_path / "fdb" / "01.03").mkdir(parents=True)
+    (tmp_path / "fdb" / "01.04").mkdir(parents=True)
+    (tmp_path / "fdb" / "db_version.sql").write_text("SELECT version")
+    (tmp_path / "fdb" / "01.03" / "trend.sql").write_text("SELECT 1.3")
+    (tmp_path / "fdb" / "01.04" / "trend.sql").write_text("SELECT 1.4")
+    return tmp_path
+
+
+class TestQueryRegistry:
+
+    def test_get(self, query_root):
+        registry = db.QueryRegistry(query_root)
+        assert registry.get("fdb", "db_version.sql") == "SELECT version"
+        assert registry.get("fdb", "trend.sql", version="01.04") == "SELECT 1.4"
+
+    def test_get_missing(self, query_root):
+        registry = db.QueryRegistry(query_root)
+        with pytest.raises(KeyError):
+            registry.get("fdb", "trend.sql", version="9.9")
+
+    def test_has(self, query_root):
+        registry = db.QueryRegistry(query_root)
+        assert registry.has("fdb", "trend.sql", version="01.03")
+        assert not registry.has("mssql", "trend.sql", version="01.03")
+
+    def test_versions(self, query_root):
+        assert db.QueryRegistry(query_root).versions("fdb") == ["01.03", "01.04"]
+
+    def test_loaded_once(self, query_root):
+        registry = db.QueryRegistry(query_root)
+        registry.get("fdb", "db_version.sql")
+        (query_root / "fdb" / "db_version.sql").write_text("changed")
+        assert registry.get("fdb", "db_version.sql") == "SELECT version"
+        registry.clear()
+        assert registry.get("fdb", "db_version.sql") == "changed"
+
+
+class TestQueryStats:
+
+    def test_sqlite_query_records_timing(self, tmp_path):
+        stats = db.QueryStats()
+        connect_kwargs = {'database': str(tmp_path / "test.sqlite3")}
+        db.sqlite_query(connect_kwargs, "CREATE TABLE foo (bar INTEGER)", stats=stats)
+        db.sqlite_query(connect_kwargs, "INSERT INTO foo VALUES (1), (2)", stats=stats)
+        rows = db.sqlite_query(connect_kwargs, "SELECT bar FROM foo", stats=stats)
+        assert rows == [(1,), (2,)]
+        assert stats.last.rows == 2
+        assert stats.summary()['count'] == 3
+
+    def test_summary_empty(self):
+        assert db.QueryStats().summary() == {'count': 0}
+
+    def test_rolling(self):
+        stats = db.QueryStats(maxlen=2)
+        for i in range(3):
+            stats.record(db.QueryTiming("SELECT 1", i, i, i, i))
+        summary = stats.summary()
+        assert summary['count'] == 2
+        assert summary['max'] == 6
+        assert summary['rows'] == 1.5
+
+    def test_slow_query_warning(self):
+        warn = mock.Mock()
+        stats = db.QueryStats(warn=warn)
+        with mock.patch.object(db.settings, "SLOW_QUERY_MS", 10):
+            db.record_query_timing(db.QueryTiming("SELECT   *\nFROM foo", 1, 1, 1, 0), stats)
+            assert not warn.called
+            db.record_query_timing(db.QueryTiming("SELECT   *\nFROM foo", 5, 5, 5, 0), stats)
+            assert "Slow query" in warn.call_args[0][0]
+            assert "SELECT * FROM foo" in warn.call_args[0][0]
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    path = str(tmp_path / "db.sqlite3")
+    db.sqlite_query({'database': path}, "CREATE TABLE results (data_key INTEGER, machine_id INTEGER)")
+    for data_key in range(10):
+        db.sqlite_query({'database': path}, "INSERT INTO results VALUES (?, ?)", params=[data_key, data_key % 5])
+    return {'database': path}
+
+
+def prepare_results_query(machine_ids):
+    placeholders = ','.join("?" for __ in machine_ids)
+    return f"SELECT * FROM results WHERE machine_id IN ({placeholders}) ORDER BY data_key", machine_ids
+
+
+class TestBatchedQuery:
+
+    def test_in_batch_size(self):
+        assert db.in_batch_size("mssql", 100) == db.MAX_IN_ITEMS
+        assert db.in_batch_size("fdb", 100) == 1400
+        assert db.in_batch_size("unknown") == db.MAX_IN_ITEMS
+        assert db.in_batch_size("sqlite", 5000) == 1
+
+    def test_single_batch(self, sqlite_db):
+        rows = db.batched_query(
+            db.sqlite_query, sqlite_db, prepare_results_query, [4, 0], 10, key="data_key", fetch_method="fetchallmap",
+        )
+        assert [r['data_key'] for r in rows] == [0, 4, 5, 9]
+
+    @pytest.mark.parametrize("max_workers", [1, 3])
+    def test_multiple_batches_merged(self, sqlite_db, max_workers):
+        querier = mock.Mock(side_effect=db.sqlite_query)
+        rows = db.batched_query(
+            querier, sqlite_db, prepare_results_query, [4, 0, 1, 0], 2, key="data_key", max_workers=max_workers,
+            fetch_method="fetchallmap",
+        )
+        assert querier.call_count == 2
+        assert [r['data_key'] for r in rows] == [0, 1, 4, 5, 6, 9]
+
+    def test_multiple_batches_no_key(self, sqlite_db):
+        rows = db.batched_query(db.sqlite_query, sqlite_db, prepare_results_query, [4, 0, 1], 2)
+        assert rows == [(0, 0), (4, 4), (5, 0), (9, 4), (1, 1), (6, 1)]
+
+    def test_no_items(self, sqlite_db):
+        querier = mock.Mock()
+        assert db.batched_query(querier, sqlite_db, prepare_results_query, [], 2) == []
+        querier.assert_not_called()
+
+
+class TestQueryExecutor:
+
+    def test_submit(self, sqlite_db):
+        executor = db.QueryExecutor(max_workers=2)
+        future = executor.submit(db.sqlite_query, sqlite_db, "SELECT COUNT(*) FROM results")
+        assert future.result() == [(10,)]
+        executor.shutdown()
+
+    def test_timeout(self):
+        release = threading.Event()
+
+        def slow_query(connect_kwargs, statement, params=None, fetch_method="fetchall", stats=None):
+            release.wait(5)
+            return []
+
+        executor = db.QueryExecutor(max_workers=1)
+        future = executor.submit(slow_query, {}, "SELECT 1", timeout=0.05)
+        with pytest.raises(db.QueryTimeout):
+            future.result()
+        release.set()
+        executor.shutdown()
+
+    def test_kill_event_cancels_queued_query(self):
+        release = threading.Event()
+        kill_event = threading.Event()
+        querier = mock.Mock(side_effect=lambda *args, **kwargs: release.wait(5))
+        querier.__name__ = "querier"
+
+        executor = db.QueryExecutor(max_workers=1)
+        running = executor.submit(querier, {}, "SELECT 1", kill_event=kill_event)
+        queued = executor.submit(querier, {}, "SELECT 2", kill_event=kill_event)
+        kill_event.set()
+        with pytest.raises(db.QueryCancelled):
+            queued.result()
+        with pytest.raises(db.QueryCancelled):
+            running.result()
+        release.set()
+        executor.shutdown()
+        assert querier.call_count == 1
+
+    def test_server_limit(self):
+        lock = threading.Lock()
+        counts = {'running': 0, 'max': 0}
+
+        def query(connect_kwargs, statement, params=None, fetch_method="fetchall", stats=None):
+            with lock:
+                counts['running'] += 1
+                counts['max'] = max(counts['max'], counts['running'])
+            time.sleep(0.02)
+            with lock:
+                counts['running'] -= 1
+            return [statement]
+
+        executor = db.QueryExecutor(max_workers=4, max_server_queries=2)
+        futures = [executor.submit(query, {'host': 'server1'}, i) for i in range(6)]
+        assert [f.result() for f in futures] == [[i] for i in range(6)]
+        assert counts['max'] == 2
+        executor.shutdown()
+
+    def test_slow_server_does_not_block_others(self):
+        release = threading.Event()
+
+        def query(connect_kwargs, statement, params=None, fetch_method="fetchall", stats=None):
+            if connect_kwargs['host'] == "slow":
+                release.wait(5)
+            return [statement]
+
+        executor = db.QueryExecutor(max_workers=2, max_server_queries=1)
+        slow = [executor.submit(query, {'host': 'slow'}, i) for i in range(3)]
+        fast = executor.submit(query, {'host': 'fast'}, "fast", timeout=1)
+        assert fast.result() == ["fast"]
+        release.set()
+        assert [f.result() for f in slow] == [[i] for i in range(3)]
+        executor.shutdown()
+
+    def test_cancelled_waiting_query_releases_slot(self):
+        release = threading.Event()
+        querier = mock.Mock(side_effect=lambda connect_kwargs, statement, **kwargs: release.wait(5) and [statement])
+        querier.__name__ = "querier"
+
+        executor = db.QueryExecutor(max_workers=2, max_server_queries=1)
+        running = executor.submit(querier, {}, "SELECT 1")
+        waiting = executor.submit(querier, {}, "SELECT 2", timeout=0.05)
+        with pytest.raises(db.QueryTimeout):
+            waiting.result()
+        release.set()
+        assert running.result() == ["SELECT 1"]
+        assert executor.submit(querier, {}, "SELECT 3").result() == ["SELECT 3"]
+        executor.shutdown()
+        assert querier.call_count == 2
+        assert executor.server_running == {("", None): 0}
+
+    def test_server_key(self):
+        assert db.server_key({'host': 'Server', 'port': 3050}) == ("server", 3050)
+        assert db.server_key({'server': 'server', 'port': 3050}) == ("server", 3050)
+        assert db.server_key({'dsn': 'server:C:/data/db.fdb'}) == ("server", None)
+
+    def test_batched_query_executor(self, sqlite_db):
+        executor = db.QueryExecutor(max_workers=2)
+        rows = db.batched_query(
+            db.sqlite_query, sqlite_db, prepare_results_query, [0, 1, 2, 3, 4], 2, key=0, executor=executor,
+        )
+        assert [r[0] for r in rows] == list(range(10))
+        executor.shutdown()
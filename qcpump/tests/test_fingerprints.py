@@ -0,0 +1,66 @@
+import os
+
+from qcpump.pumps.common.fingerprints import FingerprintStore, files_fingerprint
+
+
+def test_files_fingerprint(tmp_path):
+    a = tmp_path / "a.csv"
+    b = tmp_path / "b.csv"
+    a.write_text("a")
+    b.write_text("b")
+    fingerprint = files_fingerprint([a, b])
+    assert files_fingerprint([b, a]) == fingerprint
+
+    os.utime(a, ns=(0, 10**9))
+    assert files_fingerprint([a, b]) != fingerprint
+
+
+class TestFingerprintStore:
+
+    def test_add_get(self):
+        store = FingerprintStore()
+        assert store.get("rec") is None
+        store.add("rec", "abc", "2021-01-01-00-00")
+        assert store.get("rec") == "abc"
+        assert not store.changed("rec")
+        store.add("rec", "def", "2021-01-01-00-00", changed=True)
+        assert store.get("rec") == "def"
+        assert store.changed("rec")
+
+    def test_persisted(self, tmp_path):
+        path = tmp_path / "fingerprints.json"
+        store = FingerprintStore(path)
+        store.add("rec", "abc", "2021-01-01-00-00")
+        store.save()
+        assert not store.dirty
+
+        loaded = FingerprintStore(path)
+        loaded.load()
+        assert loaded.get("rec") == "abc"
+
+    def test_save_only_when_dirty(self, tmp_path):
+        path = tmp_path / "fingerprints.json"
+        store = FingerprintStore(path)
+        store.save()
+        assert not path.exists()
+        store.add("rec", "abc", "2021-01-01-00-00")
+        store.save()
+        store.add("rec", "abc", "2021-01-01-00-00")
+        assert not store.dirty
+
+    def test_load_invalid(self, tmp_path):
+        path = tmp_path / "fingerprints.json"
+        path.write_text("not json")
+        store = FingerprintStore(path)
+        store.load()
+        assert store.records == {}
+
+    def test_prune(self):
+        store = FingerprintStore()
+        store.add("old", "abc", "2021-01-01-00-00")
+        store.add("new", "def", "2021-02-01-00-00")
+        store.dirty = False
+        store.prune("2021-01-15-00-00")
+        assert store.get("old") is None
+        assert store.get("new") == "def"
+        assert store.dirty
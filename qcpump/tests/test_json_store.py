@@ -0,0 +1,53 @@
+from qcpump.pumps.common.json_store import JSONStore, read_json, write_json
+
+
+class Store(JSONStore):
+
+    def clear(self):
+        self.items = {}
+
+    def to_json(self):
+        return {'items': self.items}
+
+    def from_json(self, data):
+        self.items = data['items']
+
+
+def test_write_json(tmp_path):
+    path = tmp_path / "pump" / "data.json"
+    write_json(path, {'a': 1})
+    assert read_json(path) == {'a': 1}
+    assert [p.name for p in path.parent.iterdir()] == ["data.json"]
+
+
+class TestJSONStore:
+
+    def test_round_trip(self, tmp_path):
+        store = Store(tmp_path / "store.json")
+        store.items['a'] = 1
+        store.save()
+        assert not (tmp_path / "store.json").exists()
+
+        store.dirty = True
+        store.save()
+        assert not store.dirty
+
+        store = Store(tmp_path / "store.json")
+        store.load()
+        assert store.items == {'a': 1}
+
+    def test_invalid_file(self, tmp_path):
+        for content in ["not json", "[]", '{"other": 1}']:
+            (tmp_path / "store.json").write_text(content)
+            store = Store(tmp_path / "store.json")
+            store.items['a'] = 1
+            store.load()
+            assert store.items == {}
+
+    def test_in_memory(self):
+        store = Store()
+        store.items['a'] = 1
+        store.dirty = True
+        store.load()
+        store.save()
+        assert store.items == {'a': 1}
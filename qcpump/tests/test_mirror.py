@@ -0,0 +1,92 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+from qcpump.pumps.common.mirror import RowMirror
+
+dt1 = datetime.datetime(2021, 3, 31, 1, 23, 34)
+
+
+def minutes(n):
+    return dt1 + datetime.timedelta(minutes=n)
+
+
+def row(machine_id, data_key, work_started, **values):
+    return dict(machine_id=machine_id, data_key=data_key, work_started=work_started, **values)
+
+
+@pytest.fixture(params=[True, False], ids=["upsert", "replace"])
+def mirror(request, tmp_path):
+    mirror = RowMirror(tmp_path / "mirror" / "mirror.sqlite3")
+    # exercise the fallback for SQLite versions without UPSERT support
+    mirror.upsert = request.param
+    return mirror
+
+
+class TestRowMirror:
+
+    def test_add_rows(self, mirror):
+        mirror.add([
+            row(1, 2, minutes(1), dose=Decimal("1.5"), comment=None),
+            row(1, 1, minutes(0), dose=1.0, comment="foo"),
+            row(2, 3, minutes(2), dose=2.0, comment=""),
+        ])
+        assert mirror.rows([1], dt1.date()) == [
+            row(1, 1, minutes(0), dose=1.0, comment="foo"),
+            row(1, 2, minutes(1), dose=1.5, comment=None),
+        ]
+
+    def test_add_updates_existing(self, mirror):
+        mirror.add([row(1, 1, minutes(0), dose=1.0)])
+        mirror.add([row(1, "1", minutes(0), dose=2.0)])
+        assert mirror.rows([1], dt1.date()) == [row(1, "1", minutes(0), dose=2.0)]
+
+    def test_rows_date_range(self, mirror):
+        mirror.add([row(1, 1, minutes(0)), row(1, 2, minutes(60 * 24))])
+        assert [r['data_key'] for r in mirror.rows([1], dt1.date(), dt1.date() + datetime.timedelta(days=1))] == [1]
+        assert [r['data_key'] for r in mirror.rows([1], dt1.date() + datetime.timedelta(days=1))] == [2]
+
+    def test_mark_uploaded(self, mirror):
+        mirror.add([row(1, 1, minutes(0)), row(1, 2, minutes(1))])
+        mirror.mark_uploaded([row(1, "1", minutes(0))])
+        assert [r['data_key'] for r in mirror.rows([1], dt1.date())] == [2]
+        assert [r['data_key'] for r in mirror.rows([1], dt1.date(), include_uploaded=True)] == [1, 2]
+
+        # updating a row doesn't forget that it was uploaded
+        mirror.add([row(1, 1, minutes(0), dose=2.0)])
+        assert [r['data_key'] for r in mirror.rows([1], dt1.date())] == [2]
+
+    def test_prune(self, mirror):
+        mirror.add([row(1, 1, minutes(-60 * 24)), row(1, 2, minutes(0)), row(2, 3, minutes(-60 * 24))])
+        mirror.prune(dt1.date())
+        assert [r['data_key'] for r in mirror.rows([1, 2], dt1.date() - datetime.timedelta(days=7))] == [2]
+        assert mirror.watermark([1, 2]) == 2
+
+    def test_watermark(self, mirror):
+        assert mirror.watermark([1]) is None
+        mirror.add([row(1, 5, minutes(0)), row(1, 3, minutes(1)), row(2, 4, minutes(0))])
+        assert mirror.watermark([1]) == 5
+        assert mirror.watermark([1, 2]) == 4
+        assert mirror.watermark([1, 3]) is None
+
+        # historical rows don't advance the watermark
+        mirror.add([row(1, 7, minutes(-60 * 24))], advance_watermarks=False)
+        assert mirror.watermark([1]) == 5
+
+        # watermarks never go backwards
+        mirror.add([row(1, 2, minutes(0))])
+        assert mirror.watermark([1]) == 5
+
+    def test_watermark_non_integer_keys(self, mirror):
+        mirror.add([row(1, "abc-def", minutes(0))])
+        assert mirror.watermark([1]) is None
+
+    def test_check_config(self, mirror):
+        mirror.check_config({'beam types': ["Photon"]})
+        mirror.add([row(1, 5, minutes(0))])
+        mirror.check_config({'beam types': ["Photon"]})
+        assert mirror.watermark([1]) == 5
+        mirror.check_config({'beam types': ["Photon", "Electron"]})
+        assert mirror.watermark([1]) is None
+        assert len(mirror.rows([1], dt1.date())) == 1
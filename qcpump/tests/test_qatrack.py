@@ -0,0 +1,10 @@
+from qcpump.pumps.common.qatrack import slug_cache_stats, slugify
+
+
+def test_slugify_cached():
+    slugify.cache_clear()
+    assert slug_cache_stats() == "0 slugs cached, 0.0% hit rate"
+    slugify("Flatness 6 MV")
+    slugify("Flatness 6 MV")
+    assert slugify.cache_info().hits == 1
+    assert slug_cache_stats() == "1 slugs cached, 50.0% hit rate"
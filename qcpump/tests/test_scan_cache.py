@@ -0,0 +1,93 @@
+import os
+
+from qcpump.pumps.common.scan_cache import ScanCache, list_dir
+
+
+def is_csv(name):
+    return name.endswith(".csv")
+
+
+def touch_dir(path, mtime):
+    os.utime(path, (mtime, mtime))
+
+
+def test_list_dir(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "a.csv").write_text("")
+    (tmp_path / "b.txt").write_text("")
+    dirs, files = list_dir(tmp_path, is_csv)
+    assert dirs == ["sub"]
+    assert list(files) == ["a.csv"]
+
+
+class TestScanCache:
+
+    def test_hits_and_misses(self, tmp_path):
+        (tmp_path / "a.csv").write_text("")
+        touch_dir(tmp_path, 1000)
+        cache = ScanCache()
+        cache.list_dir(str(tmp_path), is_csv)
+        __, files = cache.list_dir(str(tmp_path), is_csv)
+        assert list(files) == ["a.csv"]
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        (tmp_path / "b.csv").write_text("")
+        touch_dir(tmp_path, 2000)
+        __, files = cache.list_dir(str(tmp_path), is_csv)
+        assert sorted(files) == ["a.csv", "b.csv"]
+        assert (cache.hits, cache.misses) == (1, 2)
+
+    def test_modified_files_restatted(self, tmp_path):
+        (tmp_path / "a.csv").write_text("")
+        os.utime(tmp_path / "a.csv", (1000, 1000))
+        touch_dir(tmp_path, 1000)
+        cache = ScanCache()
+        assert cache.list_dir(str(tmp_path), is_csv)[1] == {"a.csv": 1000}
+
+        # rewriting a file in place doesn't change its directory's mtime
+        (tmp_path / "a.csv").write_text("abc")
+        os.utime(tmp_path / "a.csv", (2000, 2000))
+        touch_dir(tmp_path, 1000)
+        cache.dirty = False
+        assert cache.list_dir(str(tmp_path), is_csv)[1] == {"a.csv": 2000}
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert cache.dirty
+
+    def test_persisted(self, tmp_path):
+        scan_dir = tmp_path / "scan"
+        scan_dir.mkdir()
+        (scan_dir / "a.csv").write_text("")
+        cache_path = tmp_path / "pump" / "cache.json"
+
+        cache = ScanCache(cache_path)
+        cache.check_config(("root", True))
+        cache.begin_scan()
+        cache.list_dir(str(scan_dir), is_csv)
+        cache.end_scan()
+        assert cache_path.exists()
+
+        cache = ScanCache(cache_path)
+        cache.load()
+        cache.check_config(("root", True))
+        cache.list_dir(str(scan_dir), is_csv)
+        assert (cache.hits, cache.misses) == (1, 0)
+
+    def test_rebuilt_on_config_change(self, tmp_path):
+        cache = ScanCache()
+        cache.check_config(("root", True))
+        cache.list_dir(str(tmp_path), is_csv)
+        cache.check_config(("other root", True))
+        assert cache.dirs == {}
+
+    def test_end_scan_forgets_unvisited(self, tmp_path):
+        (tmp_path / "a").mkdir()
+        (tmp_path / "b").mkdir()
+        cache = ScanCache()
+        cache.begin_scan()
+        cache.list_dir(str(tmp_path / "a"), is_csv)
+        cache.list_dir(str(tmp_path / "b"), is_csv)
+        cache.end_scan()
+        cache.begin_scan()
+        cache.list_dir(str(tmp_path / "a"), is_csv)
+        cache.end_scan()
+        assert list(cache.dirs) == [str(tmp_path / "a")]
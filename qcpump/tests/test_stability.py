@@ -0,0 +1,126 @@
+import os
+import time
+from unittest import mock
+
+from qcpump.pumps.common.stability import StabilityIndex, StableFiles
+
+
+def make_old(path, age=3600):
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+class TestStabilityIndex:
+
+    def test_stable_after_settle_time(self, tmp_path):
+        path = tmp_path / "file.txt"
+        path.write_text("abc")
+        make_old(path)
+        index = StabilityIndex(5)
+
+        assert index.filter([path], now=100) == []
+        assert index.held() == [path]
+        assert not index.recheck_due(now=104)
+        assert index.recheck_due(now=105)
+        assert index.filter([path], now=103) == []
+        assert index.filter([path], now=105) == [path]
+        assert index.held() == []
+        assert index.next_check is None
+
+    def test_changed_file_held_back(self, tmp_path):
+        path = tmp_path / "file.txt"
+        path.write_text("abc")
+        make_old(path)
+        index = StabilityIndex(5)
+
+        assert index.filter([path], now=100) == []
+        path.write_text("abcdef")
+        make_old(path)
+        assert index.filter([path], now=105) == []
+        assert index.filter([path], now=110) == [path]
+
+    def test_recently_modified_held_back(self, tmp_path):
+        path = tmp_path / "file.txt"
+        path.write_text("abc")
+        index = StabilityIndex(60)
+        assert index.filter([path], now=100) == []
+        assert index.filter([path], now=200) == []
+
+    def test_future_mtime_rechecked_after_settle_time(self, tmp_path):
+        path = tmp_path / "file.txt"
+        path.write_text("abc")
+        make_old(path, age=-3600)
+        index = StabilityIndex(5)
+
+        assert index.filter([path], now=100) == []
+        assert index.filter([path], now=105) == []
+        assert not index.recheck_due(now=106)
+        assert index.recheck_due(now=110)
+
+    def test_stable_files_not_statted(self, tmp_path):
+        path = tmp_path / "file.txt"
+        path.write_text("abc")
+        make_old(path)
+        index = StabilityIndex(5)
+        index.filter([path], now=100)
+        index.filter([path], now=105)
+
+        with mock.patch("os.stat") as stat:
+            assert index.filter([path], now=110) == [path]
+        stat.assert_not_called()
+
+        index.reset([path])
+        assert index.filter([path], now=115) == []
+
+    def test_missing_and_pruned(self, tmp_path):
+        path = tmp_path / "file.txt"
+        index = StabilityIndex(5)
+        assert index.filter([path], now=100) == []
+        assert index.held() == []
+
+        path.write_text("abc")
+        index.filter([path], now=100)
+        index.prune([])
+        assert index.held() == []
+        assert index.next_check is None
+
+
+class Pump:
+
+    def has_pending_work(self):
+        return False
+
+
+class Stable(StableFiles, Pump):
+
+    def __init__(self, settle):
+        self.settle = settle
+        self.log_info = mock.Mock()
+
+    def get_config_value(self, section, field):
+        return self.settle
+
+
+class TestStableFiles:
+
+    def test_disabled(self, tmp_path):
+        path = tmp_path / "file.txt"
+        path.write_text("abc")
+        pump = Stable(0)
+        assert pump.stable_paths([path]) == [path]
+        assert pump.recheck_paths(None) is None
+        assert pump.recheck_paths([path]) == [path]
+        assert not pump.has_pending_work()
+
+    def test_held_paths_rechecked(self, tmp_path):
+        held = tmp_path / "held.txt"
+        held.write_text("abc")
+        new = tmp_path / "new.txt"
+        pump = Stable(5)
+        assert pump.stable_paths([held]) == []
+        pump.log_info.assert_called_once()
+        assert pump.recheck_paths(None) is None
+        assert pump.recheck_paths([new]) == [new, held]
+
+        pump.stability.next_check = time.monotonic() - 1
+        assert pump.has_pending_work()
@@ -0,0 +1,260 @@
+import errno
+import os
+import stat
+from unittest import mock
+
+from qcpump.pumps.common import transfer
+from qcpump.pumps.common.transfer import (
+    TransferFiles,
+    TransferManifest,
+    copy_file,
+    file_digest,
+    iter_transfers,
+    move_file,
+)
+
+
+class TestCopyFile:
+
+    def test_copy(self, tmp_path):
+        src = tmp_path / "src.txt"
+        src.write_bytes(b"x" * 100000)
+        src.chmod(0o640)
+        dest = tmp_path / "dest.txt"
+        assert copy_file(src, dest) == (100000, None)
+        assert dest.read_bytes() == src.read_bytes()
+        assert stat.S_IMODE(dest.stat().st_mode) == 0o640
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["dest.txt", "src.txt"]
+
+    def test_chunked_fallback(self, tmp_path):
+        src = tmp_path / "src.txt"
+        src.write_bytes(b"abc" * 1000)
+        dest = tmp_path / "dest.txt"
+
+        def unsupported(infd, outfd, offset, count):
+            raise OSError(errno.EXDEV, "unsupported")
+
+        with mock.patch.object(transfer, "offload_methods", return_value=[unsupported]):
+            assert copy_file(src, dest) == (3000, None)
+        assert dest.read_bytes() == src.read_bytes()
+
+    def test_zero_byte_offload_falls_back(self, tmp_path):
+        src = tmp_path / "src.txt"
+        src.write_bytes(b"abc" * 1000)
+        dest = tmp_path / "dest.txt"
+
+        def returns_zero(infd, outfd, offset, count):
+            return 0
+
+        with mock.patch.object(transfer, "offload_methods", return_value=[returns_zero]):
+            assert copy_file(src, dest) == (3000, None)
+        assert dest.read_bytes() == src.read_bytes()
+
+    def test_empty_file(self, tmp_path):
+        src = tmp_path / "src.txt"
+        src.write_bytes(b"")
+        dest = tmp_path / "dest.txt"
+        assert copy_file(src, dest) == (0, None)
+        assert dest.read_bytes() == b""
+
+    def test_short_copy_fails(self, tmp_path):
+        src = tmp_path / "src.txt"
+        src.write_bytes(b"abc" * 1000)
+        dest = tmp_path / "dest.txt"
+        with mock.patch.object(transfer, "copy_fileobj", return_value=10):
+            try:
+                copy_file(src, dest)
+                assert False, "short copy should fail"
+            except OSError as e:
+                assert "10 of 3000" in str(e)
+        assert [p.name for p in tmp_path.iterdir()] == ["src.txt"]
+
+    def test_failure_removes_temp_file(self, tmp_path):
+        src = tmp_path / "src.txt"
+        src.write_text("abc")
+        dest = tmp_path / "dest.txt"
+
+        def fail(infd, outfd, offset, count):
+            raise OSError(errno.EIO, "failed")
+
+        with mock.patch.object(transfer, "offload_methods", return_value=[fail]):
+            try:
+                copy_file(src, dest)
+                assert False, "copy should fail"
+            except OSError:
+                pass
+        assert [p.name for p in tmp_path.iterdir()] == ["src.txt"]
+
+    def test_verify(self, tmp_path):
+        src = tmp_path / "src.txt"
+        src.write_bytes(b"abc" * 1000000)
+        dest = tmp_path / "dest.txt"
+        copied, digest = copy_file(src, dest, verify=True)
+        assert copied == 3000000
+        assert digest == file_digest(src) == file_digest(dest)
+
+    def test_verify_mismatch(self, tmp_path):
+        src = tmp_path / "src.txt"
+        src.write_text("abc")
+        dest = tmp_path / "dest.txt"
+        with mock.patch.object(transfer, "file_digest", return_value="corrupt"):
+            try:
+                copy_file(src, dest, verify=True)
+                assert False, "copy should fail verification"
+            except OSError as e:
+                assert "Checksum" in str(e)
+        assert [p.name for p in tmp_path.iterdir()] == ["src.txt"]
+
+
+class TestMoveFile:
+
+    def test_rename(self, tmp_path):
+        src = tmp_path / "src.txt"
+        src.write_text("abc")
+        dest = tmp_path / "dest.txt"
+        assert move_file(src, dest, verify=True) == (3, None)
+        assert not src.exists()
+        assert dest.read_text() == "abc"
+
+    def test_cross_device(self, tmp_path):
+        src = tmp_path / "src.txt"
+        src.write_text("abc")
+        dest = tmp_path / "dest.txt"
+        real_replace = os.replace
+
+        def replace(a, b):
+            if a == src:
+                raise OSError(errno.EXDEV, "cross device")
+            return real_replace(a, b)
+
+        with mock.patch.object(transfer.os, "replace", side_effect=replace):
+            assert move_file(src, dest, verify=True) == (3, file_digest(dest))
+        assert not src.exists()
+        assert dest.read_text() == "abc"
+
+    def test_cross_device_short_copy_keeps_source(self, tmp_path):
+        src = tmp_path / "src.txt"
+        src.write_text("abc")
+        dest = tmp_path / "dest.txt"
+        replace = mock.Mock(side_effect=OSError(errno.EXDEV, "cross device"))
+        with mock.patch.object(transfer.os, "replace", replace), \
+                mock.patch.object(transfer, "copy_fileobj", return_value=0):
+            try:
+                move_file(src, dest)
+                assert False, "move should fail"
+            except OSError:
+                pass
+        assert src.read_text() == "abc"
+        assert not dest.exists()
+
+
+class TestIterTransfers:
+
+    def test_results(self, tmp_path):
+        (tmp_path / "out").mkdir()
+        transfers = []
+        for i in range(5):
+            src = tmp_path / f"{i}.txt"
+            src.write_text(str(i))
+            transfers.append((src, tmp_path / "out" / src.name))
+        transfers.append((tmp_path / "missing.txt", tmp_path / "out" / "missing.txt"))
+
+        results = list(iter_transfers(transfers, workers=3))
+        assert len(results) == 6
+        errors = [r for r in results if r[4] is not None]
+        assert [r[0].name for r in errors] == ["missing.txt"]
+        assert sorted(p.name for p in (tmp_path / "out").iterdir()) == [f"{i}.txt" for i in range(5)]
+
+    def test_terminate(self, tmp_path):
+        transfers = []
+        for i in range(5):
+            src = tmp_path / f"{i}.txt"
+            src.write_text(str(i))
+            transfers.append((src, tmp_path / f"{i}.out"))
+
+        results = list(iter_transfers(transfers, workers=1, should_terminate=lambda: True))
+        assert len(results) == 1
+
+
+class TestTransferManifest:
+
+    def test_unchanged(self, tmp_path):
+        src = tmp_path / "src.txt"
+        dest = tmp_path / "dest.txt"
+        src.write_text("abc")
+        dest.write_text("abc")
+        manifest = TransferManifest(tmp_path / "manifest.json")
+        manifest.add(src, dest, src.stat(), "digest")
+        manifest.save()
+
+        manifest = TransferManifest(tmp_path / "manifest.json")
+        manifest.load()
+        assert manifest.unchanged(src, dest, src.stat())
+        assert not manifest.unchanged(src, tmp_path / "other.txt", src.stat())
+
+        src.write_text("abcd")
+        assert not manifest.unchanged(src, dest, src.stat())
+
+    def test_prune(self, tmp_path):
+        manifest = TransferManifest()
+        stat = os.stat(tmp_path)
+        manifest.add(tmp_path / "a", tmp_path / "b", stat, "digest")
+        manifest.add(tmp_path / "c", tmp_path / "d", stat, "digest")
+        manifest.prune([tmp_path / "c"])
+        assert list(manifest.files) == [str(tmp_path / "c")]
+
+
+class Mover(TransferFiles):
+
+    def __init__(self, tmp_path, verify=False):
+        self.config = {'workers': 2, 'verify': verify}
+        self.tmp_path = tmp_path
+        self.log_info = mock.Mock()
+        self.log_debug = mock.Mock()
+        self.log_warning = mock.Mock()
+        self.update_progress = mock.Mock()
+        self.should_terminate = mock.Mock(return_value=False)
+
+    def get_config_value(self, section, field):
+        return self.config[field]
+
+    def get_pump_data_path(self, filename=""):
+        return self.tmp_path / filename
+
+
+class TestTransferFiles:
+
+    def test_transfer_files(self, tmp_path):
+        (tmp_path / "out").mkdir()
+        paths = []
+        for i in range(3):
+            paths.append(tmp_path / f"{i}.txt")
+            paths[-1].write_text(str(i))
+
+        mover = Mover(tmp_path)
+        messages = mover.transfer_files(paths, tmp_path / "out", "Copy")
+        assert len(messages) == 3
+        assert all(m.startswith("Copied") for m in messages)
+        assert mover.update_progress.call_args[0][0] == 100
+        assert "MB/s" in mover.update_progress.call_args[0][1]
+        assert all(p.exists() for p in paths)
+        assert len(list((tmp_path / "out").iterdir())) == 3
+
+    def test_verified_copies_skipped(self, tmp_path):
+        (tmp_path / "src").mkdir()
+        (tmp_path / "out").mkdir()
+        paths = []
+        for i in range(3):
+            paths.append(tmp_path / "src" / f"{i}.txt")
+            paths[-1].write_text(str(i))
+
+        mover = Mover(tmp_path, verify=True)
+        assert len(mover.transfer_files(paths, tmp_path / "out", "Copy")) == 3
+        mover.save_manifest(paths)
+        assert (tmp_path / "transfer_manifest.json").exists()
+
+        mover = Mover(tmp_path, verify=True)
+        paths[0].write_text("changed")
+        messages = mover.transfer_files(paths, tmp_path / "out", "Copy")
+        assert messages == [f"Copied {paths[0]} to {tmp_path / 'out' / '0.txt'}"]
+        assert (tmp_path / "out" / "0.txt").read_text() == "changed"
@@ -0,0 +1,232 @@
+import time
+from unittest import mock
+
+import pytest
+
+from qcpump.pumps.common import watcher
+from qcpump.pumps.common.watcher import (
+    DebouncedQueue,
+    DirectoryWatcher,
+    PollingWatcher,
+    WatchDirectories,
+)
+
+
+def wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class TestDebouncedQueue:
+
+    def test_ready_after_delay(self):
+        queue = DebouncedQueue(5)
+        with mock.patch("time.monotonic", return_value=100):
+            queue.add("a")
+        with mock.patch("time.monotonic", return_value=102):
+            queue.add("b")
+            assert not queue.has_ready()
+            assert queue.ready() == []
+        with mock.patch("time.monotonic", return_value=105):
+            assert queue.has_ready()
+            assert queue.ready() == ["a"]
+        with mock.patch("time.monotonic", return_value=110):
+            assert queue.ready() == ["b"]
+        assert len(queue) == 0
+
+    def test_add_resets_delay(self):
+        queue = DebouncedQueue(5)
+        with mock.patch("time.monotonic", return_value=100):
+            queue.add("a")
+        with mock.patch("time.monotonic", return_value=104):
+            queue.add("a")
+        with mock.patch("time.monotonic", return_value=106):
+            assert queue.ready() == []
+        with mock.patch("time.monotonic", return_value=109):
+            assert queue.ready() == ["a"]
+
+    def test_touch_only_restarts_queued(self):
+        queue = DebouncedQueue(5)
+        with mock.patch("time.monotonic", return_value=100):
+            queue.add("a")
+            queue.touch("b")
+        with mock.patch("time.monotonic", return_value=104):
+            queue.touch("a")
+        with mock.patch("time.monotonic", return_value=106):
+            assert queue.ready() == []
+        with mock.patch("time.monotonic", return_value=109):
+            assert queue.ready() == ["a"]
+        assert len(queue) == 0
+
+
+class TestPollingWatcher:
+
+    def test_reports_new_and_modified_files(self, tmp_path):
+        (tmp_path / "old.txt").write_text("old")
+        (tmp_path / "sub").mkdir()
+        on_path = mock.Mock()
+        poller = PollingWatcher(str(tmp_path), True, on_path, mock.Mock())
+
+        poller.poll()
+        on_path.assert_not_called()
+
+        (tmp_path / "sub" / "new.txt").write_text("new")
+        (tmp_path / "old.txt").write_text("modified")
+        poller.poll()
+        assert sorted(c[0][0] for c in on_path.call_args_list) == [
+            str(tmp_path / "old.txt"),
+            str(tmp_path / "sub" / "new.txt"),
+        ]
+
+    def test_not_recursive(self, tmp_path):
+        (tmp_path / "sub").mkdir()
+        on_path = mock.Mock()
+        poller = PollingWatcher(str(tmp_path), False, on_path, mock.Mock())
+        (tmp_path / "sub" / "new.txt").write_text("new")
+        poller.poll()
+        on_path.assert_not_called()
+
+    def test_include_dir(self, tmp_path):
+        (tmp_path / "skip").mkdir()
+        on_path = mock.Mock()
+        poller = PollingWatcher(str(tmp_path), True, on_path, mock.Mock(), lambda p: not p.endswith("skip"))
+        (tmp_path / "skip" / "new.txt").write_text("new")
+        poller.poll()
+        on_path.assert_not_called()
+
+    def test_missing_root(self, tmp_path):
+        with pytest.raises(OSError):
+            PollingWatcher(str(tmp_path / "missing"), True, mock.Mock(), mock.Mock())
+
+
+@pytest.mark.skipif(not watcher.inotify_available(), reason="inotify not available")
+class TestInotifyWatcher:
+
+    def test_reports_written_files(self, tmp_path):
+        dw = DirectoryWatcher([(str(tmp_path), True)], delay=0)
+        assert dw.start() == []
+        try:
+            (tmp_path / "new.txt").write_text("new")
+            (tmp_path / "sub" / "deeper").mkdir(parents=True)
+            (tmp_path / "sub" / "deeper" / "nested.txt").write_text("nested")
+            expected = {tmp_path / "new.txt", tmp_path / "sub" / "deeper" / "nested.txt"}
+            found = set()
+            assert wait_for(lambda: found.update(dw.ready()) or found == expected)
+        finally:
+            dw.stop()
+
+    def test_open_files_not_reported(self, tmp_path):
+        dw = DirectoryWatcher([(str(tmp_path), True)], delay=0.2)
+        assert dw.start() == []
+        try:
+            with (tmp_path / "slow.txt").open("w") as f:
+                for __ in range(6):
+                    f.write("x" * 100)
+                    f.flush()
+                    time.sleep(0.1)
+                    assert dw.ready() == []
+            assert wait_for(lambda: dw.ready() == [tmp_path / "slow.txt"])
+        finally:
+            dw.stop()
+
+    def test_missing_root(self, tmp_path):
+        dw = DirectoryWatcher([(str(tmp_path / "missing"), True)])
+        errors = dw.start()
+        assert len(errors) == 1 and "missing" in errors[0]
+
+
+class Watcher(WatchDirectories):
+
+    def __init__(self, config, roots):
+        self.config = config
+        self.roots = roots
+        self.log_info = mock.Mock()
+        self.log_warning = mock.Mock()
+
+    def get_config_value(self, section, field):
+        return self.config[field]
+
+    def watch_roots(self):
+        return self.roots
+
+
+class TestWatchDirectories:
+
+    def config(self, **kwargs):
+        config = {'enabled': True, 'polling': True, 'poll interval (s)': 30, 'debounce (s)': 0, 'rescan (min)': 60}
+        config.update(kwargs)
+        return config
+
+    def test_disabled(self, tmp_path):
+        w = Watcher(self.config(enabled=False), [(str(tmp_path), False)])
+        assert w.watched_paths() is None
+        assert w.watcher is None
+
+    def test_full_search_then_watched(self, tmp_path):
+        w = Watcher(self.config(), [(str(tmp_path), False)])
+        try:
+            assert w.watched_paths() is None
+            (tmp_path / "new.txt").write_text("new")
+            w.watcher.threads[0].poll()
+            assert w.has_pending_work()
+            assert w.watched_paths() == [tmp_path / "new.txt"]
+            assert w.watched_paths() == []
+        finally:
+            w.stop_watching()
+
+    def test_rescan_due(self, tmp_path):
+        w = Watcher(self.config(), [(str(tmp_path), False)])
+        try:
+            assert w.watched_paths() is None
+            w.last_full_search -= 61 * 60
+            assert w.watched_paths() is None
+            assert w.watched_paths() == []
+        finally:
+            w.stop_watching()
+
+    def test_overflow_forces_full_search(self, tmp_path):
+        w = Watcher(self.config(), [(str(tmp_path), False)])
+        try:
+            assert w.watched_paths() is None
+            w.watcher.rescan_event.set()
+            assert w.watched_paths() is None
+        finally:
+            w.stop_watching()
+
+    def test_poll_interval(self, tmp_path):
+        w = Watcher(self.config(), [(str(tmp_path), False)])
+        try:
+            w.watched_paths()
+            assert w.watcher.threads[0].interval == 30
+            w.config['poll interval (s)'] = 0
+            w.watched_paths()
+            assert w.watcher.threads[0].interval == watcher.DEFAULT_POLL_INTERVAL
+        finally:
+            w.stop_watching()
+
+    def test_config_change_restarts(self, tmp_path):
+        w = Watcher(self.config(), [(str(tmp_path), False)])
+        try:
+            w.watched_paths()
+            first = w.watcher
+            w.roots = [(str(tmp_path), True)]
+            assert w.watched_paths() is None
+            assert w.watcher is not first
+        finally:
+            w.stop_watching()
+
+    def test_filter_watched_paths(self, tmp_path):
+        (tmp_path / "sub").mkdir()
+        for name in ["a.txt", "b.csv", "sub/c.txt"]:
+            (tmp_path / name).write_text("")
+        paths = [tmp_path / n for n in ["a.txt", "b.csv", "sub/c.txt", "missing.txt", "sub"]]
+
+        filtered = WatchDirectories.filter_watched_paths(paths, str(tmp_path), "*.txt", False)
+        assert filtered == [tmp_path / "a.txt"]
+
+        filtered = WatchDirectories.filter_watched_paths(paths, str(tmp_path), "*.txt", True)
+        assert filtered == [tmp_path / "a.txt", tmp_path / "sub" / "c.txt"]
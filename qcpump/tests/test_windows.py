@@ -0,0 +1,79 @@
+import datetime
+
+from qcpump.pumps.common.windows import WindowTracker
+
+dt1 = datetime.datetime(2021, 3, 31, 1, 23, 34)
+
+
+def minutes(n):
+    return dt1 + datetime.timedelta(minutes=n)
+
+
+class TestWindowTracker:
+
+    def test_add_groups_by_window(self):
+        tracker = WindowTracker()
+        assert tracker.add("m1", minutes(0), 1, "a", 5)
+        assert tracker.add("m1", minutes(4), 2, "b", 5)
+        assert tracker.add("m1", minutes(10), 3, "c", 5)
+        assert tracker.add("m2", minutes(1), 4, "d", 5)
+        assert not tracker.add("m1", minutes(0), 1, "a", 5)
+        assert len(tracker) == 3
+
+        assert tracker.flush(0, now=minutes(20)) == [
+            ("m1", "2021-03-31-01-23", ["a", "b"]),
+            ("m1", "2021-03-31-01-33", ["c"]),
+            ("m2", "2021-03-31-01-24", ["d"]),
+        ]
+
+    def test_flush_waits_for_latest_member(self):
+        tracker = WindowTracker()
+        tracker.add("m1", minutes(0), 1, "a", 5)
+        tracker.add("m1", minutes(3), 2, "b", 5)
+        assert tracker.flush(10, now=minutes(12)) == []
+        assert tracker.flush(10, now=minutes(13)) == [("m1", "2021-03-31-01-23", ["a", "b"])]
+
+    def test_members_added_across_flushes(self):
+        tracker = WindowTracker()
+        tracker.add("m1", minutes(0), 1, "a", 5)
+        assert tracker.flush(10, now=minutes(5)) == []
+        tracker.add("m1", minutes(4), 2, "b", 5)
+        assert tracker.flush(10, now=minutes(13)) == []
+        assert tracker.flush(10, now=minutes(14)) == [("m1", "2021-03-31-01-23", ["a", "b"])]
+
+    def test_done(self):
+        tracker = WindowTracker()
+        tracker.add("m1", minutes(0), 1, "a", 5)
+        tracker.flush(0, now=minutes(1))
+        assert tracker.flush(0, now=minutes(1)) == [("m1", "2021-03-31-01-23", ["a"])]
+
+        tracker.done("m1", "2021-03-31-01-23")
+        assert tracker.flush(0, now=minutes(1)) == []
+        assert 1 in tracker
+        assert not tracker.add("m1", minutes(0), 1, "a", 5)
+
+        tracker.prune(minutes(1))
+        assert 1 not in tracker
+
+    def test_prune_failed_windows(self):
+        tracker = WindowTracker()
+        tracker.add("m1", minutes(0), 1, "a", 5)
+        tracker.add("m1", minutes(10), 2, "b", 5)
+        tracker.add("m2", minutes(0), 3, "c", 5)
+        tracker.flush(0, now=minutes(20))
+
+        # windows which were never marked done are dropped once they are too old
+        tracker.prune(minutes(5))
+        assert len(tracker) == 1
+        assert 1 not in tracker and 3 not in tracker
+        assert tracker.flush(0, now=minutes(20)) == [("m1", "2021-03-31-01-33", ["b"])]
+        assert list(tracker.windows) == ["m1"]
+
+    def test_check_config(self):
+        tracker = WindowTracker()
+        tracker.check_config(("tds", 5))
+        tracker.add("m1", minutes(0), 1, "a", 5)
+        tracker.check_config(("tds", 5))
+        assert len(tracker) == 1
+        tracker.check_config(("tds", 10))
+        assert len(tracker) == 0